@@ -25,6 +25,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',  # Búsqueda de texto completo y trigramas
     'corsheaders',
     'rest_framework',
     'inventario',   # Cambia aquí el nombre de la app si la renombras, por ejemplo a 'clientes', 'producto', etc.
@@ -89,6 +90,23 @@ else:
             'PORT': os.environ.get('DB_PORT', '5432'),
         }
     }
+# Cache: compartido entre workers si hay Redis (snapshots del catálogo).
+# Las versiones que invalidan los snapshots viven en la BD (VersionDatos)
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # Validadores de contraseña
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',},
@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.utils import timezone
 from django.utils.html import format_html
-from .models import Categoria, Proveedor, Producto, ProductoImagen, Cliente, Cupon, PromocionProducto, Reclamo, ComentarioReclamo, DireccionEnvio, Pedido, DetallesPedido
+from .models import Categoria, Proveedor, Producto, ProductoImagen, Cliente, Cupon, PromocionProducto, Reclamo, ComentarioReclamo, DireccionEnvio, Pedido, DetallesPedido, TarifaEnvio, MovimientoStock
 
 admin.site.register(Categoria)
 admin.site.register(Proveedor)
@@ -11,6 +11,28 @@ admin.site.register(Cliente)
 admin.site.register(DetallesPedido)
 
 
+@admin.register(TarifaEnvio)
+class TarifaEnvioAdmin(admin.ModelAdmin):
+    list_display = ['region', 'comuna', 'metodo_envio', 'costo', 'activa', 'fecha_actualizacion']
+    list_filter = ['region', 'metodo_envio', 'activa']
+    search_fields = ['comuna']
+
+
+@admin.register(MovimientoStock)
+class MovimientoStockAdmin(admin.ModelAdmin):
+    list_display = ['fecha', 'producto', 'tipo', 'cantidad', 'pedido', 'usuario', 'motivo']
+    list_filter = ['tipo', 'fecha']
+    search_fields = ['producto__nombre', 'producto__sku', 'pedido__numero_pedido']
+    raw_id_fields = ['producto', 'pedido', 'usuario']
+
+    # El registro es de solo inserción: los cambios se hacen con nuevos movimientos
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 class DetallesPedidoInline(admin.TabularInline):
     """Inline para mostrar detalles de pedido en el admin"""
     model = DetallesPedido
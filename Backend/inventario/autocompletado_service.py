@@ -0,0 +1,134 @@
+"""
+Índice de autocompletado de productos en memoria (por worker)
+Elixir - Sistema de Botillería
+"""
+import bisect
+import heapq
+import re
+import threading
+import time
+import unicodedata
+
+from .catalogo_service import incrementar_version, obtener_version
+
+# Versión propia: las ventas (cambios de stock) no invalidan el índice
+CLAVE_VERSION_AUTOCOMPLETADO = 'autocompletado_version'
+# Campos de Producto que contiene el índice; cambiarlos incrementa la versión
+CAMPOS_AUTOCOMPLETADO = ('nombre', 'sku', 'precio', 'activo', 'categoria_id')
+# Reconstrucción máxima aunque no cambie la versión (cambios hechos con update() sin señales)
+INDICE_TTL_SEGUNDOS = 300
+# La versión se consulta como máximo una vez por intervalo, no en cada tecla
+VERIFICACION_VERSION_SEGUNDOS = 2
+
+
+def incrementar_version_autocompletado():
+    """Invalida el índice de todos los workers; lo llaman Producto.save() y las señales de Categoria"""
+    incrementar_version(CLAVE_VERSION_AUTOCOMPLETADO)
+
+
+def normalizar(texto):
+    """Minúsculas y sin acentos, para comparar 'carmenere' con 'Carménère'"""
+    texto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+
+
+class IndiceAutocompletado:
+    """
+    Arreglo ordenado de (token normalizado, producto_id) sobre nombres y SKUs
+    de productos activos. Se construye al primer uso y se reconstruye cuando
+    cambia su versión (nombre, SKU, precio, estado o categoría de algún producto).
+    """
+
+    _lock = threading.Lock()
+    _version = None
+    _construido_en = 0
+    _verificado_en = 0
+    _tokens = []
+    _productos = {}
+
+    @classmethod
+    def _construir(cls):
+        from .models import Producto
+
+        productos = {}
+        tokens = []
+        filas = Producto.objects.filter(activo=True).values(
+            'id', 'nombre', 'sku', 'precio', 'categoria__nombre'
+        )
+        for fila in filas:
+            productos[fila['id']] = {
+                'id': fila['id'],
+                'nombre': fila['nombre'],
+                'sku': fila['sku'],
+                'precio': float(fila['precio']) if fila['precio'] else 0,
+                'categoria': fila['categoria__nombre'],
+                '_nombre_normalizado': normalizar(fila['nombre']),
+            }
+            palabras = set(re.findall(r'\w+', normalizar(fila['nombre'])))
+            palabras.add(normalizar(fila['sku']))
+            tokens.extend((palabra, fila['id']) for palabra in palabras)
+        tokens.sort()
+        return tokens, productos
+
+    @classmethod
+    def _asegurar_actualizado(cls):
+        ahora = time.monotonic()
+        if cls._version is not None and ahora - cls._verificado_en < VERIFICACION_VERSION_SEGUNDOS:
+            return
+        version = obtener_version(CLAVE_VERSION_AUTOCOMPLETADO)
+        cls._verificado_en = ahora
+        vigente = (
+            cls._version == version and
+            time.monotonic() - cls._construido_en < INDICE_TTL_SEGUNDOS
+        )
+        if vigente:
+            return
+        with cls._lock:
+            if cls._version == version and time.monotonic() - cls._construido_en < INDICE_TTL_SEGUNDOS:
+                return
+            tokens, productos = cls._construir()
+            cls._tokens, cls._productos = tokens, productos
+            cls._version = version
+            cls._construido_en = time.monotonic()
+
+    @classmethod
+    def _ids_con_prefijo(cls, tokens, prefijo):
+        ids = set()
+        inicio = bisect.bisect_left(tokens, (prefijo,))
+        for token, producto_id in tokens[inicio:]:
+            if not token.startswith(prefijo):
+                break
+            ids.add(producto_id)
+        return ids
+
+    @classmethod
+    def sugerir(cls, texto, limite=15):
+        """Productos cuyo nombre o SKU contiene palabras que empiezan con cada palabra del texto"""
+        cls._asegurar_actualizado()
+        tokens, productos = cls._tokens, cls._productos
+
+        consulta = normalizar(texto).strip()
+        palabras = re.findall(r'\w+', consulta)
+        if not palabras:
+            return []
+
+        # El SKU completo puede contener guiones: se prueba también como un solo token
+        candidatos = cls._ids_con_prefijo(tokens, consulta)
+        por_palabras = None
+        for palabra in palabras:
+            ids = cls._ids_con_prefijo(tokens, palabra)
+            por_palabras = ids if por_palabras is None else por_palabras & ids
+            if not por_palabras:
+                break
+        candidatos |= por_palabras or set()
+
+        # Primero los nombres que empiezan con el texto, luego orden alfabético
+        resultados = heapq.nsmallest(
+            limite,
+            (productos[producto_id] for producto_id in candidatos),
+            key=lambda p: (not p['_nombre_normalizado'].startswith(consulta), p['_nombre_normalizado'], p['id'])
+        )
+        return [
+            {clave: valor for clave, valor in p.items() if not clave.startswith('_')}
+            for p in resultados
+        ]
@@ -0,0 +1,105 @@
+"""
+Numeración correlativa de boletas POS
+Elixir - Sistema de Botillería
+"""
+import re
+from datetime import datetime
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ContadorBoleta, Pedido
+
+# Formato: BOL-YYYYMMDD-XXXX
+PREFIJO_BOLETA = 'BOL'
+PATRON_BOLETA = re.compile(r'^BOL-(\d{8})-(\d+)$')
+# Máximo de números que un terminal puede reservar de una vez
+BLOQUE_MAXIMO = 100
+
+
+class NumeracionBoletaService:
+    """
+    Entrega correlativos desde una fila contador por día tomada con
+    SELECT ... FOR UPDATE: O(1) y sin colisiones entre terminales.
+    """
+
+    @staticmethod
+    def formatear(fecha, numero):
+        return f"{PREFIJO_BOLETA}-{fecha.strftime('%Y%m%d')}-{str(numero).zfill(4)}"
+
+    @staticmethod
+    def _ultimo_numero_existente(fecha):
+        """Mayor correlativo ya usado en el día (solo al crear el contador, p. ej. tras desplegar)"""
+        ultimo = 0
+        numeros = Pedido.objects.filter(
+            numero_pedido__startswith=f"{PREFIJO_BOLETA}-{fecha.strftime('%Y%m%d')}-"
+        ).values_list('numero_pedido', flat=True)
+        for numero_pedido in numeros:
+            coincidencia = PATRON_BOLETA.match(numero_pedido)
+            if coincidencia:
+                ultimo = max(ultimo, int(coincidencia.group(2)))
+        return ultimo
+
+    @staticmethod
+    def reservar(cantidad=1, fecha=None):
+        """
+        Reserva `cantidad` correlativos consecutivos del día y retorna sus números.
+
+        Conviene llamarlo fuera de la transacción de la venta: el bloqueo de la
+        fila dura solo este incremento y no toda la venta. Si la venta falla el
+        número queda sin usar.
+        """
+        if not 1 <= cantidad <= BLOQUE_MAXIMO:
+            raise ValueError(f'La cantidad de boletas debe estar entre 1 y {BLOQUE_MAXIMO}')
+        fecha = fecha or timezone.localdate()
+
+        with transaction.atomic():
+            if not ContadorBoleta.objects.filter(fecha=fecha).exists():
+                ContadorBoleta.objects.get_or_create(
+                    fecha=fecha,
+                    defaults={'ultimo_numero': NumeracionBoletaService._ultimo_numero_existente(fecha)}
+                )
+            contador = ContadorBoleta.objects.select_for_update().get(fecha=fecha)
+            primero = contador.ultimo_numero + 1
+            contador.ultimo_numero += cantidad
+            contador.save(update_fields=['ultimo_numero'])
+
+        return [NumeracionBoletaService.formatear(fecha, numero) for numero in range(primero, primero + cantidad)]
+
+    @staticmethod
+    def siguiente(fecha=None):
+        """Siguiente número de boleta del día"""
+        return NumeracionBoletaService.reservar(1, fecha)[0]
+
+    @staticmethod
+    def es_reservado(numero_boleta):
+        """Indica si el número tiene el formato de boleta y ya fue entregado por el contador"""
+        coincidencia = PATRON_BOLETA.match(numero_boleta or '')
+        if not coincidencia:
+            return False
+        fecha = datetime.strptime(coincidencia.group(1), '%Y%m%d').date()
+        return ContadorBoleta.objects.filter(
+            fecha=fecha,
+            ultimo_numero__gte=int(coincidencia.group(2))
+        ).exists()
+
+    @staticmethod
+    def reservados(numeros):
+        """Subconjunto de `numeros` ya entregados por el contador (una consulta para todo el lote)"""
+        por_fecha = {}
+        for numero_boleta in numeros:
+            coincidencia = PATRON_BOLETA.match(numero_boleta or '')
+            if coincidencia:
+                fecha = datetime.strptime(coincidencia.group(1), '%Y%m%d').date()
+                por_fecha.setdefault(fecha, []).append((numero_boleta, int(coincidencia.group(2))))
+        if not por_fecha:
+            return set()
+        ultimos = dict(
+            ContadorBoleta.objects.filter(fecha__in=por_fecha).values_list('fecha', 'ultimo_numero')
+        )
+        return {
+            numero_boleta
+            for fecha, numeros_fecha in por_fecha.items()
+            for numero_boleta, numero in numeros_fecha
+            if numero <= ultimos.get(fecha, 0)
+        }
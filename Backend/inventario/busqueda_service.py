@@ -0,0 +1,76 @@
+"""
+Servicio de búsqueda de productos
+Elixir - Sistema de Botillería
+Usa texto completo (tsvector en español sin acentos) y trigramas de PostgreSQL
+"""
+import re
+from django.db import connection
+from django.db.models import Q, F, Value, FloatField, Case, When
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+
+# Configuración de texto creada en la migración 0012 (spanish + unaccent)
+CONFIG_BUSQUEDA = 'es_unaccent'
+
+
+class BusquedaProductoService:
+    """Búsqueda de productos compartida por catálogo, sugerencias, POS y catálogo admin"""
+
+    @staticmethod
+    def _usa_postgres():
+        return connection.vendor == 'postgresql'
+
+    @staticmethod
+    def _consulta_prefijo(termino):
+        """
+        Construye una consulta tsquery donde cada palabra es un prefijo,
+        de modo que 'cerv cris' encuentre 'Cerveza Cristal' mientras se escribe.
+        """
+        palabras = re.findall(r'\w+', termino)
+        if not palabras:
+            return None
+        return SearchQuery(
+            ' & '.join(f'{palabra}:*' for palabra in palabras),
+            config=CONFIG_BUSQUEDA,
+            search_type='raw'
+        )
+
+    @staticmethod
+    def filtro(termino):
+        """Condición Q que selecciona los productos que coinciden con el término"""
+        if not BusquedaProductoService._usa_postgres():
+            return (
+                Q(nombre__icontains=termino) |
+                Q(sku__icontains=termino) |
+                Q(descripcion__icontains=termino)
+            )
+
+        condicion = Q(nombre__trigram_word_similar=termino) | Q(sku__icontains=termino)
+        consulta = BusquedaProductoService._consulta_prefijo(termino)
+        if consulta is not None:
+            condicion |= Q(busqueda_vector=consulta)
+        return condicion
+
+    @staticmethod
+    def anotar_relevancia(queryset, termino):
+        """Agrega la anotación `relevancia` (texto completo + similitud + SKU exacto)"""
+        if not BusquedaProductoService._usa_postgres():
+            return queryset.annotate(relevancia=Value(0.0, output_field=FloatField()))
+
+        relevancia = TrigramWordSimilarity(termino, 'nombre') + Case(
+            When(sku__iexact=termino, then=Value(1.0)),
+            default=Value(0.0),
+            output_field=FloatField()
+        )
+        consulta = BusquedaProductoService._consulta_prefijo(termino)
+        if consulta is not None:
+            relevancia = relevancia + SearchRank(F('busqueda_vector'), consulta)
+        return queryset.annotate(relevancia=relevancia)
+
+    @staticmethod
+    def buscar(queryset, termino):
+        """Filtra el queryset por el término y lo ordena por relevancia"""
+        termino = (termino or '').strip()
+        if not termino:
+            return queryset
+        queryset = queryset.filter(BusquedaProductoService.filtro(termino))
+        return BusquedaProductoService.anotar_relevancia(queryset, termino).order_by('-relevancia', 'id')
@@ -0,0 +1,148 @@
+"""
+Cotización de carritos y token de cotización firmado
+Elixir - Sistema de Botillería
+"""
+import uuid
+from decimal import Decimal
+
+from django.core import signing
+
+from .envio_service import CostoEnvioService
+from .models import Cupon, Producto
+
+COTIZACION_SALT = 'inventario.carrito.cotizacion'
+# Tiempo durante el cual crear_pedido acepta la cotización sin recalcular precios
+COTIZACION_VIGENCIA_SEGUNDOS = 15 * 60
+
+
+class CotizacionInvalida(Exception):
+    """Carrito, cupón o token inválido; el mensaje se puede mostrar al cliente"""
+
+
+class CotizacionService:
+    """Precio de un carrito completo (promociones, cupón y envío) con una sola consulta de productos"""
+
+    @staticmethod
+    def _lineas(items):
+        """Valida los items [{'producto_id', 'cantidad'}] y suma cantidades por producto"""
+        cantidades = {}
+        for item in items:
+            try:
+                producto_id = int(item['producto_id'])
+                cantidad = int(item['cantidad'])
+            except (KeyError, TypeError, ValueError):
+                raise CotizacionInvalida('Cada item requiere producto_id y cantidad numéricos')
+            if cantidad <= 0:
+                raise CotizacionInvalida(f'Cantidad inválida para el producto {producto_id}')
+            cantidades[producto_id] = cantidades.get(producto_id, 0) + cantidad
+        return cantidades
+
+    @staticmethod
+    def cotizar(items, codigo_cupon='', metodo_envio='estandar', region=None, costo_envio=None, comuna=None):
+        """
+        Calcula el detalle y los totales del carrito.
+
+        Si se indica `region` el envío se calcula con CostoEnvioService; si no,
+        se usa `costo_envio` tal como llega (comportamiento previo de crear_pedido).
+        """
+        cantidades = CotizacionService._lineas(items)
+        if not cantidades:
+            raise CotizacionInvalida('El carrito está vacío')
+
+        # Como en el catálogo, los productos inactivos no se pueden cotizar ni pedir
+        productos = Producto.objects.filter(id__in=cantidades, activo=True).only(
+            'id', 'nombre', 'precio', 'stock'
+        ).con_precio_vigente().in_bulk()
+        faltantes = [producto_id for producto_id in cantidades if producto_id not in productos]
+        if faltantes:
+            raise CotizacionInvalida(f"Productos no encontrados o inactivos: {', '.join(map(str, faltantes))}")
+
+        subtotal = Decimal('0')
+        lineas = []
+        for producto_id, cantidad in cantidades.items():
+            producto = productos[producto_id]
+            precio_final = producto.precio_con_descuento()
+            subtotal_item = precio_final * cantidad
+            subtotal += subtotal_item
+            lineas.append({
+                'producto_id': producto.id,
+                'nombre': producto.nombre,
+                'cantidad': cantidad,
+                'precio_original': float(producto.precio),
+                'precio_final': float(precio_final),
+                'subtotal': float(subtotal_item),
+                'stock_disponible': producto.stock >= cantidad,
+            })
+
+        # Aplicar cupón si se proporciona (si no cumple condiciones no se aplica, como antes)
+        codigo_cupon = str(codigo_cupon or '').strip().upper()
+        descuento = Decimal('0')
+        cupon_aplicado = None
+        if codigo_cupon:
+            try:
+                cupon = Cupon.objects.get(codigo=codigo_cupon)
+            except Cupon.DoesNotExist:
+                raise CotizacionInvalida('Cupón no encontrado')
+            if cupon.es_valido() and subtotal >= cupon.monto_minimo:
+                descuento = cupon.calcular_descuento(subtotal)
+                if descuento > 0:
+                    cupon_aplicado = cupon.codigo
+
+        if region:
+            try:
+                envio = Decimal(str(CostoEnvioService.calcular(region, metodo_envio, subtotal, comuna)['costo_envio']))
+            except ValueError as e:
+                raise CotizacionInvalida(str(e))
+        else:
+            envio = Decimal(str(costo_envio or 0))
+
+        total = max(subtotal - descuento + envio, Decimal('0'))
+
+        return {
+            'items': lineas,
+            'subtotal': float(subtotal),
+            'descuento': float(descuento),
+            'cupon_aplicado': cupon_aplicado,
+            'metodo_envio': metodo_envio,
+            'region': region,
+            'comuna': comuna,
+            'costo_envio': float(envio),
+            'total': float(total),
+        }
+
+    @staticmethod
+    def firmar(cotizacion, usuario_id, direccion_envio_id=None):
+        """
+        Token firmado y comprimido que crear_pedido acepta durante COTIZACION_VIGENCIA_SEGUNDOS,
+        ligado al usuario y a la dirección de envío; lleva un id para que se use una sola vez
+        """
+        return signing.dumps(
+            {
+                'usuario_id': str(usuario_id or ''),
+                'direccion_envio_id': str(direccion_envio_id or ''),
+                'cotizacion_id': uuid.uuid4().hex,
+                'cotizacion': cotizacion,
+            },
+            salt=COTIZACION_SALT,
+            compress=True
+        )
+
+    @staticmethod
+    def leer_token(token, usuario_id, direccion_envio_id=None):
+        """
+        Valida firma, vigencia, usuario y dirección del token y retorna la cotización
+        con su `cotizacion_id`, que crear_pedido guarda en el pedido (único)
+        """
+        try:
+            datos = signing.loads(token, salt=COTIZACION_SALT, max_age=COTIZACION_VIGENCIA_SEGUNDOS)
+        except signing.SignatureExpired:
+            raise CotizacionInvalida('La cotización expiró, vuelve a cotizar el carrito')
+        except signing.BadSignature:
+            raise CotizacionInvalida('Cotización inválida')
+        if datos.get('usuario_id') != str(usuario_id or ''):
+            raise CotizacionInvalida('La cotización pertenece a otro usuario')
+        if datos.get('direccion_envio_id') != str(direccion_envio_id or ''):
+            raise CotizacionInvalida('La cotización se calculó para otra dirección de envío, vuelve a cotizar el carrito')
+        if not datos.get('cotizacion_id'):
+            raise CotizacionInvalida('Cotización inválida')
+        return {**datos['cotizacion'], 'cotizacion_id': datos['cotizacion_id']}
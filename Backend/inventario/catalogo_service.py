@@ -0,0 +1,164 @@
+"""
+Versión del catálogo y snapshots cacheados de los endpoints públicos
+Elixir - Sistema de Botillería
+"""
+import json
+import time
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+
+CLAVE_VERSION_CATALOGO = 'catalogo_version'
+# El stock cambia con cada venta: tiene su propia versión para no invalidar los
+# snapshots que no lo muestran
+CLAVE_VERSION_STOCK = 'stock_version'
+# Elementos codificados por fragmento en las respuestas en streaming
+ELEMENTOS_POR_FRAGMENTO = 500
+
+
+def _version_inicial():
+    # Basada en el reloj: una versión nueva no repite ETags entregados antes de crear el contador
+    return int(time.time() * 1000)
+
+
+def obtener_version(clave):
+    """
+    Versión vigente de `clave` (una lectura por clave primaria en VersionDatos).
+
+    La versión se lee de la BD y no del cache: sin Redis cada worker y cada
+    comando tiene su propio LocMemCache y no verían los incrementos de los demás.
+    """
+    from .models import VersionDatos
+
+    version = VersionDatos.objects.filter(clave=clave).values_list('version', flat=True).first()
+    if version is None:
+        version = VersionDatos.objects.get_or_create(
+            clave=clave, defaults={'version': _version_inicial()}
+        )[0].version
+    return version
+
+
+def _incrementar(clave):
+    from .models import VersionDatos
+
+    if not VersionDatos.objects.filter(clave=clave).update(version=F('version') + 1):
+        try:
+            VersionDatos.objects.create(clave=clave, version=_version_inicial())
+        except IntegrityError:
+            VersionDatos.objects.filter(clave=clave).update(version=F('version') + 1)
+
+
+def incrementar_version(clave):
+    """
+    Incrementa la versión de `clave` al confirmar la transacción en curso (de
+    inmediato si no hay una): así la fila del contador no queda bloqueada
+    mientras dura la transacción que originó el cambio.
+    """
+    transaction.on_commit(lambda: _incrementar(clave))
+
+
+def obtener_version_catalogo():
+    """Retorna la versión actual del catálogo"""
+    return obtener_version(CLAVE_VERSION_CATALOGO)
+
+
+def incrementar_version_catalogo():
+    """Incrementa la versión del catálogo; se llama desde las señales de los modelos"""
+    incrementar_version(CLAVE_VERSION_CATALOGO)
+
+
+def obtener_version_stock():
+    """Retorna la versión actual del stock"""
+    return obtener_version(CLAVE_VERSION_STOCK)
+
+
+def incrementar_version_stock():
+    """Incrementa la versión del stock; se llama desde StockService en cada movimiento"""
+    incrementar_version(CLAVE_VERSION_STOCK)
+
+
+def _etag_catalogo(request, nombre, incluye_stock=False):
+    """
+    Retorna (etag, respuesta 304 o None) según el If-None-Match de la solicitud.
+    Con `incluye_stock` el ETag depende también de la versión del stock.
+    """
+    version = obtener_version_catalogo()
+    if incluye_stock:
+        version = f'{version}.{obtener_version_stock()}'
+    # If-None-Match separa ETags con comas: no pueden aparecer dentro de uno ('productos:id,nombre')
+    etag = f'"{nombre.replace(",", "+")}-{version}"'
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+    if etag in [valor.strip() for valor in if_none_match.split(',')]:
+        respuesta = HttpResponseNotModified()
+        respuesta['ETag'] = etag
+        return etag, respuesta
+    return etag, None
+
+
+def respuesta_snapshot(request, nombre, construir, timeout=60 * 60 * 24, incluye_stock=False):
+    """
+    Respuesta JSON cacheada por versión del catálogo, con ETag.
+
+    Si el cliente envía un If-None-Match con la versión vigente se responde 304
+    sin consultar la BD; si no, se usa el payload serializado de esa versión o
+    se construye con `construir()` y se guarda. Los snapshots que muestran el
+    stock deben indicar `incluye_stock`.
+    """
+    etag, no_modificado = _etag_catalogo(request, nombre, incluye_stock)
+    if no_modificado:
+        return no_modificado
+
+    # Las URLs absolutas de imágenes dependen del host de la solicitud
+    clave = f'catalogo_snapshot:{nombre}:{request.scheme}:{request.get_host()}:{etag}'
+    contenido = cache.get(clave)
+    if contenido is None:
+        contenido = json.dumps(construir(), cls=DjangoJSONEncoder)
+        cache.set(clave, contenido, timeout=timeout)
+
+    respuesta = HttpResponse(contenido, content_type='application/json')
+    respuesta['ETag'] = etag
+    respuesta['Cache-Control'] = 'no-cache'
+    return respuesta
+
+
+def lista_json(elementos):
+    """Codifica un iterable como arreglo JSON en fragmentos, sin materializarlo completo"""
+    yield '['
+    separador = ''
+    bloque = []
+    for elemento in elementos:
+        bloque.append(json.dumps(elemento, cls=DjangoJSONEncoder))
+        if len(bloque) >= ELEMENTOS_POR_FRAGMENTO:
+            yield separador + ','.join(bloque)
+            separador = ','
+            bloque = []
+    if bloque:
+        yield separador + ','.join(bloque)
+    yield ']'
+
+
+def objeto_json(claves):
+    """Codifica {clave: iterable} como objeto JSON cuyos valores son arreglos en streaming"""
+    yield '{'
+    for indice, (clave, elementos) in enumerate(claves):
+        yield ('' if indice == 0 else ',') + json.dumps(clave) + ':'
+        yield from lista_json(elementos)
+    yield '}'
+
+
+def respuesta_streaming(request, nombre, fragmentos, incluye_stock=False):
+    """
+    Variante de respuesta_snapshot para volcados completos: el JSON se escribe a
+    medida que se recorre el queryset, sin cachearlo, por lo que la memoria del
+    worker no crece con el tamaño del catálogo. Comparte el ETag del snapshot.
+    """
+    etag, no_modificado = _etag_catalogo(request, nombre, incluye_stock)
+    if no_modificado:
+        return no_modificado
+
+    respuesta = StreamingHttpResponse(fragmentos, content_type='application/json')
+    respuesta['ETag'] = etag
+    respuesta['Cache-Control'] = 'no-cache'
+    return respuesta
@@ -176,6 +176,13 @@ class EmailPedidoService:
         """Envía email cuando el pedido es marcado como entregado."""
         return EmailPedidoService.enviar_confirmacion_pedido(pedido)
     
+    @staticmethod
+    def notifica_estado(estado_anterior, estado_nuevo):
+        """Indica si el cambio de estado tiene un email asociado"""
+        if estado_nuevo == 'pagado':
+            return estado_anterior == 'pendiente'
+        return estado_nuevo in ('en_preparacion', 'enviado', 'entregado')
+
     @staticmethod
     def enviar_notificacion_por_estado(pedido, estado_anterior, estado_nuevo):
         """
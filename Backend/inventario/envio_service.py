@@ -0,0 +1,150 @@
+"""
+Cálculo de costos de envío
+Elixir - Sistema de Botillería
+La tabla de tarifas (región × comuna × método) se arma una vez por worker y
+se reconstruye solo cuando cambian las tarifas editables (TarifaEnvio)
+"""
+from .catalogo_service import incrementar_version, obtener_version
+from .models import METODOS_ENVIO, COSTOS_ENVIO_BASE, TarifaEnvio
+
+TIEMPOS_ESTIMADOS = {
+    'estandar': '3-5 días hábiles',
+    'express': '1-2 días hábiles'
+}
+
+# Descuentos por monto de la compra
+MONTO_ENVIO_GRATIS = 100000  # Envío estándar gratis
+MONTO_DESCUENTO_ENVIO = 50000  # 10% de descuento en el envío
+PORCENTAJE_DESCUENTO_ENVIO = 0.1
+
+CLAVE_VERSION_TARIFAS = 'envio_tarifas_version'
+
+# Costo promedio por método para regiones sin costo definido (fijo, calculado al importar)
+PROMEDIO_POR_METODO = {
+    metodo: sum(costos.get(metodo, 0) for costos in COSTOS_ENVIO_BASE.values()) / len(COSTOS_ENVIO_BASE)
+    for metodo, _ in METODOS_ENVIO
+}
+
+# Tabla en memoria del worker: {(region, comuna, metodo): costo}; comuna '' = toda la región
+_tabla_tarifas = {'version': None, 'tarifas': {}}
+
+
+def _normalizar_comuna(comuna):
+    return (comuna or '').strip().lower()
+
+
+def obtener_version_tarifas():
+    return obtener_version(CLAVE_VERSION_TARIFAS)
+
+
+def incrementar_version_tarifas():
+    """Invalida la tabla de tarifas de todos los workers; se llama desde las señales de TarifaEnvio"""
+    incrementar_version(CLAVE_VERSION_TARIFAS)
+
+
+def _construir_tabla():
+    tarifas = {
+        (region, '', metodo): costo
+        for region, costos in COSTOS_ENVIO_BASE.items()
+        for metodo, costo in costos.items()
+    }
+    # Las tarifas de la base de datos reemplazan a las de COSTOS_ENVIO_BASE
+    for region, comuna, metodo, costo in TarifaEnvio.objects.filter(activa=True).values_list(
+        'region', 'comuna', 'metodo_envio', 'costo'
+    ):
+        tarifas[(region, _normalizar_comuna(comuna), metodo)] = float(costo)
+    return tarifas
+
+
+def obtener_tabla_tarifas():
+    """Tabla de tarifas vigente; cuesta una lectura de la versión salvo cuando esta cambió"""
+    version = obtener_version_tarifas()
+    if _tabla_tarifas['version'] != version:
+        _tabla_tarifas['tarifas'] = _construir_tabla()
+        _tabla_tarifas['version'] = version
+    return _tabla_tarifas['tarifas']
+
+
+class CostoEnvioService:
+    """Costo de envío por región, comuna, método y monto de la compra"""
+
+    @staticmethod
+    def costo_base(region, metodo_envio, comuna=None, tarifas=None):
+        """Tarifa de la comuna, si no la de la región y si no el promedio del método"""
+        tarifas = tarifas if tarifas is not None else obtener_tabla_tarifas()
+        costo = tarifas.get((region, _normalizar_comuna(comuna), metodo_envio))
+        if costo is None:
+            costo = tarifas.get((region, '', metodo_envio))
+        if costo is None:
+            costo = PROMEDIO_POR_METODO.get(metodo_envio, 5000)
+        return costo
+
+    @staticmethod
+    def calcular(region, metodo_envio='estandar', monto_compra=0, comuna=None, tarifas=None):
+        """
+        Retorna el detalle del costo de envío. Lanza ValueError si el método no existe.
+        """
+        if metodo_envio not in dict(METODOS_ENVIO):
+            raise ValueError('Método de envío inválido')
+
+        # Retiro en tienda es gratis
+        if metodo_envio == 'retiro_tienda':
+            return {
+                'costo_envio': 0,
+                'metodo_envio': metodo_envio,
+                'metodo_envio_display': dict(METODOS_ENVIO)[metodo_envio],
+                'tiempo_estimado': 'Inmediato',
+                'mensaje': 'Retiro disponible en tienda física'
+            }
+
+        costo_base = CostoEnvioService.costo_base(region, metodo_envio, comuna, tarifas)
+
+        monto_compra = float(monto_compra)
+        descuento = 0
+        # Compras sobre $100,000: envío estándar gratis
+        if monto_compra >= MONTO_ENVIO_GRATIS and metodo_envio == 'estandar':
+            descuento = costo_base
+        # Compras sobre $50,000: 10% de descuento en el envío
+        elif monto_compra >= MONTO_DESCUENTO_ENVIO:
+            descuento = costo_base * PORCENTAJE_DESCUENTO_ENVIO
+
+        costo_final = max(0, costo_base - descuento)
+
+        return {
+            'costo_envio': costo_final,
+            'costo_base': costo_base,
+            'descuento': descuento,
+            'metodo_envio': metodo_envio,
+            'metodo_envio_display': dict(METODOS_ENVIO)[metodo_envio],
+            'tiempo_estimado': TIEMPOS_ESTIMADOS.get(metodo_envio, '3-5 días'),
+            'region': region,
+            'comuna': comuna
+        }
+
+    @staticmethod
+    def cotizar_direcciones(direcciones, monto_compra=0):
+        """
+        Cotiza todos los métodos de envío para cada dirección, sin consultas
+        adicionales. `direcciones` son DireccionEnvio o dicts con id, region y comuna.
+        """
+        tarifas = obtener_tabla_tarifas()
+        resultado = []
+        for direccion in direcciones:
+            if not isinstance(direccion, dict):
+                direccion = {
+                    'id': direccion.id,
+                    'nombre': direccion.nombre,
+                    'region': direccion.region,
+                    'comuna': direccion.comuna,
+                    'es_principal': direccion.es_principal,
+                }
+            resultado.append({
+                **direccion,
+                'opciones': [
+                    CostoEnvioService.calcular(
+                        direccion['region'], metodo, monto_compra, direccion['comuna'], tarifas
+                    )
+                    for metodo, _ in METODOS_ENVIO
+                ]
+            })
+        return resultado
@@ -0,0 +1,123 @@
+"""
+Claves de idempotencia (header Idempotency-Key) para la creación de pedidos y ventas
+Elixir - Sistema de Botillería
+"""
+import functools
+import hashlib
+import json
+import time
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import SolicitudIdempotente
+
+# Espera máxima de un duplicado mientras el primer intento sigue en proceso
+ESPERA_MAXIMA_SEGUNDOS = 30
+INTERVALO_ESPERA_SEGUNDOS = 0.2
+# Un intento en proceso más antiguo que esto se considera abandonado (worker caído)
+VENCIMIENTO_EN_PROCESO = timedelta(minutes=5)
+# Tiempo que se conservan las respuestas guardadas
+RETENCION_DIAS = 7
+
+
+def _huella(request):
+    """Hash del cuerpo de la solicitud, para detectar la misma clave con otro contenido"""
+    contenido = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+
+
+def _respuesta_guardada(registro):
+    respuesta = Response(registro.respuesta, status=registro.codigo_estado)
+    respuesta['Idempotent-Replayed'] = 'true'
+    return respuesta
+
+
+def _reservar(endpoint, clave, huella):
+    """
+    Registra el intento. Retorna (registro, creado); si ya existía uno vencido
+    en proceso lo reemplaza.
+    """
+    try:
+        return SolicitudIdempotente.objects.create(endpoint=endpoint, clave=clave, huella=huella), True
+    except IntegrityError:
+        registro = SolicitudIdempotente.objects.filter(endpoint=endpoint, clave=clave).first()
+        if registro is None:
+            return _reservar(endpoint, clave, huella)
+        limite = timezone.now() - VENCIMIENTO_EN_PROCESO
+        if registro.estado == 'en_proceso' and registro.fecha_creacion < limite:
+            eliminados, _ = SolicitudIdempotente.objects.filter(
+                pk=registro.pk, estado='en_proceso', fecha_creacion__lt=limite
+            ).delete()
+            if eliminados:
+                return _reservar(endpoint, clave, huella)
+        return registro, False
+
+
+def idempotente(endpoint):
+    """
+    Decorador para vistas POST de DRF. Con header Idempotency-Key:
+    - la primera solicitud se ejecuta y, si responde 2xx, se guarda su respuesta;
+    - las repeticiones reciben la respuesta guardada sin volver a ejecutar la vista;
+    - un duplicado concurrente espera a que termine el primer intento.
+    Las respuestas de error no se guardan: la vista es transaccional y se puede reintentar.
+    """
+    def decorador(vista):
+        @functools.wraps(vista)
+        def envoltura(request, *args, **kwargs):
+            clave = (request.headers.get('Idempotency-Key') or '').strip()
+            if not clave:
+                return vista(request, *args, **kwargs)
+            if len(clave) > 255:
+                return Response({
+                    'success': False,
+                    'message': 'Idempotency-Key no puede superar 255 caracteres'
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            huella = _huella(request)
+            inicio = time.monotonic()
+            while True:
+                registro, creado = _reservar(endpoint, clave, huella)
+                if creado:
+                    break
+                if registro.huella != huella:
+                    return Response({
+                        'success': False,
+                        'message': 'Idempotency-Key ya fue usada con una solicitud distinta'
+                    }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+                if registro.estado == 'completada':
+                    return _respuesta_guardada(registro)
+                if time.monotonic() - inicio >= ESPERA_MAXIMA_SEGUNDOS:
+                    return Response({
+                        'success': False,
+                        'message': 'La solicitud original todavía se está procesando, reintente en unos segundos'
+                    }, status=status.HTTP_409_CONFLICT)
+                time.sleep(INTERVALO_ESPERA_SEGUNDOS)
+
+            try:
+                respuesta = vista(request, *args, **kwargs)
+            except Exception:
+                registro.delete()
+                raise
+
+            if 200 <= respuesta.status_code < 300 and hasattr(respuesta, 'data'):
+                registro.estado = 'completada'
+                registro.codigo_estado = respuesta.status_code
+                registro.respuesta = respuesta.data
+                registro.save(update_fields=['estado', 'codigo_estado', 'respuesta'])
+            else:
+                registro.delete()
+            return respuesta
+        return envoltura
+    return decorador
+
+
+def purgar_vencidas(dias=RETENCION_DIAS):
+    """Elimina los registros de idempotencia más antiguos que `dias`"""
+    limite = timezone.now() - timedelta(days=dias)
+    eliminados, _ = SolicitudIdempotente.objects.filter(fecha_creacion__lt=limite).delete()
+    return eliminados
@@ -0,0 +1,127 @@
+"""
+Derivados de imágenes de productos (miniaturas JPEG y WebP)
+Elixir - Sistema de Botillería
+Se generan fuera del request con el comando generar_derivados_imagenes
+"""
+import hashlib
+import logging
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Tamaño -> (ancho, alto, recortar). 'listado' se recorta a tamaño fijo; el resto conserva proporción
+TAMANOS_DERIVADOS = {
+    'listado': (400, 400, True),
+    'detalle': (800, 800, False),
+    'zoom': (1600, 1600, False),
+}
+CALIDAD_JPEG = 85
+CALIDAD_WEBP = 80
+
+
+class DerivadosImagenService:
+    """Genera miniaturas direccionadas por contenido: el mismo archivo nunca se procesa dos veces"""
+
+    @staticmethod
+    def _hash_contenido(contenido):
+        return hashlib.sha256(contenido).hexdigest()
+
+    @staticmethod
+    def _ruta(hash_contenido, tamano, extension):
+        return f'derivados/{hash_contenido[:2]}/{hash_contenido}/{tamano}.{extension}'
+
+    @staticmethod
+    def _redimensionar(imagen, ancho, alto, recortar):
+        if recortar:
+            return ImageOps.fit(imagen, (ancho, alto), Image.LANCZOS)
+        copia = imagen.copy()
+        copia.thumbnail((ancho, alto), Image.LANCZOS)
+        return copia
+
+    @staticmethod
+    def _codificar(imagen, extension):
+        buffer = BytesIO()
+        if extension == 'jpg':
+            if imagen.mode != 'RGB':
+                fondo = Image.new('RGB', imagen.size, (255, 255, 255))
+                fondo.paste(imagen, mask=imagen.getchannel('A') if 'A' in imagen.getbands() else None)
+                imagen = fondo
+            imagen.save(buffer, format='JPEG', quality=CALIDAD_JPEG, optimize=True, progressive=True)
+        else:
+            imagen.save(buffer, format='WEBP', quality=CALIDAD_WEBP, method=4)
+        return buffer.getvalue()
+
+    @staticmethod
+    def generar(archivo):
+        """
+        Genera (o reutiliza) los derivados de un archivo de imagen.
+        Retorna {tamano: {'url': jpg, 'webp': webp}} con URLs del storage.
+        """
+        archivo.open('rb')
+        try:
+            contenido = archivo.read()
+        finally:
+            archivo.close()
+
+        hash_contenido = DerivadosImagenService._hash_contenido(contenido)
+        rutas = {
+            tamano: {
+                'url': DerivadosImagenService._ruta(hash_contenido, tamano, 'jpg'),
+                'webp': DerivadosImagenService._ruta(hash_contenido, tamano, 'webp'),
+            }
+            for tamano in TAMANOS_DERIVADOS
+        }
+
+        faltantes = [
+            (tamano, formato, ruta)
+            for tamano, formatos in rutas.items()
+            for formato, ruta in formatos.items()
+            if not default_storage.exists(ruta)
+        ]
+        if faltantes:
+            original = ImageOps.exif_transpose(Image.open(BytesIO(contenido)))
+            if original.mode not in ('RGB', 'RGBA'):
+                original = original.convert('RGBA')
+            for tamano, formato, ruta in faltantes:
+                ancho, alto, recortar = TAMANOS_DERIVADOS[tamano]
+                imagen = DerivadosImagenService._redimensionar(original, ancho, alto, recortar)
+                extension = 'jpg' if formato == 'url' else 'webp'
+                default_storage.save(ruta, ContentFile(DerivadosImagenService._codificar(imagen, extension)))
+
+        return {
+            tamano: {formato: default_storage.url(ruta) for formato, ruta in formatos.items()}
+            for tamano, formatos in rutas.items()
+        }
+
+    @staticmethod
+    def procesar_producto(producto):
+        """Genera los derivados de la imagen principal del producto y los guarda"""
+        from .models import Producto
+
+        archivo = producto.archivo_imagen_principal()
+        derivados = {}
+        if archivo:
+            try:
+                derivados = DerivadosImagenService.generar(archivo)
+            except Exception as e:
+                # Cualquier falla (imagen corrupta o demasiado grande, error del storage) deja al
+                # producto sin derivados y fuera de la cola, para no bloquear al resto del lote
+                logger.exception(f"No se pudieron generar derivados del producto {producto.id}: {e}")
+
+        # Si la imagen cambió mientras se generaban los derivados, estos ya no
+        # corresponden: no se guardan y el producto queda pendiente para el próximo lote
+        guardados = Producto.objects.filter(
+            pk=producto.pk,
+            imagen_principal=producto.imagen_principal
+        ).update(
+            imagen_derivados=derivados,
+            derivados_pendientes=False
+        )
+        if not guardados:
+            logger.info(f"La imagen del producto {producto.id} cambió durante el proceso; se reprocesará")
+            return {}
+        return derivados
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from inventario.models import Cupon
+
+
+class Command(BaseCommand):
+    help = 'Consolida los usos de los cupones con contador fragmentado y reparte su cupo restante'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--codigo', help='Código del cupón a configurar o consolidar')
+        parser.add_argument('--fragmentos', type=int, help='Nuevo número de fragmentos del contador (0 = contador único)')
+        parser.add_argument('--loop', action='store_true', help='Quedar en ejecución consolidando periódicamente')
+        parser.add_argument('--intervalo', type=int, default=60, help='Segundos de espera entre consolidaciones con --loop')
+
+    def handle(self, *args, **options):
+        if options['fragmentos'] is not None:
+            if not options['codigo']:
+                raise CommandError('--fragmentos requiere --codigo')
+            if options['fragmentos'] < 0:
+                raise CommandError('--fragmentos no puede ser negativo')
+
+        while True:
+            cupones = Cupon.objects.all()
+            if options['codigo']:
+                cupones = cupones.filter(codigo=options['codigo'].strip().upper())
+                if not cupones.exists():
+                    raise CommandError(f"Cupón {options['codigo']} no encontrado")
+            else:
+                cupones = cupones.filter(fragmentos_contador__gt=0)
+
+            for cupon in cupones:
+                usos = cupon.consolidar_usos(options['fragmentos'])
+                self.stdout.write(self.style.SUCCESS(
+                    f'✓ {cupon.codigo}: {usos}/{cupon.usos_maximos} usos en {cupon.fragmentos_contador} fragmentos'
+                ))
+
+            if not options['loop']:
+                break
+            options['fragmentos'] = None
+            time.sleep(options['intervalo'])
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+from inventario.catalogo_service import incrementar_version_catalogo
+from inventario.imagenes_service import DerivadosImagenService
+from inventario.models import Producto
+
+
+class Command(BaseCommand):
+    help = 'Genera las miniaturas JPEG/WebP de las imágenes de productos pendientes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--todos', action='store_true', help='Regenerar los derivados de todos los productos')
+        parser.add_argument('--lote', type=int, default=50, help='Productos procesados por lote')
+        parser.add_argument('--loop', action='store_true', help='Quedar en ejecución procesando pendientes')
+        parser.add_argument('--intervalo', type=int, default=30, help='Segundos de espera entre revisiones con --loop')
+
+    def handle(self, *args, **options):
+        if options['todos']:
+            Producto.objects.update(derivados_pendientes=True)
+
+        while True:
+            procesados = self.procesar_pendientes(options['lote'])
+            if procesados:
+                self.stdout.write(self.style.SUCCESS(f'✓ Derivados generados para {procesados} productos'))
+            if not options['loop']:
+                break
+            time.sleep(options['intervalo'])
+
+    def procesar_pendientes(self, lote):
+        total = 0
+        while True:
+            productos = list(
+                Producto.objects.filter(derivados_pendientes=True).order_by('id')[:lote]
+            )
+            if not productos:
+                break
+            for producto in productos:
+                derivados = DerivadosImagenService.procesar_producto(producto)
+                estado = '✓' if derivados else '—'
+                self.stdout.write(f'{estado} {producto.nombre}')
+            total += len(productos)
+            # Las URLs de los derivados forman parte de los snapshots del catálogo
+            incrementar_version_catalogo()
+        return total
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+from inventario.outbox_service import OutboxService
+
+
+class Command(BaseCommand):
+    help = 'Procesa los eventos pendientes del outbox (auditoría, logs y emails de pedidos)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=100, help='Eventos procesados por lote')
+        parser.add_argument('--loop', action='store_true', help='Quedar en ejecución procesando eventos')
+        parser.add_argument('--intervalo', type=float, default=1.0, help='Segundos de espera cuando no hay eventos con --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            total = 0
+            while True:
+                procesados = OutboxService.procesar_lote(options['lote'])
+                total += procesados
+                if procesados < options['lote']:
+                    break
+            if total:
+                self.stdout.write(self.style.SUCCESS(f'✓ Eventos procesados: {total}'))
+            if not options['loop']:
+                break
+            time.sleep(options['intervalo'])
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from inventario.idempotencia_service import RETENCION_DIAS, purgar_vencidas
+
+
+class Command(BaseCommand):
+    help = 'Elimina las respuestas guardadas por Idempotency-Key más antiguas que la retención'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=RETENCION_DIAS, help='Días de retención')
+
+    def handle(self, *args, **options):
+        eliminados = purgar_vencidas(options['dias'])
+        self.stdout.write(self.style.SUCCESS(f'✓ Registros de idempotencia eliminados: {eliminados}'))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+
+from inventario.models import Producto
+from inventario.stock_service import StockService
+
+
+class Command(BaseCommand):
+    help = 'Recalcula Producto.stock sumando el registro de movimientos de stock'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--producto', type=int, action='append', help='ID de producto (repetible); por defecto todos')
+        parser.add_argument('--verificar', action='store_true', help='Solo informar diferencias, sin corregir')
+        parser.add_argument('--fecha', help='Mostrar el stock a una fecha (ISO 8601) sin modificar nada')
+
+    def handle(self, *args, **options):
+        producto_ids = options['producto']
+
+        if options['fecha']:
+            fecha = parse_datetime(options['fecha'])
+            if fecha is None:
+                self.stderr.write(self.style.ERROR('Fecha inválida, se espera ISO 8601'))
+                return
+            if timezone.is_naive(fecha):
+                fecha = timezone.make_aware(fecha)
+            stock = StockService.stock_en(fecha, producto_ids)
+            productos = Producto.objects.order_by('id')
+            if producto_ids:
+                productos = productos.filter(id__in=producto_ids)
+            for producto_id, nombre in productos.values_list('id', 'nombre'):
+                self.stdout.write(f'{producto_id}\t{stock.get(producto_id, 0)}\t{nombre}')
+            return
+
+        if options['verificar']:
+            from django.db import transaction
+            with transaction.atomic():
+                diferencias = StockService.reconstruir(producto_ids)
+                transaction.set_rollback(True)
+        else:
+            diferencias = StockService.reconstruir(producto_ids)
+
+        for producto_id, (proyectado, registro) in diferencias.items():
+            self.stdout.write(f'— Producto {producto_id}: stock {proyectado}, registro {registro}')
+
+        if not diferencias:
+            self.stdout.write(self.style.SUCCESS('✓ El stock coincide con el registro de movimientos'))
+        elif options['verificar']:
+            self.stdout.write(self.style.WARNING(f'{len(diferencias)} productos difieren del registro'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'✓ Stock reconstruido para {len(diferencias)} productos'))
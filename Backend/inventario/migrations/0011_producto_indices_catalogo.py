@@ -0,0 +1,25 @@
+# Generated by Django 4.1.7 on 2026-10-18 05:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0010_reportefinanciero_descripcion_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['activo', 'nombre', 'id'], name='inventario__activo_e3a62b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['activo', 'precio', 'id'], name='inventario__activo_dbd120_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['activo', 'fecha_creacion', 'id'], name='inventario__activo_2f78d3_idx'),
+        ),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 4.1.7 on 2026-10-18 05:41
+# Modificado para crear la configuración de texto, el trigger del tsvector y el backfill
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension, UnaccentExtension
+from django.db import migrations
+import django.db.models.functions.text
+
+
+def crear_busqueda_texto(apps, schema_editor):
+    """Crea la configuración es_unaccent, el trigger que mantiene busqueda_vector y lo rellena"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("""
+            DO $$
+            BEGIN
+                IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'es_unaccent') THEN
+                    CREATE TEXT SEARCH CONFIGURATION es_unaccent (COPY = pg_catalog.spanish);
+                    ALTER TEXT SEARCH CONFIGURATION es_unaccent
+                        ALTER MAPPING FOR hword, hword_part, word WITH unaccent, spanish_stem;
+                END IF;
+            END
+            $$;
+        """)
+        cursor.execute("""
+            CREATE OR REPLACE FUNCTION inventario_producto_busqueda_vector() RETURNS trigger AS $$
+            BEGIN
+                NEW.busqueda_vector :=
+                    setweight(to_tsvector('es_unaccent', coalesce(NEW.nombre, '')), 'A') ||
+                    setweight(to_tsvector('simple', coalesce(NEW.sku, '')), 'A') ||
+                    setweight(to_tsvector('es_unaccent', coalesce(NEW.descripcion, '')), 'C');
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql;
+        """)
+        cursor.execute("""
+            DROP TRIGGER IF EXISTS inventario_producto_busqueda_vector_trg ON inventario_producto;
+            CREATE TRIGGER inventario_producto_busqueda_vector_trg
+                BEFORE INSERT OR UPDATE OF nombre, sku, descripcion ON inventario_producto
+                FOR EACH ROW EXECUTE FUNCTION inventario_producto_busqueda_vector();
+        """)
+        # Backfill: el trigger se dispara al reescribir nombre
+        cursor.execute("UPDATE inventario_producto SET nombre = nombre")
+
+
+def eliminar_busqueda_texto(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP TRIGGER IF EXISTS inventario_producto_busqueda_vector_trg ON inventario_producto")
+        cursor.execute("DROP FUNCTION IF EXISTS inventario_producto_busqueda_vector()")
+        cursor.execute("DROP TEXT SEARCH CONFIGURATION IF EXISTS es_unaccent")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0011_producto_indices_catalogo'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        UnaccentExtension(),
+        migrations.AddField(
+            model_name='producto',
+            name='busqueda_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(crear_busqueda_texto, eliminar_busqueda_texto),
+        migrations.AddIndex(
+            model_name='producto',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['busqueda_vector'], name='producto_busqueda_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['nombre'], name='producto_nombre_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('sku'), name='gin_trgm_ops'), name='producto_sku_trgm'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.1.7 on 2026-10-18 05:44
+# Modificado para rellenar imagen_principal en los productos existentes
+
+from django.db import migrations, models
+
+
+def rellenar_imagen_principal(apps, schema_editor):
+    """Misma prioridad que Producto.resolver_imagen_principal"""
+    Producto = apps.get_model('inventario', 'Producto')
+    ProductoImagen = apps.get_model('inventario', 'ProductoImagen')
+
+    primeras = {}
+    for imagen in ProductoImagen.objects.order_by('producto_id', 'orden', 'id'):
+        primeras.setdefault(imagen.producto_id, imagen)
+
+    for producto in Producto.objects.all().iterator():
+        primera = primeras.get(producto.id)
+        if primera and primera.imagen:
+            imagen_principal = primera.imagen.url
+        elif producto.imagen:
+            imagen_principal = producto.imagen.url
+        else:
+            imagen_principal = producto.imagen_url or ''
+        if imagen_principal:
+            Producto.objects.filter(pk=producto.pk).update(imagen_principal=imagen_principal)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0012_producto_busqueda'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='imagen_principal',
+            field=models.CharField(blank=True, default='', editable=False, max_length=500),
+        ),
+        migrations.RunPython(rellenar_imagen_principal, migrations.RunPython.noop),
+    ]
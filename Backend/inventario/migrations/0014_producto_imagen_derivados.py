@@ -0,0 +1,33 @@
+# Generated by Django 4.1.7 on 2026-10-18 05:46
+# Modificado para marcar como pendientes los productos con imagen local
+
+from django.db import migrations, models
+
+
+def marcar_derivados_pendientes(apps, schema_editor):
+    """Los productos con archivo de imagen quedan en cola para generar_derivados_imagenes"""
+    Producto = apps.get_model('inventario', 'Producto')
+    Producto.objects.filter(
+        models.Q(imagenes__isnull=False) | (models.Q(imagen__isnull=False) & ~models.Q(imagen=''))
+    ).update(derivados_pendientes=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0013_producto_imagen_principal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='derivados_pendientes',
+            field=models.BooleanField(db_index=True, default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='imagen_derivados',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(marcar_derivados_pendientes, migrations.RunPython.noop),
+    ]
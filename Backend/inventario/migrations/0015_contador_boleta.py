@@ -0,0 +1,25 @@
+# Generated by Django 4.1.7 on 2026-10-18 05:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0014_producto_imagen_derivados'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContadorBoleta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(unique=True)),
+                ('ultimo_numero', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Contador de Boletas',
+                'verbose_name_plural': 'Contadores de Boletas',
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.1.7 on 2026-10-18 05:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0015_contador_boleta'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cupon',
+            name='fragmentos_contador',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Fragmentos del contador de usos (0 = contador único)'),
+        ),
+        migrations.CreateModel(
+            name='CuponFragmento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('indice', models.PositiveSmallIntegerField()),
+                ('usos', models.PositiveIntegerField(default=0)),
+                ('cupo', models.PositiveIntegerField(default=0)),
+                ('cupon', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fragmentos', to='inventario.cupon')),
+            ],
+            options={
+                'verbose_name': 'Fragmento de Cupón',
+                'verbose_name_plural': 'Fragmentos de Cupones',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='cuponfragmento',
+            constraint=models.UniqueConstraint(fields=('cupon', 'indice'), name='cupon_fragmento_unico'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.1.7 on 2026-10-18 05:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0018_evento_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pedido',
+            name='fecha_captura',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='pedido',
+            name='id_externo',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.1.7 on 2026-10-18 06:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0019_pedido_venta_offline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TarifaEnvio',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('region', models.CharField(choices=[('Arica y Parinacota', 'Arica y Parinacota'), ('Tarapacá', 'Tarapacá'), ('Antofagasta', 'Antofagasta'), ('Atacama', 'Atacama'), ('Coquimbo', 'Coquimbo'), ('Valparaíso', 'Valparaíso'), ('Metropolitana', 'Región Metropolitana de Santiago'), ("O'Higgins", "O'Higgins"), ('Maule', 'Maule'), ('Ñuble', 'Ñuble'), ('Biobío', 'Biobío'), ('Araucanía', 'Araucanía'), ('Los Ríos', 'Los Ríos'), ('Los Lagos', 'Los Lagos'), ('Aysén', 'Aysén'), ('Magallanes', 'Magallanes y la Antártica Chilena')], max_length=50)),
+                ('comuna', models.CharField(blank=True, default='', help_text='Vacía para aplicar a toda la región', max_length=100)),
+                ('metodo_envio', models.CharField(choices=[('estandar', 'Envío Estándar (3-5 días)'), ('express', 'Envío Express (1-2 días)'), ('retiro_tienda', 'Retiro en Tienda (Gratis)')], max_length=20)),
+                ('costo', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('activa', models.BooleanField(default=True)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Tarifa de Envío',
+                'verbose_name_plural': 'Tarifas de Envío',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='tarifaenvio',
+            constraint=models.UniqueConstraint(fields=('region', 'comuna', 'metodo_envio'), name='tarifa_envio_unica'),
+        ),
+    ]
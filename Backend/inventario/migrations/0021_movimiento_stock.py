@@ -0,0 +1,54 @@
+# Generated by Django 4.1.7 on 2026-10-18 06:02
+# Modificado para registrar el stock actual como movimiento inicial
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def registrar_stock_inicial(apps, schema_editor):
+    """Un movimiento 'inicial' por producto para que el registro sume el stock actual"""
+    Producto = apps.get_model('inventario', 'Producto')
+    MovimientoStock = apps.get_model('inventario', 'MovimientoStock')
+    MovimientoStock.objects.bulk_create([
+        MovimientoStock(producto_id=producto_id, tipo='inicial', cantidad=stock, motivo='Stock al crear el registro de movimientos')
+        for producto_id, stock in Producto.objects.exclude(stock=0).values_list('id', 'stock')
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('inventario', '0020_tarifa_envio'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovimientoStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('inicial', 'Stock inicial'), ('venta', 'Venta online'), ('venta_pos', 'Venta POS'), ('ajuste', 'Ajuste'), ('devolucion', 'Devolución'), ('cancelacion', 'Cancelación de pedido')], max_length=20)),
+                ('cantidad', models.IntegerField(help_text='Positiva si ingresa stock, negativa si sale')),
+                ('motivo', models.CharField(blank=True, default='', max_length=255)),
+                ('fecha', models.DateTimeField(default=django.utils.timezone.now)),
+                ('pedido', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movimientos_stock', to='inventario.pedido')),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movimientos_stock', to='inventario.producto')),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movimientos_stock', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Movimiento de Stock',
+                'verbose_name_plural': 'Movimientos de Stock',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='movimientostock',
+            index=models.Index(fields=['producto', 'fecha'], name='inventario__product_fc780a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimientostock',
+            index=models.Index(fields=['fecha'], name='inventario__fecha_87302d_idx'),
+        ),
+        migrations.RunPython(registrar_stock_inicial, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.1.7 on 2026-10-18 06:04
+# Modificado para abrir alertas de los productos que ya tienen stock bajo
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def abrir_alertas_existentes(apps, schema_editor):
+    """Los productos que ya están bajo el mínimo entran a la cola de alertas"""
+    Producto = apps.get_model('inventario', 'Producto')
+    AlertaStockBajo = apps.get_model('inventario', 'AlertaStockBajo')
+    AlertaStockBajo.objects.bulk_create([
+        AlertaStockBajo(producto_id=producto_id, stock=stock, stock_minimo=stock_minimo)
+        for producto_id, stock, stock_minimo in Producto.objects.filter(
+            activo=True, stock__lte=models.F('stock_minimo')
+        ).values_list('id', 'stock', 'stock_minimo')
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0021_movimiento_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertaStockBajo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock', models.IntegerField(help_text='Stock al momento de cruzar el mínimo')),
+                ('stock_minimo', models.IntegerField()),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('resuelta', models.BooleanField(default=False)),
+                ('fecha_resuelta', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Alerta de Stock Bajo',
+                'verbose_name_plural': 'Alertas de Stock Bajo',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(condition=models.Q(('activo', True), ('stock__lte', models.F('stock_minimo'))), fields=['id'], name='producto_stock_bajo_idx'),
+        ),
+        migrations.AddField(
+            model_name='alertastockbajo',
+            name='producto',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alertas_stock', to='inventario.producto'),
+        ),
+        migrations.AddConstraint(
+            model_name='alertastockbajo',
+            constraint=models.UniqueConstraint(condition=models.Q(('resuelta', False)), fields=('producto',), name='alerta_stock_abierta_unica'),
+        ),
+        migrations.RunPython(abrir_alertas_existentes, migrations.RunPython.noop),
+    ]
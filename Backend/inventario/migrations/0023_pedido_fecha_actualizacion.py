@@ -0,0 +1,33 @@
+# Generated by Django 4.1.7 on 2026-10-18 06:05
+# Modificado para inicializar fecha_actualizacion con la fecha del pedido
+
+from django.db import migrations, models
+
+
+def inicializar_fecha_actualizacion(apps, schema_editor):
+    Pedido = apps.get_model('inventario', 'Pedido')
+    Pedido.objects.update(fecha_actualizacion=models.F('fecha_pedido'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0022_alerta_stock_bajo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pedido',
+            name='fecha_actualizacion',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(inicializar_fecha_actualizacion, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['cliente', 'fecha_pedido', 'id'], name='inventario__cliente_adcc11_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['cliente', 'fecha_actualizacion', 'id'], name='inventario__cliente_a71d1a_idx'),
+        ),
+    ]
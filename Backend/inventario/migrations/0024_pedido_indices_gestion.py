@@ -0,0 +1,25 @@
+# Generated by Django 4.1.7 on 2026-10-18 06:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0023_pedido_fecha_actualizacion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['estado', 'fecha_pedido', 'id'], name='inventario__estado_1e1d7a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['vendedor', 'fecha_pedido', 'id'], name='inventario__vendedo_426bcc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['fecha_pedido', 'id'], name='inventario__fecha_p_4c3dcb_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.1.7 on 2026-10-18 06:40
+# Modificado para crear índices de trigramas sobre auth_user (tabla de django.contrib.auth)
+
+from django.db import migrations
+
+# icontains / istartswith en PostgreSQL generan UPPER(campo::text) LIKE UPPER(...);
+# los índices usan la misma expresión para que el planificador los aproveche
+CAMPOS_BUSQUEDA_USUARIO = ('email', 'first_name', 'last_name', 'username')
+
+
+def crear_indices(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        for campo in CAMPOS_BUSQUEDA_USUARIO:
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS auth_user_{campo}_trgm '
+                f'ON auth_user USING gin ((UPPER({campo}::text)) gin_trgm_ops)'
+            )
+
+
+def eliminar_indices(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        for campo in CAMPOS_BUSQUEDA_USUARIO:
+            cursor.execute(f'DROP INDEX IF EXISTS auth_user_{campo}_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('inventario', '0024_pedido_indices_gestion'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indices, eliminar_indices),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 06:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0026_versiondatos'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cupon',
+            name='fragmentos_contador',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, help_text='Fragmentos del contador de usos (0 = contador único)'),
+        ),
+    ]
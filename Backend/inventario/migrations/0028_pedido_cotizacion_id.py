@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 06:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0027_cupon_fragmentos_no_editable'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pedido',
+            name='cotizacion_id',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True, unique=True),
+        ),
+    ]
@@ -1,9 +1,14 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
+from django.db.models.functions import Upper
+from django.core.serializers.json import DjangoJSONEncoder
 import json
 import hashlib
+import random
 
 # Definición de roles
 ROLES = (
@@ -42,6 +47,43 @@ class Proveedor(models.Model):
         verbose_name = "Proveedor"
         verbose_name_plural = "Proveedores"
 
+IMAGEN_PLACEHOLDER = 'https://via.placeholder.com/400x250?text=Sin+imagen'
+
+class ProductoQuerySet(models.QuerySet):
+    def con_precio_vigente(self):
+        """
+        Precarga la promoción vigente de cada producto en una sola consulta.
+        Los métodos de precio del modelo usan esta precarga cuando existe.
+        """
+        return self.prefetch_related(
+            models.Prefetch(
+                'promociones',
+                queryset=PromocionProducto.objects.vigentes(),
+                to_attr='promociones_vigentes'
+            )
+        )
+
+    def con_promociones_entre(self, desde, hasta):
+        """
+        Precarga las promociones activas cuya vigencia se cruza con [desde, hasta],
+        para calcular precios en fechas pasadas (ventas POS capturadas sin conexión)
+        """
+        return self.prefetch_related(
+            models.Prefetch(
+                'promociones',
+                queryset=PromocionProducto.objects.filter(
+                    activa=True,
+                    fecha_inicio__lte=hasta,
+                    fecha_fin__gte=desde
+                ),
+                to_attr='promociones_periodo'
+            )
+        )
+
+    def con_stock_bajo(self):
+        """Productos activos en o bajo su stock mínimo (usa el índice parcial producto_stock_bajo_idx)"""
+        return self.filter(activo=True, stock__lte=models.F('stock_minimo'))
+
 class Producto(models.Model):
     nombre = models.CharField(max_length=200)
     sku = models.CharField(max_length=50, unique=True)
@@ -57,10 +99,126 @@ class Producto(models.Model):
     activo = models.BooleanField(default=True)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     creador = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='productos_creados')
+    # Primera ProductoImagen por orden, luego imagen, luego imagen_url (ver resolver_imagen_principal)
+    imagen_principal = models.CharField(max_length=500, blank=True, default='', editable=False)
+    # Miniaturas JPEG/WebP de la imagen principal, generadas por el comando generar_derivados_imagenes
+    imagen_derivados = models.JSONField(default=dict, blank=True, editable=False)
+    derivados_pendientes = models.BooleanField(default=False, db_index=True, editable=False)
+    # Mantenido por un trigger de PostgreSQL (migración 0012) a partir de nombre, sku y descripción
+    busqueda_vector = SearchVectorField(null=True, blank=True, editable=False)
+
+    objects = ProductoQuerySet.as_manager()
 
     def __str__(self):
         return self.nombre
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        # Stock leído de la BD; save() solo lo escribe si se cambió en memoria
+        instancia._stock_cargado = instancia.__dict__.get('stock')
+        return instancia
+
+    def save(self, *args, **kwargs):
+        if self.imagen and not self.imagen._committed:
+            # Subir el archivo ahora (FileField lo haría recién en super().save()) para que
+            # imagen_principal use el nombre final en upload_to y no el del archivo subido
+            self.imagen.save(self.imagen.name, self.imagen.file, save=False)
+        imagen_principal = self.resolver_imagen_principal()
+        if imagen_principal != self.imagen_principal:
+            # Los derivados anteriores ya no corresponden; el comando los regenera
+            self.imagen_derivados = {}
+            self.derivados_pendientes = bool(self.archivo_imagen_principal())
+        self.imagen_principal = imagen_principal
+
+        # Los cambios de stock hechos editando el producto (admin, formularios) quedan
+        # en el registro de movimientos; ventas y ajustes usan StockService
+        from .autocompletado_service import CAMPOS_AUTOCOMPLETADO, incrementar_version_autocompletado
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not {'stock', 'stock_minimo', 'activo'} & set(update_fields):
+            super().save(*args, **kwargs)
+            if {campo.removesuffix('_id') for campo in CAMPOS_AUTOCOMPLETADO} & set(update_fields):
+                incrementar_version_autocompletado()
+            return
+        from .stock_service import StockService
+        with transaction.atomic():
+            anterior = None
+            if self.pk:
+                anterior = Producto.objects.select_for_update().filter(
+                    pk=self.pk
+                ).values('stock', 'stock_minimo', *CAMPOS_AUTOCOMPLETADO).first()
+            if anterior is None or any(getattr(self, campo) != anterior[campo] for campo in CAMPOS_AUTOCOMPLETADO):
+                incrementar_version_autocompletado()
+            if anterior is not None and self.stock == getattr(self, '_stock_cargado', None):
+                # No se editó el stock: se conserva el actual (bloqueado) y no se
+                # pisa una venta confirmada después de leer el producto
+                self.stock = anterior['stock']
+            self.stock = int(self.stock)
+            self.stock_minimo = int(self.stock_minimo)
+            super().save(*args, **kwargs)
+            diferencia = self.stock - (anterior['stock'] if anterior else 0)
+            if diferencia:
+                MovimientoStock.objects.create(
+                    producto=self,
+                    tipo='inicial' if anterior is None else 'ajuste',
+                    cantidad=diferencia,
+                    motivo='Edición del producto'
+                )
+            StockService.evaluar_alerta(
+                self,
+                estaba_bajo=bool(anterior) and anterior['activo'] and anterior['stock'] <= anterior['stock_minimo']
+            )
+            self._stock_cargado = self.stock
+
+    def archivo_imagen_principal(self):
+        """Archivo local de la imagen principal (None si no hay o es una URL externa)"""
+        primera = self.imagenes.order_by('orden', 'id').first() if self.pk else None
+        if primera and primera.imagen:
+            return primera.imagen
+        if self.imagen:
+            return self.imagen
+        return None
+
+    def resolver_imagen_principal(self):
+        """Calcula la imagen principal: primera ProductoImagen, luego imagen, luego imagen_url"""
+        archivo = self.archivo_imagen_principal()
+        if archivo:
+            return archivo.url
+        return self.imagen_url or ''
+
+    def obtener_url_imagen(self, request=None):
+        """URL absoluta de la imagen principal ya materializada (sin consultas)"""
+        imagen = self.imagen_principal
+        if not imagen:
+            return IMAGEN_PLACEHOLDER
+        if imagen.startswith(('http://', 'https://')) or request is None:
+            return imagen
+        return request.build_absolute_uri(imagen)
+
+    def obtener_urls_derivados(self, request=None):
+        """
+        URLs por tamaño ({'listado': {'url', 'webp'}, ...}). Mientras no existan
+        derivados se usa la imagen principal en todos los tamaños y webp es None.
+        """
+        from .imagenes_service import TAMANOS_DERIVADOS
+
+        def absoluta(url):
+            if not url or url.startswith(('http://', 'https://')) or request is None:
+                return url
+            return request.build_absolute_uri(url)
+
+        if self.imagen_derivados:
+            return {
+                tamano: {
+                    'url': absoluta(self.imagen_derivados[tamano].get('url')),
+                    'webp': absoluta(self.imagen_derivados[tamano].get('webp')),
+                }
+                for tamano in TAMANOS_DERIVADOS if tamano in self.imagen_derivados
+            }
+        original = self.obtener_url_imagen(request)
+        return {tamano: {'url': original, 'webp': None} for tamano in TAMANOS_DERIVADOS}
+
     @property
     def margen_ganancia(self):
         if self.costo > 0:
@@ -73,38 +231,64 @@ class Producto(models.Model):
     
     def tiene_promocion_activa(self):
         """Verifica si el producto tiene una promoción activa"""
-        ahora = timezone.now()
-        return self.promociones.filter(
-            activa=True,
-            fecha_inicio__lte=ahora,
-            fecha_fin__gte=ahora
-        ).exists()
+        if hasattr(self, 'promociones_vigentes'):
+            return bool(self.promociones_vigentes)
+        return self.promociones.vigentes().exists()
     
-    def obtener_promocion_activa(self):
-        """Obtiene la promoción activa del producto si existe"""
-        ahora = timezone.now()
-        return self.promociones.filter(
-            activa=True,
-            fecha_inicio__lte=ahora,
-            fecha_fin__gte=ahora
-        ).first()
+    def obtener_promocion_activa(self, ahora=None):
+        """Obtiene la promoción activa del producto si existe (en `ahora` si se indica)"""
+        if ahora is not None:
+            if hasattr(self, 'promociones_periodo'):
+                return next((p for p in self.promociones_periodo if p.esta_vigente(ahora)), None)
+            return self.promociones.vigentes(ahora).first()
+        if hasattr(self, 'promociones_vigentes'):
+            return self.promociones_vigentes[0] if self.promociones_vigentes else None
+        return self.promociones.vigentes().first()
     
-    def precio_con_descuento(self):
-        """Retorna el precio con descuento si hay promoción activa, sino el precio normal"""
-        promocion = self.obtener_promocion_activa()
+    def precio_con_descuento(self, ahora=None):
+        """Retorna el precio con descuento si hay promoción activa (en `ahora` si se indica), sino el precio normal"""
+        promocion = self.obtener_promocion_activa(ahora)
         if promocion:
-            return promocion.calcular_precio_con_descuento()
+            return promocion.calcular_precio_con_descuento(ahora)
         return self.precio
 
     class Meta:
         verbose_name = "Producto"
         verbose_name_plural = "Productos"
+        indexes = [
+            # Claves de paginación por cursor del catálogo: (orden, id)
+            models.Index(fields=['activo', 'nombre', 'id']),
+            models.Index(fields=['activo', 'precio', 'id']),
+            models.Index(fields=['activo', 'fecha_creacion', 'id']),
+            # Búsqueda de texto completo y por trigramas (ver busqueda_service.py)
+            GinIndex(fields=['busqueda_vector'], name='producto_busqueda_gin'),
+            GinIndex(fields=['nombre'], opclasses=['gin_trgm_ops'], name='producto_nombre_trgm'),
+            GinIndex(OpClass(Upper('sku'), name='gin_trgm_ops'), name='producto_sku_trgm'),
+            # Solo contiene los productos con stock bajo: contarlos no recorre el catálogo
+            models.Index(
+                fields=['id'],
+                condition=models.Q(activo=True, stock__lte=models.F('stock_minimo')),
+                name='producto_stock_bajo_idx'
+            ),
+        ]
 
 class ProductoImagen(models.Model):
     producto = models.ForeignKey('Producto', related_name='imagenes', on_delete=models.CASCADE)
     imagen = models.ImageField(upload_to='productos/')
     orden = models.PositiveIntegerField(default=0)
 
+    def actualizar_imagen_principal_producto(self):
+        """Recalcula Producto.imagen_principal tras agregar, cambiar o quitar una imagen"""
+        producto = Producto.objects.filter(pk=self.producto_id).first()
+        if producto:
+            imagen_principal = producto.resolver_imagen_principal()
+            if imagen_principal != producto.imagen_principal:
+                Producto.objects.filter(pk=producto.pk).update(
+                    imagen_principal=imagen_principal,
+                    imagen_derivados={},
+                    derivados_pendientes=bool(producto.archivo_imagen_principal())
+                )
+
     class Meta:
         ordering = ['orden']
 
@@ -216,6 +400,28 @@ COSTOS_ENVIO_BASE = {
     'Magallanes': {'estandar': 15000, 'express': 22000},
 }
 
+class TarifaEnvio(models.Model):
+    """
+    Tarifa editable que reemplaza el costo de COSTOS_ENVIO_BASE para una región
+    completa (comuna vacía) o para una comuna específica.
+    """
+    region = models.CharField(max_length=50, choices=REGIONES_CHILE)
+    comuna = models.CharField(max_length=100, blank=True, default='', help_text="Vacía para aplicar a toda la región")
+    metodo_envio = models.CharField(max_length=20, choices=METODOS_ENVIO)
+    costo = models.DecimalField(max_digits=10, decimal_places=2)
+    activa = models.BooleanField(default=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.region} {self.comuna or '(toda la región)'} - {self.metodo_envio}: ${self.costo}"
+
+    class Meta:
+        verbose_name = "Tarifa de Envío"
+        verbose_name_plural = "Tarifas de Envío"
+        constraints = [
+            models.UniqueConstraint(fields=['region', 'comuna', 'metodo_envio'], name='tarifa_envio_unica'),
+        ]
+
 class Pedido(models.Model):
     # Modelo que coincide con la estructura REAL de inventario_pedido en Railway
     numero_pedido = models.CharField(max_length=50, unique=True)
@@ -238,6 +444,8 @@ class Pedido(models.Model):
     ], default='transferencia')
     notas = models.TextField(blank=True, null=True)
     fecha_pedido = models.DateTimeField(auto_now_add=True)
+    # Última modificación; los clientes sincronizan su historial desde aquí (mis_pedidos?desde=)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
     fecha_entrega_estimada = models.DateField(blank=True, null=True)
     fecha_entrega_real = models.DateField(blank=True, null=True)
     cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE, related_name='pedidos')
@@ -245,6 +453,11 @@ class Pedido(models.Model):
     direccion_envio = models.ForeignKey(DireccionEnvio, on_delete=models.SET_NULL, null=True, blank=True, related_name='pedidos')
     metodo_envio = models.CharField(max_length=20, choices=METODOS_ENVIO, blank=True, null=True)
     costo_envio = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Ventas POS capturadas sin conexión: id generado por el terminal y hora de la venta en el terminal
+    id_externo = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    fecha_captura = models.DateTimeField(null=True, blank=True)
+    # Id de la cotización firmada con que se creó; único para que cada cotización se use una sola vez
+    cotizacion_id = models.CharField(max_length=32, unique=True, null=True, blank=True, editable=False)
 
     def __str__(self):
         return f"Pedido {self.numero_pedido} - {self.cliente.user.email}"
@@ -284,6 +497,15 @@ class Pedido(models.Model):
         ordering = ['-fecha_pedido']
         verbose_name = "Pedido"
         verbose_name_plural = "Pedidos"
+        indexes = [
+            # Historial del cliente (paginado) y sincronización incremental (mis_pedidos)
+            models.Index(fields=['cliente', 'fecha_pedido', 'id']),
+            models.Index(fields=['cliente', 'fecha_actualizacion', 'id']),
+            # Listado de gestión paginado por (fecha_pedido, id), con o sin filtro de estado / vendedor
+            models.Index(fields=['estado', 'fecha_pedido', 'id']),
+            models.Index(fields=['vendedor', 'fecha_pedido', 'id']),
+            models.Index(fields=['fecha_pedido', 'id']),
+        ]
 
 class DetallesPedido(models.Model):
     # Modelo que coincide con la tabla inventario_detallespedido existente en Railway
@@ -304,6 +526,149 @@ class DetallesPedido(models.Model):
         verbose_name = "Detalle de Pedido"
         verbose_name_plural = "Detalles de Pedidos"
 
+class MovimientoStock(models.Model):
+    """
+    Registro inmutable de cada cambio de stock. Producto.stock es la proyección
+    (suma) de estos movimientos; el comando reconstruir_stock la recalcula.
+    """
+    TIPOS = (
+        ('inicial', 'Stock inicial'),
+        ('venta', 'Venta online'),
+        ('venta_pos', 'Venta POS'),
+        ('ajuste', 'Ajuste'),
+        ('devolucion', 'Devolución'),
+        ('cancelacion', 'Cancelación de pedido'),
+    )
+
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='movimientos_stock')
+    tipo = models.CharField(max_length=20, choices=TIPOS)
+    cantidad = models.IntegerField(help_text="Positiva si ingresa stock, negativa si sale")
+    pedido = models.ForeignKey(Pedido, on_delete=models.SET_NULL, null=True, blank=True, related_name='movimientos_stock')
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='movimientos_stock')
+    motivo = models.CharField(max_length=255, blank=True, default='')
+    fecha = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} {self.cantidad:+d} - {self.producto_id}"
+
+    class Meta:
+        verbose_name = "Movimiento de Stock"
+        verbose_name_plural = "Movimientos de Stock"
+        indexes = [
+            models.Index(fields=['producto', 'fecha']),
+            models.Index(fields=['fecha']),
+        ]
+
+class AlertaStockBajo(models.Model):
+    """
+    Cola de productos que cruzaron su stock mínimo. Se crea al cruzar hacia
+    abajo y se resuelve sola cuando el stock vuelve a superar el mínimo.
+    """
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='alertas_stock')
+    stock = models.IntegerField(help_text="Stock al momento de cruzar el mínimo")
+    stock_minimo = models.IntegerField()
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    resuelta = models.BooleanField(default=False)
+    fecha_resuelta = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Stock bajo: {self.producto_id} ({self.stock}/{self.stock_minimo})"
+
+    class Meta:
+        verbose_name = "Alerta de Stock Bajo"
+        verbose_name_plural = "Alertas de Stock Bajo"
+        constraints = [
+            # Una sola alerta abierta por producto
+            models.UniqueConstraint(
+                fields=['producto'],
+                condition=models.Q(resuelta=False),
+                name='alerta_stock_abierta_unica'
+            ),
+        ]
+
+class SolicitudIdempotente(models.Model):
+    """Respuesta guardada de un POST con header Idempotency-Key (ver idempotencia_service.py)"""
+    ESTADOS = (
+        ('en_proceso', 'En proceso'),
+        ('completada', 'Completada'),
+    )
+
+    endpoint = models.CharField(max_length=50)
+    clave = models.CharField(max_length=255)
+    huella = models.CharField(max_length=64, help_text="SHA-256 del cuerpo de la solicitud")
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='en_proceso')
+    codigo_estado = models.PositiveSmallIntegerField(null=True, blank=True)
+    respuesta = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    fecha_creacion = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.endpoint} {self.clave} ({self.estado})"
+
+    class Meta:
+        verbose_name = "Solicitud Idempotente"
+        verbose_name_plural = "Solicitudes Idempotentes"
+        constraints = [
+            models.UniqueConstraint(fields=['endpoint', 'clave'], name='solicitud_idempotente_unica'),
+        ]
+
+class EventoOutbox(models.Model):
+    """
+    Efecto secundario pendiente (auditoría, log, email) escrito en la misma
+    transacción que lo origina; lo ejecuta el comando procesar_outbox.
+    """
+    ESTADOS = (
+        ('pendiente', 'Pendiente'),
+        ('procesado', 'Procesado'),
+        ('fallido', 'Fallido'),
+    )
+
+    tipo = models.CharField(max_length=50)
+    datos = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='pendiente')
+    intentos = models.PositiveSmallIntegerField(default=0)
+    proximo_intento = models.DateTimeField(default=timezone.now)
+    ultimo_error = models.TextField(blank=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_procesado = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.tipo} #{self.id} ({self.estado})"
+
+    class Meta:
+        verbose_name = "Evento Outbox"
+        verbose_name_plural = "Eventos Outbox"
+        indexes = [
+            models.Index(fields=['estado', 'proximo_intento', 'id']),
+        ]
+
+class ContadorBoleta(models.Model):
+    """Último correlativo de boleta POS entregado por día (ver boleta_service.py)"""
+    fecha = models.DateField(unique=True)
+    ultimo_numero = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Boletas {self.fecha}: {self.ultimo_numero}"
+
+    class Meta:
+        verbose_name = "Contador de Boletas"
+        verbose_name_plural = "Contadores de Boletas"
+
+class VersionDatos(models.Model):
+    """
+    Contador de versión de datos cacheados (catálogo, tarifas de envío, autocompletado).
+    Vive en la BD para que todos los workers y comandos vean la misma versión
+    aunque el cache no sea compartido (ver catalogo_service.py).
+    """
+    clave = models.CharField(max_length=50, primary_key=True)
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.clave}: {self.version}"
+
+    class Meta:
+        verbose_name = "Versión de Datos"
+        verbose_name_plural = "Versiones de Datos"
+
 # Modelo para Auditoría del Sistema (HU 20)
 class AuditLog(models.Model):
     ACCIONES = (
@@ -327,7 +692,8 @@ class AuditLog(models.Model):
         ('SolicitudAutorizacion', 'Solicitud de Autorización'),
     )
 
-    fecha = models.DateTimeField(auto_now_add=True, db_index=True)
+    # default y no auto_now_add: el outbox registra la fecha en que ocurrió la acción, no la de su proceso
+    fecha = models.DateTimeField(default=timezone.now, editable=False, db_index=True)
     usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='audit_logs')
     tipo_accion = models.CharField(max_length=50, choices=ACCIONES, db_index=True)
     modelo = models.CharField(max_length=50, choices=MODELOS, db_index=True)
@@ -479,9 +845,11 @@ class SolicitudAutorizacion(models.Model):
             producto = self.producto_afectado
             nuevo_stock = self.datos_nuevos.get('stock')
             if nuevo_stock is not None:
-                old_stock = producto.stock
-                producto.stock = nuevo_stock
-                producto.save()
+                from .stock_service import StockService
+                old_stock, _ = StockService.ajustar(
+                    producto.id, nuevo_stock, usuario=self.aprobador,
+                    motivo=f"Solicitud de autorización {self.id}"
+                )
                 AuditLog.registrar_cambio(
                     usuario=self.aprobador,
                     tipo_accion='ACTUALIZACION_STOCK_AUTOMATICA',
@@ -732,17 +1100,28 @@ class Cupon(models.Model):
     monto_minimo = models.DecimalField(max_digits=10, decimal_places=2, default=0, help_text="Monto mínimo de compra para aplicar el cupón")
     creado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='cupones_creados')
     fecha_creacion = models.DateTimeField(auto_now_add=True)
+    # Con N > 0 los usos se cuentan en N filas CuponFragmento (cupones muy usados); ver consolidar_usos
+    # Solo lo cambia consolidar_usos, que crea las filas correspondientes (no editable en admin ni formularios)
+    fragmentos_contador = models.PositiveSmallIntegerField(default=0, editable=False, help_text="Fragmentos del contador de usos (0 = contador único)")
     
     def __str__(self):
         return f"{self.codigo} - {self.get_tipo_descuento_display()}"
     
+    def usos_registrados(self):
+        """Usos vigentes: con fragmentos, la suma de sus filas (usos_actuales solo se actualiza al consolidar)"""
+        if self.fragmentos_contador:
+            return CuponFragmento.objects.filter(cupon_id=self.pk).aggregate(
+                total=models.Sum('usos')
+            )['total'] or 0
+        return self.usos_actuales
+
     def es_valido(self):
         """Verifica si el cupón es válido para usar"""
         ahora = timezone.now()
         return (
             self.activo and
             self.fecha_inicio <= ahora <= self.fecha_fin and
-            self.usos_actuales < self.usos_maximos
+            self.usos_registrados() < self.usos_maximos
         )
     
     def calcular_descuento(self, monto_total):
@@ -765,12 +1144,80 @@ class Cupon(models.Model):
         return Decimal('0')
     
     def usar(self):
-        """Incrementa el contador de usos"""
-        if self.usos_actuales < self.usos_maximos:
+        """
+        Registra un uso si quedan disponibles, con un UPDATE condicional en vez de
+        leer, sumar y guardar. Dentro de la transacción del checkout el uso se
+        revierte si la compra falla. Retorna False si el cupón está agotado.
+        """
+        fragmentos = self.fragmentos_contador
+        # Si consolidar_usos cambió la cantidad de fragmentos después de leer el cupón,
+        # el UPDATE no toca el contador viejo y se reintenta con el modo vigente
+        for _ in range(3):
+            if fragmentos:
+                usado = self._usar_fragmento(fragmentos)
+            else:
+                usado = bool(
+                    Cupon.objects.filter(
+                        pk=self.pk, fragmentos_contador=0, usos_actuales__lt=models.F('usos_maximos')
+                    ).update(usos_actuales=models.F('usos_actuales') + 1)
+                )
+            if usado:
+                break
+            vigentes = Cupon.objects.filter(pk=self.pk).values_list('fragmentos_contador', flat=True).first()
+            if vigentes is None or vigentes == fragmentos:
+                break
+            fragmentos = vigentes
+        self.fragmentos_contador = fragmentos
+        if usado:
             self.usos_actuales += 1
-            self.save()
-            return True
+        return usado
+
+    def _usar_fragmento(self, fragmentos):
+        """Incrementa un fragmento con cupo disponible, elegido al azar para repartir la contención"""
+        indices = list(range(fragmentos))
+        random.shuffle(indices)
+        for indice in indices:
+            actualizados = CuponFragmento.objects.filter(
+                cupon_id=self.pk, indice=indice, usos__lt=models.F('cupo')
+            ).update(usos=models.F('usos') + 1)
+            if actualizados:
+                return True
         return False
+
+    def consolidar_usos(self, fragmentos=None):
+        """
+        Suma los usos de los fragmentos en usos_actuales y reparte el cupo restante
+        (usos_maximos - usos) entre `fragmentos` filas; con 0 vuelve al contador único.
+        Las filas se actualizan en su lugar para no invalidar usos concurrentes.
+        """
+        with transaction.atomic():
+            cupon = Cupon.objects.select_for_update().get(pk=self.pk)
+            existentes = list(
+                CuponFragmento.objects.select_for_update().filter(cupon=cupon).order_by('indice')
+            )
+            usos = sum(f.usos for f in existentes) if cupon.fragmentos_contador else cupon.usos_actuales
+            fragmentos = cupon.fragmentos_contador if fragmentos is None else fragmentos
+
+            por_indice = {f.indice: f for f in existentes}
+            restante = max(cupon.usos_maximos - usos, 0)
+            activos = []
+            for indice in range(fragmentos):
+                fragmento = por_indice.pop(indice, None) or CuponFragmento(cupon=cupon, indice=indice)
+                # Los usos acumulados quedan en el fragmento 0
+                fragmento.usos = usos if indice == 0 else 0
+                fragmento.cupo = fragmento.usos + restante // fragmentos + (1 if indice < restante % fragmentos else 0)
+                activos.append(fragmento)
+            CuponFragmento.objects.filter(pk__in=[f.pk for f in por_indice.values()]).delete()
+            CuponFragmento.objects.bulk_create([f for f in activos if f.pk is None])
+            CuponFragmento.objects.bulk_update([f for f in activos if f.pk is not None], ['usos', 'cupo'])
+
+            cupon.usos_actuales = usos
+            cupon.fragmentos_contador = fragmentos
+            cupon.save(update_fields=['usos_actuales', 'fragmentos_contador'])
+
+        self.usos_actuales = usos
+        self.fragmentos_contador = fragmentos
+        return usos
     
     class Meta:
         verbose_name = "Cupón"
@@ -782,6 +1229,35 @@ class Cupon(models.Model):
         ]
 
 
+class CuponFragmento(models.Model):
+    """Parte del contador de usos de un cupón fragmentado; cada fila admite hasta `cupo` usos"""
+    cupon = models.ForeignKey(Cupon, on_delete=models.CASCADE, related_name='fragmentos')
+    indice = models.PositiveSmallIntegerField()
+    usos = models.PositiveIntegerField(default=0)
+    cupo = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.cupon.codigo} #{self.indice}: {self.usos}/{self.cupo}"
+
+    class Meta:
+        verbose_name = "Fragmento de Cupón"
+        verbose_name_plural = "Fragmentos de Cupones"
+        constraints = [
+            models.UniqueConstraint(fields=['cupon', 'indice'], name='cupon_fragmento_unico'),
+        ]
+
+
+class PromocionProductoQuerySet(models.QuerySet):
+    def vigentes(self, ahora=None):
+        """Promociones activas cuya vigencia incluye el instante indicado"""
+        ahora = ahora or timezone.now()
+        return self.filter(
+            activa=True,
+            fecha_inicio__lte=ahora,
+            fecha_fin__gte=ahora
+        )
+
+
 class PromocionProducto(models.Model):
     producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='promociones')
     descuento_porcentaje = models.DecimalField(max_digits=5, decimal_places=2, help_text="Descuento en porcentaje (0-100)")
@@ -791,20 +1267,22 @@ class PromocionProducto(models.Model):
     descripcion = models.TextField(blank=True, help_text="Descripción de la promoción")
     creado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='promociones_creadas')
     fecha_creacion = models.DateTimeField(auto_now_add=True)
+
+    objects = PromocionProductoQuerySet.as_manager()
     
     def __str__(self):
         return f"{self.producto.nombre} - {self.descuento_porcentaje}% OFF"
     
-    def esta_vigente(self):
-        """Verifica si la promoción está vigente"""
-        ahora = timezone.now()
+    def esta_vigente(self, ahora=None):
+        """Verifica si la promoción está vigente (ahora o en el instante indicado)"""
+        ahora = ahora or timezone.now()
         return self.activa and self.fecha_inicio <= ahora <= self.fecha_fin
     
-    def calcular_precio_con_descuento(self):
+    def calcular_precio_con_descuento(self, ahora=None):
         """Calcula el precio del producto con el descuento aplicado"""
         from decimal import Decimal
         
-        if not self.esta_vigente():
+        if not self.esta_vigente(ahora):
             return self.producto.precio
         
         descuento = (self.producto.precio * self.descuento_porcentaje) / Decimal('100')
@@ -0,0 +1,220 @@
+"""
+Outbox transaccional para los efectos secundarios del checkout
+Elixir - Sistema de Botillería
+Los eventos se escriben junto con el pedido y se procesan fuera del request
+"""
+import logging
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import AuditLog, EventoOutbox, LogSistema, Pedido
+
+logger = logging.getLogger(__name__)
+
+MAX_INTENTOS = 8
+# Espera entre reintentos: 30 s, 1 min, 2 min, ... hasta 1 hora
+ESPERA_BASE_SEGUNDOS = 30
+ESPERA_MAXIMA_SEGUNDOS = 60 * 60
+# Un lote tomado queda arrendado este tiempo: si el worker se cae, otro lo retoma al vencer
+ARRIENDO_SEGUNDOS = 5 * 60
+# No se empieza un envío (timeout HTTP de 30 s) cuando al arriendo le queda menos que esto
+MARGEN_ARRIENDO_SEGUNDOS = 60
+
+
+class OutboxService:
+    """Registro y procesamiento por lotes de eventos del outbox"""
+
+    @staticmethod
+    def registrar(tipo, **datos):
+        """Agrega un evento; llamarlo dentro de la transacción que origina el efecto"""
+        datos.setdefault('fecha_evento', timezone.now().isoformat())
+        return EventoOutbox(tipo=tipo, datos=datos)
+
+    @staticmethod
+    def guardar(*eventos):
+        """Inserta los eventos registrados en un solo INSERT"""
+        return EventoOutbox.objects.bulk_create(eventos)
+
+    # ---- Manejadores por tipo ----
+
+    @staticmethod
+    def _usuarios(eventos):
+        ids = {e.datos.get('usuario_id') for e in eventos if e.datos.get('usuario_id')}
+        return User.objects.in_bulk(ids)
+
+    @staticmethod
+    def _fecha_evento(evento):
+        """Momento en que se registró el evento (no el de su proceso, que puede llegar tarde)"""
+        return parse_datetime(evento.datos.get('fecha_evento') or '') or evento.fecha_creacion
+
+    @staticmethod
+    def _procesar_auditoria(eventos):
+        """Inserta todos los registros de auditoría del lote juntos"""
+        usuarios = OutboxService._usuarios(eventos)
+        registros = []
+        for evento in eventos:
+            datos = evento.datos
+            registro = AuditLog(
+                fecha=OutboxService._fecha_evento(evento),
+                usuario=usuarios.get(datos.get('usuario_id')),
+                tipo_accion=datos['tipo_accion'],
+                modelo=datos['modelo'],
+                id_objeto=str(datos['id_objeto']),
+                datos_anteriores=datos.get('datos_anteriores') or {},
+                datos_nuevos=datos.get('datos_nuevos') or {},
+                descripcion=datos.get('descripcion', ''),
+                ip_address=datos.get('ip_address', ''),
+                user_agent=datos.get('user_agent', '')
+            )
+            registro.hash_integridad = registro.generar_hash_integridad()
+            registros.append(registro)
+        AuditLog.objects.bulk_create(registros)
+
+    @staticmethod
+    def _procesar_log_sistema(eventos):
+        usuarios = OutboxService._usuarios(eventos)
+        LogSistema.objects.bulk_create([
+            LogSistema(
+                nivel=e.datos['nivel'],
+                categoria=e.datos['categoria'],
+                mensaje=e.datos['mensaje'],
+                usuario=usuarios.get(e.datos.get('usuario_id')),
+                datos_extra={**(e.datos.get('datos_extra') or {}), 'fecha_evento': e.datos['fecha_evento']},
+                ip_address=e.datos.get('ip_address', ''),
+                user_agent=e.datos.get('user_agent', ''),
+                modulo=e.datos.get('modulo', ''),
+                funcion=e.datos.get('funcion', '')
+            )
+            for e in eventos
+        ])
+
+    @staticmethod
+    def _pedido(evento):
+        return Pedido.objects.select_related('cliente__user', 'direccion_envio').get(id=evento.datos['pedido_id'])
+
+    @staticmethod
+    def _procesar_email_confirmacion(evento):
+        from .email_service import EmailPedidoService, MAILERSEND_API_KEY
+        if not MAILERSEND_API_KEY:
+            logger.warning("MAILERSEND_API_KEY no configurada, email de confirmación omitido")
+            return
+        if not EmailPedidoService.enviar_confirmacion_pedido(OutboxService._pedido(evento)):
+            raise RuntimeError('MailerSend no aceptó el email de confirmación')
+
+    @staticmethod
+    def _procesar_email_estado(evento):
+        from .email_service import EmailPedidoService, MAILERSEND_API_KEY
+        if not MAILERSEND_API_KEY:
+            logger.warning("MAILERSEND_API_KEY no configurada, email de cambio de estado omitido")
+            return
+        datos = evento.datos
+        if not EmailPedidoService.notifica_estado(datos['estado_anterior'], datos['estado_nuevo']):
+            return
+        enviados = EmailPedidoService.enviar_notificacion_por_estado(
+            OutboxService._pedido(evento), datos['estado_anterior'], datos['estado_nuevo']
+        )
+        if not enviados:
+            raise RuntimeError('MailerSend no aceptó el email de cambio de estado')
+
+    # Tipos que se procesan en bloque (un INSERT por lote) y tipos uno a uno
+    MANEJADORES_LOTE = {
+        'auditoria': '_procesar_auditoria',
+        'log_sistema': '_procesar_log_sistema',
+    }
+    MANEJADORES = {
+        'email_confirmacion_pedido': '_procesar_email_confirmacion',
+        'email_estado_pedido': '_procesar_email_estado',
+    }
+
+    @staticmethod
+    def _marcar_fallo(eventos, error):
+        ahora = timezone.now()
+        for evento in eventos:
+            evento.intentos += 1
+            evento.ultimo_error = str(error)[:2000]
+            if evento.intentos >= MAX_INTENTOS:
+                evento.estado = 'fallido'
+                logger.error(f"Evento outbox {evento.id} ({evento.tipo}) descartado tras {evento.intentos} intentos: {error}")
+            else:
+                espera = min(ESPERA_BASE_SEGUNDOS * 2 ** (evento.intentos - 1), ESPERA_MAXIMA_SEGUNDOS)
+                evento.proximo_intento = ahora + timedelta(seconds=espera)
+        EventoOutbox.objects.bulk_update(eventos, ['intentos', 'ultimo_error', 'estado', 'proximo_intento'])
+
+    @staticmethod
+    def _reclamar(tamano):
+        """
+        Toma hasta `tamano` eventos vencidos en una transacción corta (SKIP LOCKED)
+        y los arrienda moviendo proximo_intento al vencimiento del arriendo.
+        Retorna (eventos, hora límite para empezar a procesarlos).
+        """
+        ahora = timezone.now()
+        with transaction.atomic():
+            eventos = list(
+                EventoOutbox.objects.select_for_update(skip_locked=True)
+                .filter(estado='pendiente', proximo_intento__lte=ahora)
+                .order_by('id')[:tamano]
+            )
+            if eventos:
+                EventoOutbox.objects.filter(id__in=[e.id for e in eventos]).update(
+                    proximo_intento=ahora + timedelta(seconds=ARRIENDO_SEGUNDOS)
+                )
+        return eventos, ahora + timedelta(seconds=ARRIENDO_SEGUNDOS - MARGEN_ARRIENDO_SEGUNDOS)
+
+    @staticmethod
+    def _marcar_procesados(eventos):
+        EventoOutbox.objects.filter(id__in=[e.id for e in eventos]).update(
+            estado='procesado',
+            fecha_procesado=timezone.now()
+        )
+
+    @staticmethod
+    def procesar_lote(tamano=100):
+        """
+        Procesa hasta `tamano` eventos vencidos. El lote se reclama y se confirma
+        antes de procesarlo, por lo que varios workers pueden drenar el outbox a
+        la vez sin mantener transacciones abiertas durante los envíos. Cada grupo
+        en bloque o email se marca como procesado apenas termina; un email que se
+        envió pero no alcanzó a marcarse (worker caído) se reenvía al vencer el arriendo.
+        Retorna la cantidad de eventos procesados con éxito.
+        """
+        eventos, limite = OutboxService._reclamar(tamano)
+        if not eventos:
+            return 0
+
+        por_tipo = {}
+        for evento in eventos:
+            por_tipo.setdefault(evento.tipo, []).append(evento)
+
+        procesados = 0
+        for tipo, grupo in por_tipo.items():
+            if tipo in OutboxService.MANEJADORES_LOTE:
+                manejador = getattr(OutboxService, OutboxService.MANEJADORES_LOTE[tipo])
+                try:
+                    # Los registros y la marca de procesado se confirman juntos
+                    with transaction.atomic():
+                        manejador(grupo)
+                        OutboxService._marcar_procesados(grupo)
+                    procesados += len(grupo)
+                except Exception as e:
+                    OutboxService._marcar_fallo(grupo, e)
+            elif tipo in OutboxService.MANEJADORES:
+                manejador = getattr(OutboxService, OutboxService.MANEJADORES[tipo])
+                for evento in grupo:
+                    if timezone.now() >= limite:
+                        # El resto sigue arrendado y se retoma cuando vence el arriendo
+                        break
+                    try:
+                        manejador(evento)
+                    except Exception as e:
+                        OutboxService._marcar_fallo([evento], e)
+                        continue
+                    OutboxService._marcar_procesados([evento])
+                    procesados += 1
+            else:
+                OutboxService._marcar_fallo(grupo, f'Tipo de evento desconocido: {tipo}')
+
+        return procesados
@@ -0,0 +1,63 @@
+"""
+Carga por lotes de las líneas de pedidos
+Elixir - Sistema de Botillería
+"""
+from .models import DetallesPedido
+
+# Estado nuevo -> estados desde los que se puede llegar (mismas reglas que cambiar_estado_pedido)
+PREDECESORES_ESTADO = {
+    'pagado': ('pendiente',),
+    'en_preparacion': ('pendiente', 'pagado'),
+    'enviado': ('pagado', 'en_preparacion'),
+    'entregado': ('enviado',),
+    'cancelado': ('pendiente', 'pagado', 'en_preparacion', 'enviado'),
+}
+
+
+class CargadorDetallesPedido:
+    """
+    Junta los ids de los pedidos que se van a serializar y trae todas sus líneas
+    (con nombre y SKU del producto) en una sola consulta la primera vez que se
+    pide alguna. Serializar N pedidos cuesta una consulta en lugar de N.
+    """
+
+    def __init__(self, pedido_ids=()):
+        self._pendientes = set(pedido_ids)
+        self._detalles = {}
+
+    def agregar(self, pedido_ids):
+        """Registra pedidos para la próxima carga (los ya cargados se ignoran)"""
+        self._pendientes.update(pedido_id for pedido_id in pedido_ids if pedido_id not in self._detalles)
+
+    def obtener(self, pedido_id):
+        """Líneas de un pedido; si aún no se cargó, carga todos los pendientes juntos"""
+        if pedido_id not in self._detalles:
+            self._pendientes.add(pedido_id)
+            self._cargar()
+        return self._detalles[pedido_id]
+
+    def _cargar(self):
+        pedido_ids = self._pendientes
+        self._pendientes = set()
+        for pedido_id in pedido_ids:
+            self._detalles[pedido_id] = []
+        filas = DetallesPedido.objects.filter(pedido_id__in=pedido_ids).order_by('id').values(
+            'pedido_id', 'producto_id', 'producto__nombre', 'producto__sku',
+            'cantidad', 'precio_unitario', 'subtotal'
+        )
+        for fila in filas:
+            self._detalles[fila['pedido_id']].append({
+                'producto_id': fila['producto_id'],
+                'producto_nombre': fila['producto__nombre'],
+                'producto_sku': fila['producto__sku'],
+                'cantidad': fila['cantidad'],
+                'precio_unitario': float(fila['precio_unitario']),
+                'subtotal': float(fila['subtotal'])
+            })
+
+    @staticmethod
+    def cargar(pedido_ids):
+        """Atajo: {pedido_id: [detalle, ...]} para una lista de pedidos en una consulta"""
+        cargador = CargadorDetallesPedido(pedido_ids)
+        cargador._cargar()
+        return cargador._detalles
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import AuditLog, Cliente, Producto, Pedido, Categoria, SolicitudAutorizacion, LogSistema, EstadisticaVisita, Cupon, PromocionProducto, Reclamo, ComentarioReclamo, DireccionEnvio
+from .pedido_service import CargadorDetallesPedido
 
 class AuditLogSerializer(serializers.ModelSerializer):
     usuario_email = serializers.CharField(source='usuario.email', read_only=True)
@@ -40,7 +41,17 @@ class ClienteSerializer(serializers.ModelSerializer):
     def get_total_pedidos(self, obj):
         return obj.pedidos.count()
 
-class ProductoSerializer(serializers.ModelSerializer):
+class CamposDinamicosMixin:
+    """Acepta fields=[...] para serializar solo esos campos (proyección ?fields=)"""
+
+    def __init__(self, *args, **kwargs):
+        campos = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if campos is not None:
+            for nombre in set(self.fields) - set(campos):
+                self.fields.pop(nombre)
+
+class ProductoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     categoria_nombre = serializers.CharField(source='categoria.nombre', read_only=True)
     creador_username = serializers.CharField(source='creador.username', read_only=True)
     tiene_promocion = serializers.SerializerMethodField()
@@ -55,6 +66,27 @@ class ProductoSerializer(serializers.ModelSerializer):
             'creador_username', 'fecha_creacion', 'tiene_promocion', 'descuento_porcentaje'
         ]
         read_only_fields = ['id', 'fecha_creacion']
+
+    # Columnas del modelo que usa cada campo que no es una columna propia
+    COLUMNAS_POR_CAMPO = {
+        'categoria_nombre': ['categoria', 'categoria__nombre'],
+        'creador_username': ['creador', 'creador__username'],
+        'precio_con_descuento': ['precio'],
+        'tiene_promocion': [],
+        'descuento_porcentaje': [],
+    }
+
+    @classmethod
+    def optimizar_queryset(cls, queryset, campos):
+        """Limita el queryset (.only() y select_related) a las columnas que usan los campos pedidos"""
+        columnas = set()
+        for campo in campos:
+            columnas.update(cls.COLUMNAS_POR_CAMPO.get(campo, [campo]))
+        relaciones = sorted({columna.split('__')[0] for columna in columnas if '__' in columna})
+        queryset = queryset.select_related(None)
+        if relaciones:
+            queryset = queryset.select_related(*relaciones)
+        return queryset.only('id', *columnas)
     
     def get_tiene_promocion(self, obj):
         """Indica si el producto tiene una promoción activa"""
@@ -71,6 +103,17 @@ class ProductoSerializer(serializers.ModelSerializer):
             return float(promocion.descuento_porcentaje)
         return None
 
+class PedidoListSerializer(serializers.ListSerializer):
+    """Registra todos los pedidos en el cargador antes de serializarlos (una consulta de líneas)"""
+
+    def to_representation(self, data):
+        pedidos = list(data.all() if hasattr(data, 'all') else data)
+        self.context.setdefault('cargador_detalles', CargadorDetallesPedido()).agregar(
+            pedido.id for pedido in pedidos
+        )
+        return super().to_representation(pedidos)
+
+
 class PedidoSerializer(serializers.ModelSerializer):
     cliente_email = serializers.CharField(source='cliente.user.email', read_only=True)
     cliente_nombre = serializers.CharField(source='cliente.user.first_name', read_only=True)
@@ -86,29 +129,16 @@ class PedidoSerializer(serializers.ModelSerializer):
             'fecha_entrega_estimada', 'fecha_entrega_real', 'detalles'
         ]
         read_only_fields = ['id', 'numero_pedido', 'fecha_pedido']
+        list_serializer_class = PedidoListSerializer
+
+    @staticmethod
+    def optimizar_queryset(queryset):
+        """Trae cliente y vendedor con sus usuarios en la misma consulta de los pedidos"""
+        return queryset.select_related('cliente__user', 'vendedor__user')
 
     def get_detalles(self, obj):
-        from django.db import connection
-        detalles = []
-        try:
-            with connection.cursor() as cursor:
-                cursor.execute("""
-                    SELECT dp.producto_id, p.nombre, dp.cantidad, dp.precio_unitario, dp.subtotal
-                    FROM inventario_detallespedido dp
-                    JOIN inventario_producto p ON dp.producto_id = p.id
-                    WHERE dp.pedido_id = %s
-                """, [obj.id])
-                for row in cursor.fetchall():
-                    detalles.append({
-                        'producto_id': row[0],
-                        'producto_nombre': row[1],
-                        'cantidad': row[2],
-                        'precio_unitario': float(row[3]),
-                        'subtotal': float(row[4])
-                    })
-        except Exception:
-            pass
-        return detalles
+        # Con many=True el cargador ya tiene todos los pedidos de la página
+        return self.context.setdefault('cargador_detalles', CargadorDetallesPedido()).obtener(obj.id)
 
 class CategoriaSerializer(serializers.ModelSerializer):
     total_productos = serializers.SerializerMethodField()
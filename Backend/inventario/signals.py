@@ -0,0 +1,44 @@
+"""
+Señales del inventario
+Mantiene los datos derivados del catálogo e invalida sus cachés cuando cambian los modelos
+"""
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Producto, Categoria, ProductoImagen, PromocionProducto, TarifaEnvio
+from .autocompletado_service import incrementar_version_autocompletado
+from .catalogo_service import incrementar_version_catalogo
+from .envio_service import incrementar_version_tarifas
+
+
+# Se registra antes de invalidar_catalogo para que la nueva versión ya vea la imagen actualizada
+@receiver(post_save, sender=ProductoImagen)
+@receiver(post_delete, sender=ProductoImagen)
+def actualizar_imagen_principal(sender, instance, **kwargs):
+    instance.actualizar_imagen_principal_producto()
+
+
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+@receiver(post_save, sender=Categoria)
+@receiver(post_delete, sender=Categoria)
+@receiver(post_save, sender=ProductoImagen)
+@receiver(post_delete, sender=ProductoImagen)
+@receiver(post_save, sender=PromocionProducto)
+@receiver(post_delete, sender=PromocionProducto)
+def invalidar_catalogo(sender, **kwargs):
+    incrementar_version_catalogo()
+
+
+# Producto.save() incrementa la versión solo si cambió algún campo del índice
+@receiver(post_delete, sender=Producto)
+@receiver(post_save, sender=Categoria)
+@receiver(post_delete, sender=Categoria)
+def invalidar_autocompletado(sender, **kwargs):
+    incrementar_version_autocompletado()
+
+
+@receiver(post_save, sender=TarifaEnvio)
+@receiver(post_delete, sender=TarifaEnvio)
+def invalidar_tarifas_envio(sender, **kwargs):
+    incrementar_version_tarifas()
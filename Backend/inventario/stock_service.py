@@ -0,0 +1,340 @@
+"""
+Movimientos de stock (registro) y su proyección en Producto.stock
+Elixir - Sistema de Botillería
+"""
+from django.db import transaction
+from django.utils import timezone
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+
+from .catalogo_service import incrementar_version_stock
+
+
+class StockInsuficiente(Exception):
+    """Una o más líneas no tienen stock suficiente; `faltantes` trae el detalle por producto"""
+
+    def __init__(self, faltantes):
+        self.faltantes = faltantes
+        detalle = ', '.join(
+            f"{f['nombre']} (solicitado: {f['solicitado']}, disponible: {f['disponible']})"
+            for f in faltantes
+        )
+        super().__init__(f'Stock insuficiente para {detalle}')
+
+
+class StockService:
+    """
+    Único punto de cambio del stock. Cada operación agrega sus filas a
+    MovimientoStock (un INSERT) y aplica la proyección sobre Producto.stock con
+    un único UPDATE relativo (stock + diferencia), nunca escribiendo un valor leído
+    antes. Las filas se bloquean en orden de id (evita deadlocks entre compras
+    concurrentes de los mismos productos).
+    """
+
+    @staticmethod
+    def consolidar(lineas):
+        """Suma las cantidades por producto: [(producto_id, cantidad)] -> {producto_id: cantidad}"""
+        cantidades = {}
+        for producto_id, cantidad in lineas:
+            cantidad = int(cantidad)
+            if cantidad <= 0:
+                raise ValueError(f'Cantidad inválida para el producto {producto_id}: {cantidad}')
+            cantidades[int(producto_id)] = cantidades.get(int(producto_id), 0) + cantidad
+        return dict(sorted(cantidades.items()))
+
+    @staticmethod
+    def _bloquear(producto_ids):
+        """SELECT ... FOR UPDATE ordenado: todas las transacciones bloquean en el mismo orden"""
+        from .models import Producto
+
+        return {
+            fila['id']: fila
+            for fila in Producto.objects.select_for_update()
+            .filter(id__in=producto_ids)
+            .order_by('id')
+            .values('id', 'nombre', 'stock')
+        }
+
+    @staticmethod
+    def _aplicar(diferencias):
+        """Proyección: un único UPDATE con la diferencia (con signo) de cada producto"""
+        from .models import Producto
+
+        diferencias = {producto_id: d for producto_id, d in diferencias.items() if d}
+        if not diferencias:
+            return
+        diferencia = Case(
+            *[When(id=producto_id, then=Value(d)) for producto_id, d in diferencias.items()],
+            output_field=IntegerField()
+        )
+        Producto.objects.filter(id__in=diferencias.keys()).update(stock=F('stock') + diferencia)
+        StockService._actualizar_alertas(diferencias, diferencia)
+
+        # update() no emite señales; solo se invalidan los snapshots que muestran el stock
+        incrementar_version_stock()
+
+    @staticmethod
+    def _actualizar_alertas(diferencias, diferencia):
+        """
+        Abre alertas para los productos que bajaron y cruzaron su mínimo con este
+        UPDATE (stock - diferencia > mínimo >= stock) y resuelve las de los que se repusieron.
+        """
+        from .models import AlertaStockBajo, Producto
+
+        bajaron = [producto_id for producto_id, d in diferencias.items() if d < 0]
+        if bajaron:
+            cruzaron = (
+                Producto.objects.con_stock_bajo()
+                .filter(id__in=bajaron)
+                .alias(diferencia=diferencia)
+                .filter(stock__gt=F('stock_minimo') + F('diferencia'))
+                .values_list('id', 'stock', 'stock_minimo')
+            )
+            AlertaStockBajo.objects.bulk_create([
+                AlertaStockBajo(producto_id=producto_id, stock=stock, stock_minimo=stock_minimo)
+                for producto_id, stock, stock_minimo in cruzaron
+            ], ignore_conflicts=True)
+
+        subieron = [producto_id for producto_id, d in diferencias.items() if d > 0]
+        if subieron:
+            AlertaStockBajo.objects.filter(
+                producto_id__in=subieron,
+                resuelta=False,
+                producto__stock__gt=F('producto__stock_minimo')
+            ).update(resuelta=True, fecha_resuelta=timezone.now())
+
+    @staticmethod
+    def evaluar_alerta(producto, estaba_bajo):
+        """Abre o resuelve la alerta de un producto editado directamente (stock, mínimo o activo)"""
+        from .models import AlertaStockBajo
+
+        esta_bajo = producto.activo and producto.stock <= producto.stock_minimo
+        if esta_bajo and not estaba_bajo:
+            AlertaStockBajo.objects.bulk_create([
+                AlertaStockBajo(producto=producto, stock=producto.stock, stock_minimo=producto.stock_minimo)
+            ], ignore_conflicts=True)
+        elif estaba_bajo and not esta_bajo:
+            AlertaStockBajo.objects.filter(producto=producto, resuelta=False).update(
+                resuelta=True, fecha_resuelta=timezone.now()
+            )
+
+    @staticmethod
+    def registrar_movimientos(movimientos):
+        """Inserta MovimientoStock ya construidos en un solo INSERT (sin tocar la proyección)"""
+        from .models import MovimientoStock
+
+        return MovimientoStock.objects.bulk_create(movimientos)
+
+    @staticmethod
+    def movimientos_salida(cantidades, tipo, pedido=None, usuario=None, motivo=''):
+        """Movimientos negativos para {producto_id: cantidad}"""
+        from .models import MovimientoStock
+
+        return [
+            MovimientoStock(
+                producto_id=producto_id,
+                tipo=tipo,
+                cantidad=-cantidad,
+                pedido=pedido,
+                usuario=usuario,
+                motivo=motivo
+            )
+            for producto_id, cantidad in cantidades.items()
+        ]
+
+    @staticmethod
+    def descontar(lineas, tipo='venta', pedido=None, usuario=None):
+        """
+        Descuenta el stock de las líneas [(producto_id, cantidad)].
+
+        Debe llamarse dentro de transaction.atomic(): si alguna línea no alcanza
+        se lanza StockInsuficiente con todos los faltantes y la transacción del
+        llamador se revierte. Retorna {producto_id: stock_restante}.
+        """
+        from .models import Producto
+
+        cantidades = StockService.consolidar(lineas)
+        if not cantidades:
+            return {}
+
+        bloqueados = StockService._bloquear(cantidades.keys())
+
+        faltantes = []
+        for producto_id, cantidad in cantidades.items():
+            fila = bloqueados.get(producto_id)
+            if fila is None:
+                raise Producto.DoesNotExist(f'Producto con ID {producto_id} no encontrado')
+            if fila['stock'] < cantidad:
+                faltantes.append({
+                    'producto_id': producto_id,
+                    'nombre': fila['nombre'],
+                    'solicitado': cantidad,
+                    'disponible': fila['stock'],
+                })
+        if faltantes:
+            raise StockInsuficiente(faltantes)
+
+        StockService.registrar_movimientos(
+            StockService.movimientos_salida(cantidades, tipo, pedido, usuario)
+        )
+        StockService._aplicar({producto_id: -cantidad for producto_id, cantidad in cantidades.items()})
+
+        return {
+            producto_id: bloqueados[producto_id]['stock'] - cantidad
+            for producto_id, cantidad in cantidades.items()
+        }
+
+    @staticmethod
+    def asignar(ventas):
+        """
+        Descuenta el stock de varias ventas independientes en una sola pasada.
+
+        `ventas` es una lista [(clave, lineas)] que se evalúa en orden: cada venta
+        se acepta solo si todas sus líneas alcanzan con el stock que dejaron las
+        anteriores. Bloquea las filas una vez y aplica un único UPDATE para todo
+        el lote. Debe llamarse dentro de transaction.atomic(); el llamador registra
+        los movimientos (registrar_movimientos) una vez creados los pedidos.
+        Retorna (claves_aceptadas, {clave: faltantes}).
+        """
+        ventas = [(clave, StockService.consolidar(lineas)) for clave, lineas in ventas]
+        producto_ids = {producto_id for _, cantidades in ventas for producto_id in cantidades}
+        if not producto_ids:
+            return [], {}
+
+        bloqueados = StockService._bloquear(producto_ids)
+        disponible = {producto_id: fila['stock'] for producto_id, fila in bloqueados.items()}
+
+        aceptadas = []
+        rechazadas = {}
+        total = {}
+        for clave, cantidades in ventas:
+            faltantes = [
+                {
+                    'producto_id': producto_id,
+                    'nombre': bloqueados[producto_id]['nombre'] if producto_id in bloqueados else None,
+                    'solicitado': cantidad,
+                    'disponible': disponible.get(producto_id, 0),
+                }
+                for producto_id, cantidad in cantidades.items()
+                if disponible.get(producto_id, 0) < cantidad
+            ]
+            if faltantes:
+                rechazadas[clave] = faltantes
+                continue
+            for producto_id, cantidad in cantidades.items():
+                disponible[producto_id] -= cantidad
+                total[producto_id] = total.get(producto_id, 0) - cantidad
+            aceptadas.append(clave)
+
+        StockService._aplicar(total)
+        return aceptadas, rechazadas
+
+    @staticmethod
+    def ajustar(producto_id, nuevo_stock, usuario=None, motivo='', tipo='ajuste'):
+        """
+        Fija el stock de un producto registrando la diferencia como movimiento.
+        Retorna (stock_anterior, nuevo_stock).
+        """
+        from .models import MovimientoStock, Producto
+
+        nuevo_stock = int(nuevo_stock)
+        with transaction.atomic():
+            fila = StockService._bloquear([producto_id]).get(int(producto_id))
+            if fila is None:
+                raise Producto.DoesNotExist(f'Producto con ID {producto_id} no encontrado')
+            diferencia = nuevo_stock - fila['stock']
+            if diferencia:
+                StockService.registrar_movimientos([MovimientoStock(
+                    producto_id=fila['id'],
+                    tipo=tipo,
+                    cantidad=diferencia,
+                    usuario=usuario,
+                    motivo=motivo
+                )])
+                StockService._aplicar({fila['id']: diferencia})
+        return fila['stock'], nuevo_stock
+
+    @staticmethod
+    def reponer_pedido(pedido, tipo='cancelacion', usuario=None):
+        """Devuelve al stock las líneas de un pedido (cancelación o devolución)"""
+        return StockService.reponer_pedidos([pedido], tipo, usuario)
+
+    @staticmethod
+    def reponer_pedidos(pedidos, tipo='cancelacion', usuario=None):
+        """
+        Devuelve al stock las líneas de varios pedidos: una consulta de líneas, un
+        bloqueo, un INSERT de movimientos y un UPDATE. Retorna {producto_id: cantidad}.
+        """
+        from .models import DetallesPedido, MovimientoStock
+
+        pedidos = {pedido.id: pedido for pedido in pedidos}
+        lineas = list(
+            DetallesPedido.objects.filter(pedido_id__in=pedidos, producto__isnull=False)
+            .values_list('pedido_id', 'producto_id', 'cantidad')
+        )
+        if not lineas:
+            return {}
+
+        por_pedido = {}
+        for pedido_id, producto_id, cantidad in lineas:
+            por_pedido.setdefault(pedido_id, []).append((producto_id, cantidad))
+        cantidades = StockService.consolidar(
+            (producto_id, cantidad) for _, producto_id, cantidad in lineas
+        )
+        with transaction.atomic():
+            StockService._bloquear(cantidades.keys())
+            StockService.registrar_movimientos([
+                MovimientoStock(
+                    producto_id=producto_id,
+                    tipo=tipo,
+                    cantidad=cantidad,
+                    pedido=pedidos[pedido_id],
+                    usuario=usuario,
+                    motivo=f'Pedido {pedidos[pedido_id].numero_pedido}'
+                )
+                for pedido_id, lineas_pedido in por_pedido.items()
+                for producto_id, cantidad in StockService.consolidar(lineas_pedido).items()
+            ])
+            StockService._aplicar(cantidades)
+        return cantidades
+
+    @staticmethod
+    def stock_en(fecha, producto_ids=None):
+        """Stock de cada producto a una fecha, según el registro de movimientos"""
+        from .models import MovimientoStock
+
+        movimientos = MovimientoStock.objects.filter(fecha__lte=fecha)
+        if producto_ids is not None:
+            movimientos = movimientos.filter(producto_id__in=producto_ids)
+        return dict(
+            movimientos.values('producto_id').annotate(total=Sum('cantidad'))
+            .values_list('producto_id', 'total')
+        )
+
+    @staticmethod
+    def reconstruir(producto_ids=None):
+        """
+        Recalcula Producto.stock como la suma de sus movimientos.
+        Retorna {producto_id: (stock_proyectado, stock_registro)} de los que difieren.
+        """
+        from .models import MovimientoStock, Producto
+
+        with transaction.atomic():
+            productos = Producto.objects.select_for_update().order_by('id')
+            movimientos = MovimientoStock.objects.all()
+            if producto_ids is not None:
+                productos = productos.filter(id__in=producto_ids)
+                movimientos = movimientos.filter(producto_id__in=producto_ids)
+            actuales = dict(productos.values_list('id', 'stock'))
+            registro = dict(
+                movimientos.values('producto_id').annotate(total=Sum('cantidad'))
+                .values_list('producto_id', 'total')
+            )
+            diferencias = {
+                producto_id: (stock, registro.get(producto_id, 0))
+                for producto_id, stock in actuales.items()
+                if stock != registro.get(producto_id, 0)
+            }
+            StockService._aplicar({
+                producto_id: correcto - stock for producto_id, (stock, correcto) in diferencias.items()
+            })
+        return diferencias
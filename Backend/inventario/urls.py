@@ -8,6 +8,8 @@ urlpatterns = [
     path('home/', views.home, name='api_home'),
     path('catalogo/', views.catalogo, name='api_catalogo'),
     path('productos/sugerencias/', views.sugerencias_productos, name='api_sugerencias_productos'),
+    path('productos/lote/', views.productos_lote, name='api_productos_lote'),
+    path('productos/lote', views.productos_lote, name='api_productos_lote_root'),
     path('producto/<int:producto_id>/', views.detalle_producto, name='api_detalle_producto'),
     path('checkout/', views.checkout, name='api_checkout'),
     path('productos/', views.api_productos, name='api_productos'),
@@ -23,12 +25,14 @@ urlpatterns = [
     path('listar-clientes/', views.listar_clientes, name='api_listar_clientes'),
     
     # Endpoints para pedidos y checkout
+    path('carrito/cotizar/', views.cotizar_carrito, name='api_cotizar_carrito'),
     path('crear-pedido/', views.crear_pedido, name='api_crear_pedido'),
     path('mis-pedidos/', views.mis_pedidos, name='api_mis_pedidos'),
     path('dashboard-admin/', views.dashboard_gerente, name='api_dashboard_admin'),
     path('mi-perfil/', views.mi_perfil, name='api_mi_perfil'),
     path('marcar-pagado/', views.marcar_pedido_pagado, name='api_marcar_pagado'),
     path('cambiar-estado-pedido/', views.cambiar_estado_pedido, name='api_cambiar_estado_pedido'),
+    path('pedidos/estado/lote/', views.cambiar_estado_pedidos_lote, name='api_cambiar_estado_pedidos_lote'),
     path('confirmar-envio/', views.confirmar_envio_pedido, name='api_confirmar_envio_pedido'),
     path('pedidos/gestion/', views.listar_pedidos_gestion, name='api_listar_pedidos_gestion'),
     
@@ -36,6 +40,7 @@ urlpatterns = [
     path('productos/<int:producto_id>/actualizar/', views.actualizar_producto, name='api_actualizar_producto'),
     path('productos/crear/', views.crear_producto, name='api_crear_producto'),
     path('productos/<int:producto_id>/actualizar-stock/', views.actualizar_stock_producto, name='api_actualizar_stock'),
+    path('inventario/alertas-stock/', views.alertas_stock_bajo, name='api_alertas_stock_bajo'),
     path('productos/<int:producto_id>/', views.obtener_eliminar_producto, name='api_obtener_eliminar_producto'),
     path('sliders/', views.obtener_sliders, name='api_sliders'),
     
@@ -96,6 +101,8 @@ urlpatterns = [
     # Endpoints de POS (Punto de Venta) - HU 22
     path('pos/buscar-producto/', views.pos_buscar_producto, name='api_pos_buscar_producto'),
     path('pos/crear-venta/', views.pos_crear_venta, name='api_pos_crear_venta'),
+    path('pos/ventas/lote/', views.pos_ventas_lote, name='api_pos_ventas_lote'),
+    path('pos/boletas/reservar/', views.pos_reservar_boletas, name='api_pos_reservar_boletas'),
     path('pos/cierre-caja/', views.pos_cierre_caja, name='api_pos_cierre_caja'),
 
     # Endpoints de Recomendaciones - HU 32
@@ -107,6 +114,7 @@ urlpatterns = [
     path('direcciones/<int:direccion_id>/', views.gestionar_direccion, name='api_direccion'),
     path('direcciones/regiones-comunas/', views.obtener_regiones_comunas, name='api_regiones_comunas'),
     path('envio/calcular-costo/', views.calcular_costo_envio, name='api_calcular_costo_envio'),
+    path('envio/cotizar-direcciones/', views.cotizar_envio_direcciones, name='api_cotizar_envio_direcciones'),
     path('envio/metodos/', views.obtener_metodos_envio, name='api_metodos_envio'),
 
     # Endpoint para poblar datos de prueba
@@ -1,22 +1,34 @@
 from django.shortcuts import get_object_or_404
-from django.db.models import Q, Sum, Count, F
+from django.db.models import Q, Sum, Count, F, OuterRef, Subquery, IntegerField, Case, When, Value
 from django.utils import timezone
-from .models import Producto, Categoria, Cliente, Pedido, DetallesPedido, AuditLog, LogSistema, EstadisticaVisita, SolicitudAutorizacion, Cupon, PromocionProducto, Reclamo, ComentarioReclamo, DireccionEnvio, REGIONES_CHILE, Proveedor, ReporteFinanciero
-from django.db.models.functions import TruncDay, TruncWeek, TruncMonth, TruncYear
+from .models import Producto, Categoria, Cliente, Pedido, DetallesPedido, AlertaStockBajo, AuditLog, LogSistema, EstadisticaVisita, SolicitudAutorizacion, Cupon, PromocionProducto, Reclamo, ComentarioReclamo, DireccionEnvio, REGIONES_CHILE, Proveedor, ReporteFinanciero
+from django.db.models.functions import TruncDay, TruncWeek, TruncMonth, TruncYear, Coalesce
 from django.http import JsonResponse
 from .forms import RegistroClienteForm
 from django.core.mail import send_mail
 from django.conf import settings
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, authentication_classes
 from rest_framework.response import Response
 from rest_framework import status
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
 from decimal import Decimal
 import secrets
-from datetime import datetime
+from datetime import datetime, timedelta
 import uuid
 from .email_service import EmailPedidoService
+from .busqueda_service import BusquedaProductoService
+from .autocompletado_service import IndiceAutocompletado
+from .catalogo_service import respuesta_snapshot, respuesta_streaming, lista_json, objeto_json
+from .stock_service import StockService, StockInsuficiente
+from .carrito_service import CotizacionService, CotizacionInvalida, COTIZACION_VIGENCIA_SEGUNDOS
+from .envio_service import CostoEnvioService
+from .boleta_service import NumeracionBoletaService, BLOQUE_MAXIMO
+from .idempotencia_service import idempotente
+from .outbox_service import OutboxService
+from .pedido_service import CargadorDetallesPedido, PREDECESORES_ESTADO
+from django.db import transaction, IntegrityError
+from django.utils.dateparse import parse_date, parse_datetime
 
 @api_view(['POST'])
 def login_cliente(request):
@@ -506,44 +518,158 @@ def registro_cliente(request):
     }, status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 def home(request):
-    """API endpoint para obtener datos de home"""
+    """API endpoint para obtener datos de home (cacheado por versión del catálogo)"""
     try:
-        categorias = Categoria.objects.filter(activa=True).values('id', 'nombre', 'descripcion')
-        productos_destacados = Producto.objects.filter(activo=True)[:8]
-        productos_prueba = Producto.objects.filter(nombre__icontains="Prueba", activo=True)
-
-        productos_data = []
-        for p in productos_destacados:
-            imagen_url = ''
-            if hasattr(p, 'imagenes') and p.imagenes.exists():
-                primera = p.imagenes.first()
-                if primera and getattr(primera, 'imagen', None):
-                    imagen_url = request.build_absolute_uri(primera.imagen.url)
-            elif p.imagen:
-                imagen_url = request.build_absolute_uri(p.imagen.url)
-            if not imagen_url:
-                imagen_url = 'https://via.placeholder.com/400x250?text=Sin+imagen'
-            
-            productos_data.append({
-                'id': p.id,
-                'nombre': p.nombre,
-                'precio': float(p.precio) if p.precio else 0,
-                'imagen': imagen_url,
-                'imagen_url': p.imagen_url or imagen_url,
-            })
-
-        return JsonResponse({
-            'categorias': list(categorias),
-            'productos_destacados': productos_data,
-            'productos_prueba': list(productos_prueba.values('id', 'nombre', 'precio')),
-        })
+        return respuesta_snapshot(request, 'home', lambda: _construir_home(request))
     except Exception as e:
         return JsonResponse({
             'error': str(e)
         }, status=400)
 
+def _construir_home(request):
+    """Payload de home; se construye solo cuando cambia la versión del catálogo"""
+    categorias = Categoria.objects.filter(activa=True).values('id', 'nombre', 'descripcion')
+    productos_destacados = Producto.objects.filter(activo=True)[:8]
+    productos_prueba = Producto.objects.filter(nombre__icontains="Prueba", activo=True)
+
+    productos_data = []
+    for p in productos_destacados:
+        imagen_url = p.obtener_url_imagen(request)
+        
+        productos_data.append({
+            'id': p.id,
+            'nombre': p.nombre,
+            'precio': float(p.precio) if p.precio else 0,
+            'imagen': imagen_url,
+            'imagen_url': p.imagen_url or imagen_url,
+            'imagenes': p.obtener_urls_derivados(request),
+        })
+
+    return {
+        'categorias': list(categorias),
+        'productos_destacados': productos_data,
+        'productos_prueba': list(productos_prueba.values('id', 'nombre', 'precio')),
+    }
+
+# Paginación por cursor del catálogo: orden permitido -> campo de la clave
+ORDENES_CATALOGO = {
+    'nombre': 'nombre',
+    '-nombre': '-nombre',
+    'precio': 'precio',
+    '-precio': '-precio',
+    'recientes': '-fecha_creacion',
+}
+CATALOGO_PAGE_SIZE_DEFAULT = 24
+CATALOGO_PAGE_SIZE_MAX = 60
+
+
+def _codificar_cursor(valores):
+    """Codifica la clave de la última fila entregada como cursor opaco"""
+    import base64
+    import json
+    contenido = json.dumps([str(v) for v in valores])
+    return base64.urlsafe_b64encode(contenido.encode('utf-8')).decode('ascii')
+
+
+def _decodificar_cursor(cursor, largo):
+    """Decodifica un cursor generado por _codificar_cursor"""
+    import base64
+    import binascii
+    import json
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, binascii.Error, UnicodeError):
+        raise ValueError('Cursor inválido')
+    if not isinstance(valores, list) or len(valores) != largo:
+        raise ValueError('Cursor inválido')
+    return valores
+
+
+def _filtro_keyset(campo, valor, id_valor):
+    """Condición 'después de (valor, id)' para un orden (campo, id) ascendente o descendente"""
+    if campo.startswith('-'):
+        campo = campo[1:]
+        return Q(**{f'{campo}__lt': valor}) | Q(**{campo: valor, 'id__lt': id_valor})
+    return Q(**{f'{campo}__gt': valor}) | Q(**{campo: valor, 'id__gt': id_valor})
+
+
+def _facetas_catalogo(productos):
+    """
+    Calcula las facetas de proveedor, categoría y rango de precios con una sola
+    consulta agrupada por (proveedor, categoría).
+    """
+    from django.db.models import Min, Max
+
+    grupos = productos.order_by().values(
+        'proveedor_id', 'proveedor__nombre', 'categoria_id', 'categoria__nombre'
+    ).annotate(
+        total=Count('id'),
+        precio_min=Min('precio'),
+        precio_max=Max('precio'),
+    )
+
+    proveedores = {}
+    categorias = {}
+    precio_min = None
+    precio_max = None
+    total = 0
+    for grupo in grupos:
+        proveedor = proveedores.setdefault(grupo['proveedor_id'], {
+            'id': grupo['proveedor_id'],
+            'nombre': grupo['proveedor__nombre'],
+            'total': 0,
+        })
+        proveedor['total'] += grupo['total']
+        categoria = categorias.setdefault(grupo['categoria_id'], {
+            'id': grupo['categoria_id'],
+            'nombre': grupo['categoria__nombre'],
+            'total': 0,
+        })
+        categoria['total'] += grupo['total']
+        total += grupo['total']
+        if precio_min is None or grupo['precio_min'] < precio_min:
+            precio_min = grupo['precio_min']
+        if precio_max is None or grupo['precio_max'] > precio_max:
+            precio_max = grupo['precio_max']
+
+    return {
+        'proveedores': list(proveedores.values()),
+        'categorias': list(categorias.values()),
+        'rango_precios': {
+            'minimo': float(precio_min) if precio_min is not None else 0,
+            'maximo': float(precio_max) if precio_max is not None else 0,
+        },
+        'total': total,
+    }
+
+
+def _serializar_producto_catalogo(request, p):
+    """Representación de un producto en los listados del catálogo"""
+    imagen_url = p.obtener_url_imagen(request)
+
+    return {
+        'id': p.id,
+        'nombre': p.nombre,
+        'sku': p.sku,
+        'precio': float(p.precio) if p.precio else 0,
+        'stock': p.stock,
+        'disponible': p.stock > 0,
+        'descripcion': p.descripcion,
+        'imagen': imagen_url,
+        'imagen_url': p.imagen_url or imagen_url,
+        'imagenes': p.obtener_urls_derivados(request),
+        'categoria': {'id': p.categoria.id, 'nombre': p.categoria.nombre},
+        'proveedor': {'id': p.proveedor.id, 'nombre': p.proveedor.nombre},
+    }
+
+
 def catalogo(request):
-    """API endpoint para catálogo de productos con filtros avanzados"""
+    """
+    API endpoint para catálogo de productos con filtros avanzados.
+
+    Si se envía `page_size` o `cursor` la respuesta se pagina por cursor sobre
+    (orden, id); sin ellos se mantiene la respuesta completa original.
+    """
     try:
         productos = Producto.objects.filter(activo=True)
         categorias_qs = Categoria.objects.filter(activa=True)
@@ -556,13 +682,9 @@ def catalogo(request):
         precio_max = request.GET.get('precio_max')
         disponible = request.GET.get('disponible')  # 'true' o 'false'
         
-        # Filtro de búsqueda por nombre, descripción y SKU
+        # Filtro de búsqueda por nombre, descripción y SKU (texto completo + trigramas)
         if busqueda:
-            productos = productos.filter(
-                Q(nombre__icontains=busqueda) |
-                Q(descripcion__icontains=busqueda) |
-                Q(sku__icontains=busqueda)
-            )
+            productos = productos.filter(BusquedaProductoService.filtro(busqueda))
         
         # Filtro por categorías múltiples
         if categoria_ids:
@@ -594,65 +716,80 @@ def catalogo(request):
             elif disponible.lower() == 'false':
                 productos = productos.filter(stock__lte=0)
         
-        # Obtener proveedores para filtrado
-        proveedores = {}
-        for prod in productos:
-            if prod.proveedor_id not in proveedores:
-                proveedores[prod.proveedor_id] = prod.proveedor.nombre
-        
-        # Calcular rango de precios disponibles
-        precio_min_disponible = productos.order_by('precio').first()
-        precio_max_disponible = productos.order_by('-precio').first()
-        
-        precio_rango_min = float(precio_min_disponible.precio) if precio_min_disponible else 0
-        precio_rango_max = float(precio_max_disponible.precio) if precio_max_disponible else 0
-
-        productos_data = []
-        for p in productos:
-            imagen_url = ''
-            if hasattr(p, 'imagenes') and p.imagenes.exists():
-                primera = p.imagenes.first()
-                if primera and getattr(primera, 'imagen', None):
-                    imagen_url = request.build_absolute_uri(primera.imagen.url)
-            elif p.imagen:
-                imagen_url = request.build_absolute_uri(p.imagen.url)
-            if not imagen_url:
-                imagen_url = 'https://via.placeholder.com/400x250?text=Sin+imagen'
-            
-            productos_data.append({
-                'id': p.id,
-                'nombre': p.nombre,
-                'sku': p.sku,
-                'precio': float(p.precio) if p.precio else 0,
-                'stock': p.stock,
-                'disponible': p.stock > 0,
-                'descripcion': p.descripcion,
-                'imagen': imagen_url,
-                'imagen_url': p.imagen_url or imagen_url,
-                'categoria': {'id': p.categoria.id, 'nombre': p.categoria.nombre},
-                'proveedor': {'id': p.proveedor.id, 'nombre': p.proveedor.nombre},
-            })
+        # Facetas de proveedores, categorías y rango de precios en una consulta
+        facetas = _facetas_catalogo(productos)
 
         categorias = [{'id': c.id, 'nombre': c.nombre} for c in categorias_qs]
-        proveedores_lista = [{'id': k, 'nombre': v} for k, v in proveedores.items()]
+        proveedores_lista = [{'id': f['id'], 'nombre': f['nombre']} for f in facetas['proveedores']]
+        filtros = {
+            'busqueda': busqueda,
+            'categorias': categoria_ids,
+            'proveedor': proveedor_id,
+            'precio_min': precio_min,
+            'precio_max': precio_max,
+            'disponible': disponible,
+        }
+
+        productos = productos.select_related('categoria', 'proveedor')
+
+        page_size = request.GET.get('page_size')
+        cursor = request.GET.get('cursor')
+        if page_size is None and cursor is None:
+            if busqueda:
+                productos = BusquedaProductoService.anotar_relevancia(productos, busqueda).order_by('-relevancia', 'id')
+            productos_data = [_serializar_producto_catalogo(request, p) for p in productos]
+            return JsonResponse({
+                'productos': productos_data,
+                'categorias': categorias,
+                'proveedores': proveedores_lista,
+                'total_resultados': len(productos_data),
+                'rango_precios': facetas['rango_precios'],
+                'filtros': filtros,
+            })
+
+        # Modo paginado por cursor
+        orden = request.GET.get('orden', 'nombre')
+        if orden not in ORDENES_CATALOGO:
+            raise ValueError(f'Orden no válido. Opciones: {", ".join(ORDENES_CATALOGO)}')
+        campo = ORDENES_CATALOGO[orden]
+        campo_id = '-id' if campo.startswith('-') else 'id'
+
+        try:
+            page_size = int(page_size) if page_size else CATALOGO_PAGE_SIZE_DEFAULT
+        except ValueError:
+            page_size = CATALOGO_PAGE_SIZE_DEFAULT
+        page_size = max(1, min(page_size, CATALOGO_PAGE_SIZE_MAX))
+
+        if cursor:
+            valor, id_valor = _decodificar_cursor(cursor, 2)
+            productos = productos.filter(_filtro_keyset(campo, valor, id_valor))
+
+        pagina = list(productos.order_by(campo, campo_id)[:page_size + 1])
+        hay_mas = len(pagina) > page_size
+        pagina = pagina[:page_size]
+
+        siguiente_cursor = None
+        if hay_mas:
+            ultimo = pagina[-1]
+            siguiente_cursor = _codificar_cursor([getattr(ultimo, campo.lstrip('-')), ultimo.id])
 
         return JsonResponse({
-            'productos': productos_data,
+            'productos': [_serializar_producto_catalogo(request, p) for p in pagina],
             'categorias': categorias,
             'proveedores': proveedores_lista,
-            'total_resultados': len(productos_data),
-            'rango_precios': {
-                'minimo': precio_rango_min,
-                'maximo': precio_rango_max,
+            'facetas': {
+                'proveedores': facetas['proveedores'],
+                'categorias': facetas['categorias'],
+            },
+            'total_resultados': facetas['total'],
+            'rango_precios': facetas['rango_precios'],
+            'filtros': filtros,
+            'paginacion': {
+                'orden': orden,
+                'page_size': page_size,
+                'siguiente_cursor': siguiente_cursor,
+                'hay_mas': hay_mas,
             },
-            'filtros': {
-                'busqueda': busqueda,
-                'categorias': categoria_ids,
-                'proveedor': proveedor_id,
-                'precio_min': precio_min,
-                'precio_max': precio_max,
-                'disponible': disponible,
-            }
         })
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=400)
@@ -660,39 +797,24 @@ def catalogo(request):
 def detalle_producto(request, producto_id):
     """API endpoint para obtener detalle de un producto"""
     try:
-        producto = get_object_or_404(Producto, id=producto_id, activo=True)
+        producto = get_object_or_404(Producto.objects.select_related('categoria', 'proveedor'), id=producto_id, activo=True)
         productos_relacionados = Producto.objects.filter(
             categoria=producto.categoria,
             activo=True
         ).exclude(id=producto_id)[:4]
 
-        imagen_url = ''
-        if hasattr(producto, 'imagenes') and producto.imagenes.exists():
-            primera = producto.imagenes.first()
-            if primera and getattr(primera, 'imagen', None):
-                imagen_url = request.build_absolute_uri(primera.imagen.url)
-        elif producto.imagen:
-            imagen_url = request.build_absolute_uri(producto.imagen.url)
-        if not imagen_url:
-            imagen_url = 'https://via.placeholder.com/400x250?text=Sin+imagen'
+        imagen_url = producto.obtener_url_imagen(request)
 
         relacionados = []
         for p in productos_relacionados:
-            img_url = ''
-            if hasattr(p, 'imagenes') and p.imagenes.exists():
-                primera = p.imagenes.first()
-                if primera and getattr(primera, 'imagen', None):
-                    img_url = request.build_absolute_uri(primera.imagen.url)
-            elif p.imagen:
-                img_url = request.build_absolute_uri(p.imagen.url)
-            if not img_url:
-                img_url = 'https://via.placeholder.com/400x250?text=Sin+imagen'
+            img_url = p.obtener_url_imagen(request)
             relacionados.append({
                 'id': p.id,
                 'nombre': p.nombre,
                 'precio': float(p.precio),
                 'imagen': img_url,
                 'imagen_url': p.imagen_url or img_url,
+                'imagenes': p.obtener_urls_derivados(request),
             })
 
         return JsonResponse({
@@ -706,6 +828,7 @@ def detalle_producto(request, producto_id):
                 'descripcion': producto.descripcion,
                 'imagen': imagen_url,
                 'imagen_url': producto.imagen_url or imagen_url,
+                'imagenes': producto.obtener_urls_derivados(request),
                 'categoria': {'id': producto.categoria.id, 'nombre': producto.categoria.nombre},
                 'proveedor': {'id': producto.proveedor.id, 'nombre': producto.proveedor.nombre},
                 'margen_ganancia': producto.margen_ganancia,
@@ -715,70 +838,178 @@ def detalle_producto(request, producto_id):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=400)
 
-def checkout(request):
-    """API endpoint para checkout (placeholder)"""
-    return JsonResponse({'message': 'Checkout API endpoint'})
+# Máximo de productos por solicitud en productos_lote
+PRODUCTOS_LOTE_MAX = 100
 
-def api_productos(request):
-    productos_qs = Producto.objects.filter(activo=True)
-    categorias_qs = Categoria.objects.filter(activa=True)
 
-    productos = []
-    for p in productos_qs:
-        imagen_url = ''
-        try:
-            # Primero intentar con imagen_url de la BD
-            if p.imagen_url:
-                imagen_url = p.imagen_url
-            # Si no existe imagen_url, intentar con imagenes relacionadas
-            elif hasattr(p, 'imagenes') and p.imagenes.exists():
-                primera = p.imagenes.first()
-                if primera and getattr(primera, 'imagen', None):
-                    imagen_url = request.build_absolute_uri(primera.imagen.url)
-            # Si no, usar imagen del producto
-            elif p.imagen:
-                imagen_url = request.build_absolute_uri(p.imagen.url)
-        except Exception:
-            imagen_url = ''
-        
-        # Fallback final
-        if not imagen_url:
-            imagen_url = 'https://via.placeholder.com/400x250?text=Sin+imagen'
-        
-        productos.append({
+def productos_lote(request):
+    """
+    Precio vigente, stock e imagen de varios productos (?ids=1,2,3) en dos
+    consultas, para refrescar el carrito o la lista de deseos en un solo viaje.
+    """
+    try:
+        ids = [int(valor) for valor in request.GET.get('ids', '').split(',') if valor.strip()]
+    except ValueError:
+        return JsonResponse({'error': 'ids debe ser una lista de números separados por coma'}, status=400)
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return JsonResponse({'error': 'ids es requerido'}, status=400)
+    if len(ids) > PRODUCTOS_LOTE_MAX:
+        return JsonResponse({'error': f'Máximo {PRODUCTOS_LOTE_MAX} productos por solicitud'}, status=400)
+
+    productos = Producto.objects.filter(id__in=ids).only(
+        'id', 'nombre', 'sku', 'precio', 'stock', 'activo', 'imagen_principal', 'imagen_derivados'
+    ).con_precio_vigente().in_bulk()
+
+    resultado = []
+    for producto_id in ids:
+        p = productos.get(producto_id)
+        if p is None:
+            continue
+        promocion = p.obtener_promocion_activa()
+        resultado.append({
             'id': p.id,
             'nombre': p.nombre,
             'sku': p.sku,
-            'precio': float(p.precio) if p.precio is not None else 0,
-            'costo': float(p.costo) if p.costo is not None else 0,
+            'precio': float(p.precio),
+            'precio_con_descuento': float(p.precio_con_descuento()),
+            'tiene_promocion': promocion is not None,
+            'descuento_porcentaje': float(promocion.descuento_porcentaje) if promocion else None,
             'stock': p.stock,
-            'stock_minimo': p.stock_minimo,
-            'descripcion': p.descripcion,
-            'imagen': imagen_url,
-            'imagen_url': imagen_url,
-            'categoria': {
-                'id': p.categoria.id,
-                'nombre': p.categoria.nombre,
-            },
             'activo': p.activo,
+            'disponible': p.activo and p.stock > 0,
+            'imagen': p.obtener_url_imagen(request),
+            'imagenes': p.obtener_urls_derivados(request),
         })
 
-    categorias = [{'id': c.id, 'nombre': c.nombre} for c in categorias_qs]
+    return JsonResponse({
+        'productos': resultado,
+        'no_encontrados': [producto_id for producto_id in ids if producto_id not in productos],
+    })
+
+def checkout(request):
+    """API endpoint para checkout (placeholder)"""
+    return JsonResponse({'message': 'Checkout API endpoint'})
+
+def _campos_solicitados(request, disponibles):
+    """
+    Lee la proyección ?fields=a,b,c. Retorna (campos en el orden de `disponibles`, error);
+    campos es None si no se envió el parámetro.
+    """
+    parametro = request.GET.get('fields', '').strip()
+    if not parametro:
+        return None, None
+    solicitados = {campo.strip() for campo in parametro.split(',') if campo.strip()}
+    invalidos = solicitados - set(disponibles)
+    if invalidos:
+        return None, (
+            f"Campos no válidos: {', '.join(sorted(invalidos))}. "
+            f"Disponibles: {', '.join(disponibles)}"
+        )
+    return [campo for campo in disponibles if campo in solicitados], None
+
+
+# Campo de api_productos -> (columnas del modelo que necesita, valor)
+CAMPOS_API_PRODUCTOS = {
+    'id': (('id',), lambda p, request: p.id),
+    'nombre': (('nombre',), lambda p, request: p.nombre),
+    'sku': (('sku',), lambda p, request: p.sku),
+    'precio': (('precio',), lambda p, request: float(p.precio) if p.precio is not None else 0),
+    'costo': (('costo',), lambda p, request: float(p.costo) if p.costo is not None else 0),
+    'stock': (('stock',), lambda p, request: p.stock),
+    'stock_minimo': (('stock_minimo',), lambda p, request: p.stock_minimo),
+    'descripcion': (('descripcion',), lambda p, request: p.descripcion),
+    'imagen': (('imagen_principal',), lambda p, request: p.obtener_url_imagen(request)),
+    'imagen_url': (('imagen_principal',), lambda p, request: p.obtener_url_imagen(request)),
+    'imagenes': (
+        ('imagen_principal', 'imagen_derivados'),
+        lambda p, request: p.obtener_urls_derivados(request)
+    ),
+    'categoria': (
+        ('categoria', 'categoria__nombre'),
+        lambda p, request: {'id': p.categoria.id, 'nombre': p.categoria.nombre}
+    ),
+    'activo': (('activo',), lambda p, request: p.activo),
+}
+
+
+# Filas leídas por viaje a la BD en las respuestas en streaming
+STREAMING_CHUNK_SIZE = 500
+
+
+def _solicita_streaming(request):
+    return request.GET.get('stream', '').lower() in ('1', 'true', 'si')
+
+
+def api_productos(request):
+    """
+    Productos y categorías activas (cacheado por versión del catálogo).
+    Con ?fields=id,nombre,precio solo se cargan y entregan esas columnas.
+    Con ?stream=1 el JSON se escribe mientras se recorre el queryset, sin armarlo en memoria.
+    """
+    campos, error = _campos_solicitados(request, list(CAMPOS_API_PRODUCTOS))
+    if error:
+        return JsonResponse({'error': error}, status=400)
+    campos = campos or list(CAMPOS_API_PRODUCTOS)
+
+    nombre = 'productos' if len(campos) == len(CAMPOS_API_PRODUCTOS) else 'productos:' + ','.join(campos)
+    incluye_stock = 'stock' in campos
+    if _solicita_streaming(request):
+        return respuesta_streaming(request, nombre, objeto_json([
+            ('productos', _filas_api_productos(request, campos, chunk_size=STREAMING_CHUNK_SIZE)),
+            ('categorias', _filas_api_categorias(chunk_size=STREAMING_CHUNK_SIZE)),
+        ]), incluye_stock=incluye_stock)
+    return respuesta_snapshot(
+        request, nombre, lambda: _construir_api_productos(request, campos), incluye_stock=incluye_stock
+    )
+
+
+def _filas_api_productos(request, campos, chunk_size=None):
+    """Genera los productos de api_productos; con chunk_size recorre el queryset con iterator()"""
+    columnas = {columna for campo in campos for columna in CAMPOS_API_PRODUCTOS[campo][0]}
+    productos_qs = Producto.objects.filter(activo=True)
+    if 'categoria' in campos:
+        productos_qs = productos_qs.select_related('categoria')
+    productos_qs = productos_qs.only(*columnas)
+    if chunk_size:
+        productos_qs = productos_qs.order_by('id').iterator(chunk_size=chunk_size)
+
+    valores = [(campo, CAMPOS_API_PRODUCTOS[campo][1]) for campo in campos]
+    for p in productos_qs:
+        yield {campo: valor(p, request) for campo, valor in valores}
+
 
-    return JsonResponse({'productos': productos, 'categorias': categorias}, safe=False)
+def _filas_api_categorias(chunk_size=None):
+    categorias_qs = Categoria.objects.filter(activa=True).values('id', 'nombre')
+    if chunk_size:
+        categorias_qs = categorias_qs.iterator(chunk_size=chunk_size)
+    yield from categorias_qs
 
 
+def _construir_api_productos(request, campos):
+    return {
+        'productos': list(_filas_api_productos(request, campos)),
+        'categorias': list(_filas_api_categorias()),
+    }
+
+
+def _construir_api_categorias():
+    categorias_qs = Categoria.objects.filter(activa=True).order_by('nombre')
+    categorias = [{'id': c.id, 'nombre': c.nombre} for c in categorias_qs]
+    return {
+        'success': True,
+        'categorias': categorias,
+        'total': len(categorias)
+    }
+
+
+# Endpoints públicos sin autenticación para que un 304 no consulte la sesión
 @api_view(['GET'])
+@authentication_classes([])
 def api_categorias(request):
     """Endpoint para obtener todas las categorías activas"""
     try:
-        categorias_qs = Categoria.objects.filter(activa=True).order_by('nombre')
-        categorias = [{'id': c.id, 'nombre': c.nombre} for c in categorias_qs]
-        return Response({
-            'success': True,
-            'categorias': categorias,
-            'total': len(categorias)
-        })
+        return respuesta_snapshot(request, 'categorias', _construir_api_categorias)
     except Exception as e:
         return Response({
             'success': False,
@@ -787,12 +1018,31 @@ def api_categorias(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+CAMPOS_PRODUCTOS_LISTA = ['id', 'nombre', 'sku', 'stock']
+
+
 @api_view(['GET'])
+@authentication_classes([])
 def api_productos_lista(request):
-    """Endpoint para obtener lista simple de productos activos"""
-    productos_qs = Producto.objects.filter(activo=True)
-    productos = [{'id': p.id, 'nombre': p.nombre} for p in productos_qs]
-    return Response(productos)
+    """Endpoint para obtener lista simple de productos activos (?fields= entre id, nombre, sku y stock; ?stream=1)"""
+    campos, error = _campos_solicitados(request, CAMPOS_PRODUCTOS_LISTA)
+    if error:
+        return JsonResponse({'error': error}, status=400)
+    campos = campos or ['id', 'nombre']
+
+    nombre = 'productos_lista' if campos == ['id', 'nombre'] else 'productos_lista:' + ','.join(campos)
+    incluye_stock = 'stock' in campos
+    if _solicita_streaming(request):
+        filas = Producto.objects.filter(activo=True).order_by('id').values(*campos)
+        return respuesta_streaming(
+            request, nombre, lista_json(filas.iterator(chunk_size=STREAMING_CHUNK_SIZE)), incluye_stock=incluye_stock
+        )
+    return respuesta_snapshot(
+        request,
+        nombre,
+        lambda: list(Producto.objects.filter(activo=True).values(*campos)),
+        incluye_stock=incluye_stock
+    )
 
 
 @api_view(['POST'])
@@ -984,6 +1234,58 @@ def listar_clientes(request):
 # ==================== ENDPOINTS PARA PEDIDOS Y CHECKOUT ====================
 
 @api_view(['POST'])
+def cotizar_carrito(request):
+    """
+    Cotiza el carrito completo (promociones, cupón y envío) y entrega un token
+    firmado que crear_pedido acepta sin volver a calcular precios.
+    """
+    try:
+        usuario_id = request.data.get('usuario_id')
+        region = request.data.get('region')
+        comuna = request.data.get('comuna')
+        direccion_envio_id = request.data.get('direccion_envio_id')
+
+        # Con dirección, región y comuna salen siempre de ella: el token queda ligado a la
+        # dirección y el envío no puede cotizarse para otra zona
+        if direccion_envio_id:
+            direcciones = DireccionEnvio.objects.filter(id=direccion_envio_id)
+            if usuario_id:
+                direcciones = direcciones.filter(cliente__user_id=usuario_id)
+            direccion = direcciones.values_list('region', 'comuna').first()
+            if direccion is None:
+                return Response({
+                    'success': False,
+                    'message': 'Dirección de envío no encontrada'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            region, comuna = direccion
+
+        cotizacion = CotizacionService.cotizar(
+            request.data.get('items', []),
+            codigo_cupon=request.data.get('codigo_cupon'),
+            metodo_envio=request.data.get('metodo_envio', 'estandar'),
+            region=region,
+            comuna=comuna
+        )
+
+        return Response({
+            'success': True,
+            'cotizacion': cotizacion,
+            'token': CotizacionService.firmar(cotizacion, usuario_id, direccion_envio_id),
+            'vigencia_segundos': COTIZACION_VIGENCIA_SEGUNDOS
+        })
+    except CotizacionInvalida as e:
+        return Response({
+            'success': False,
+            'message': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({
+            'success': False,
+            'message': f'Error al cotizar carrito: {str(e)}'
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['POST'])
+@idempotente('crear_pedido')
 def crear_pedido(request):
     """Crear un nuevo pedido desde el carrito"""
     if request.method == 'POST':
@@ -996,9 +1298,12 @@ def crear_pedido(request):
             costo_envio_raw = request.data.get('costo_envio', 0)
             costo_envio = Decimal(str(costo_envio_raw)) if costo_envio_raw is not None else Decimal('0')
 
+            # Token de POST /api/carrito/cotizar/; si viene, los items y precios salen de él
+            token_cotizacion = request.data.get('cotizacion')
+
             print(f"DEBUG: usuario_id={usuario_id}, items={items}")  # Debug
 
-            if not usuario_id or not items:
+            if not usuario_id or not (items or token_cotizacion):
                 return Response({
                     'success': False,
                     'message': 'Usuario_id e items son requeridos'
@@ -1008,64 +1313,35 @@ def crear_pedido(request):
             user = User.objects.get(id=usuario_id)
             cliente = Cliente.objects.get(user=user)
 
-            # Aplicar promociones a productos y calcular subtotal
-            subtotal = Decimal('0')
-            items_con_precio_actualizado = []
-            from django.db import connection
-            
-            for item in items:
-                producto = Producto.objects.get(id=item['producto_id'])
-                
-                # Verificar stock
-                if producto.stock < item['cantidad']:
-                    return Response({
-                        'success': False,
-                        'message': f'Stock insuficiente para {producto.nombre}'
-                    }, status=status.HTTP_400_BAD_REQUEST)
-                
-                # Aplicar promoción si existe
-                precio_final = producto.precio_con_descuento()  # Retorna Decimal
-                cantidad = Decimal(str(item['cantidad']))
-                subtotal_item = precio_final * cantidad
-                subtotal += subtotal_item
-                
-                items_con_precio_actualizado.append({
-                    'producto_id': producto.id,
-                    'cantidad': item['cantidad'],
-                    'precio_original': float(producto.precio),
-                    'precio_final': float(precio_final),
-                    'subtotal': float(subtotal_item)
-                })
-            
-            # Aplicar cupón si se proporciona
-            codigo_cupon_raw = request.data.get('codigo_cupon')
-            codigo_cupon = str(codigo_cupon_raw or '').strip().upper() if codigo_cupon_raw else ''
-            descuento_cupon = 0
-            cupon_usado = None
-            
-            if codigo_cupon:
-                try:
-                    cupon = Cupon.objects.get(codigo=codigo_cupon)
-                    # Convertir subtotal a float para comparación con monto_minimo
-                    subtotal_float = float(subtotal)
-                    monto_minimo_float = float(cupon.monto_minimo)
-                    
-                    if cupon.es_valido() and subtotal_float >= monto_minimo_float:
-                        descuento_decimal = cupon.calcular_descuento(subtotal_float)
-                        descuento_cupon = float(descuento_decimal)
-                        if descuento_cupon > 0:
-                            cupon_usado = cupon
-                            cupon.usar()  # Incrementar contador de usos
-                except Cupon.DoesNotExist:
-                    return Response({
-                        'success': False,
-                        'message': 'Cupón no encontrado'
-                    }, status=status.HTTP_400_BAD_REQUEST)
-                except Exception as e:
-                    return Response({
-                        'success': False,
-                        'message': f'Error al aplicar cupón: {str(e)}'
-                    }, status=status.HTTP_400_BAD_REQUEST)
+            # Precios, cupón y envío: desde la cotización firmada o calculados ahora
+            try:
+                if token_cotizacion:
+                    cotizacion = CotizacionService.leer_token(token_cotizacion, usuario_id, direccion_envio_id)
+                else:
+                    cotizacion = CotizacionService.cotizar(
+                        items,
+                        codigo_cupon=request.data.get('codigo_cupon'),
+                        metodo_envio=metodo_envio,
+                        costo_envio=costo_envio
+                    )
+            except CotizacionInvalida as e:
+                return Response({
+                    'success': False,
+                    'message': str(e)
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            items_con_precio_actualizado = [
+                {clave: linea[clave] for clave in ('producto_id', 'cantidad', 'precio_original', 'precio_final', 'subtotal')}
+                for linea in cotizacion['items']
+            ]
+            subtotal = Decimal(str(cotizacion['subtotal']))
+            descuento_decimal = Decimal(str(cotizacion['descuento']))
+            costo_envio = Decimal(str(cotizacion['costo_envio']))
+            total = Decimal(str(cotizacion['total']))
+            metodo_envio = cotizacion['metodo_envio']
+            codigo_cupon = cotizacion['cupon_aplicado'] or ''
+            cupon_usado = Cupon.objects.get(codigo=codigo_cupon) if codigo_cupon else None
+            cotizacion_id = cotizacion.get('cotizacion_id')
             
             # Obtener dirección de envío si se proporciona
             direccion_envio = None
@@ -1077,57 +1353,61 @@ def crear_pedido(request):
                         'success': False,
                         'message': 'Dirección de envío no encontrada'
                     }, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Calcular total final (convertir descuento_cupon a Decimal si es necesario)
-            descuento_decimal = Decimal(str(descuento_cupon)) if isinstance(descuento_cupon, (int, float)) else descuento_cupon
-            total = subtotal - descuento_decimal + costo_envio
-            if total < 0:
-                total = Decimal('0')
 
             # Generar número de pedido único
             numero_pedido = f"PED-{datetime.now().strftime('%Y%m%d')}-{str(uuid.uuid4())[:8].upper()}"
 
             # Crear pedido con la estructura correcta de Railway
-            # Convertir todos los valores Decimal a float para guardar en DecimalField
-            pedido = Pedido.objects.create(
-                cliente=cliente,
-                numero_pedido=numero_pedido,
-                total=float(total),
-                subtotal=float(subtotal),
-                impuesto=0,
-                descuento=float(descuento_decimal),
-                estado='pendiente',
-                metodo_pago=metodo_pago,
-                vendedor=None,  # Se asignará cuando el vendedor procese
-                direccion_envio=direccion_envio,
-                metodo_envio=metodo_envio,
-                costo_envio=float(costo_envio)
-            )
-            
-            # Crear detalles del pedido usando SQL directo con precios actualizados
-            for item_actualizado in items_con_precio_actualizado:
-                producto = Producto.objects.get(id=item_actualizado['producto_id'])
+            # Pedido, detalles, stock y uso del cupón se confirman juntos o no se aplican
+            with transaction.atomic():
+                # Convertir todos los valores Decimal a float para guardar en DecimalField
+                try:
+                    pedido = Pedido.objects.create(
+                        cliente=cliente,
+                        numero_pedido=numero_pedido,
+                        total=float(total),
+                        subtotal=float(subtotal),
+                        impuesto=0,
+                        descuento=float(descuento_decimal),
+                        estado='pendiente',
+                        metodo_pago=metodo_pago,
+                        vendedor=None,  # Se asignará cuando el vendedor procese
+                        direccion_envio=direccion_envio,
+                        metodo_envio=metodo_envio,
+                        costo_envio=float(costo_envio),
+                        # Único: si otra petición ya usó la cotización, el INSERT falla y se revierte todo
+                        cotizacion_id=cotizacion_id
+                    )
+                except IntegrityError as e:
+                    # Otra petición (o un reintento) ya creó un pedido con esta cotización
+                    if cotizacion_id and 'cotizacion_id' in str(e):
+                        raise CotizacionInvalida('La cotización ya fue usada en otro pedido, vuelve a cotizar el carrito')
+                    raise
                 
-                # Crear detalle del pedido usando SQL directo
-                with connection.cursor() as cursor:
-                    cursor.execute("""
-                        INSERT INTO inventario_detallespedido
-                        (pedido_id, producto_id, cantidad, precio_unitario, subtotal)
-                        VALUES (%s, %s, %s, %s, %s)
-                    """, [
-                        pedido.id, 
-                        producto.id, 
-                        item_actualizado['cantidad'], 
-                        item_actualizado['precio_final'], 
-                        item_actualizado['subtotal']
-                    ])
-
-                # Reducir stock
-                producto.stock -= item['cantidad']
-                producto.save()
-            
-            # Registrar auditoría de creación de pedido
-            try:
+                # Crear detalles del pedido con los precios cotizados en un solo INSERT
+                DetallesPedido.objects.bulk_create([
+                    DetallesPedido(
+                        pedido=pedido,
+                        producto_id=linea['producto_id'],
+                        cantidad=linea['cantidad'],
+                        precio_unitario=Decimal(str(linea['precio_final'])),
+                        subtotal=Decimal(str(linea['subtotal']))
+                    )
+                    for linea in items_con_precio_actualizado
+                ])
+
+                # Reducir stock de todas las líneas (bloqueo en orden de id + un solo UPDATE)
+                StockService.descontar(
+                    ((linea['producto_id'], linea['cantidad']) for linea in items_con_precio_actualizado),
+                    tipo='venta', pedido=pedido, usuario=user
+                )
+
+                # Uso del cupón con UPDATE condicional; si se agotó se revierte todo el pedido
+                if cupon_usado and not cupon_usado.usar():
+                    raise CotizacionInvalida(f'El cupón {codigo_cupon} ya alcanzó su límite de usos')
+
+                # Auditoría, log y email quedan en el outbox dentro de la misma transacción;
+                # el comando procesar_outbox los ejecuta fuera del request
                 ip_address = _get_client_ip(request)
                 user_agent = request.META.get('HTTP_USER_AGENT', '')
 
@@ -1141,50 +1421,43 @@ def crear_pedido(request):
                     'estado': pedido.estado,
                     'metodo_pago': pedido.metodo_pago,
                     'metodo_envio': pedido.metodo_envio,
-                    'cliente_email': pedido.cliente.user.email,
+                    'cliente_email': user.email,
                     'items': items_con_precio_actualizado,
                     'codigo_cupon': codigo_cupon if cupon_usado else None,
                     'direccion_envio': direccion_envio.direccion_completa if direccion_envio else None
                 }
 
-                AuditLog.registrar_cambio(
-                    usuario=user,
-                    tipo_accion='crear',
-                    modelo='Pedido',
-                    id_objeto=str(pedido.id),
-                    datos_nuevos=datos_pedido,
-                    descripcion=f'Pedido {numero_pedido} creado por {user.email} - Total: ${pedido.total}',
-                    ip_address=ip_address,
-                    user_agent=user_agent
-                )
-
-                # Registrar log del sistema
-                LogSistema.registrar_evento(
-                    nivel='info',
-                    categoria='venta',
-                    mensaje=f'Nuevo pedido {numero_pedido} creado por {user.email}',
-                    usuario=user,
-                    datos_extra={
-                        'pedido_id': pedido.id,
-                        'numero_pedido': numero_pedido,
-                        'total': float(pedido.total),
-                        'items_count': len(items)
-                    },
-                    ip_address=ip_address,
-                    user_agent=user_agent,
-                    modulo='views.checkout',
-                    funcion='crear_pedido'
+                OutboxService.guardar(
+                    OutboxService.registrar(
+                        'auditoria',
+                        usuario_id=user.id,
+                        tipo_accion='crear',
+                        modelo='Pedido',
+                        id_objeto=str(pedido.id),
+                        datos_nuevos=datos_pedido,
+                        descripcion=f'Pedido {numero_pedido} creado por {user.email} - Total: ${pedido.total}',
+                        ip_address=ip_address,
+                        user_agent=user_agent
+                    ),
+                    OutboxService.registrar(
+                        'log_sistema',
+                        nivel='info',
+                        categoria='venta',
+                        mensaje=f'Nuevo pedido {numero_pedido} creado por {user.email}',
+                        usuario_id=user.id,
+                        datos_extra={
+                            'pedido_id': pedido.id,
+                            'numero_pedido': numero_pedido,
+                            'total': float(pedido.total),
+                            'items_count': len(items_con_precio_actualizado)
+                        },
+                        ip_address=ip_address,
+                        user_agent=user_agent,
+                        modulo='views.checkout',
+                        funcion='crear_pedido'
+                    ),
+                    OutboxService.registrar('email_confirmacion_pedido', pedido_id=pedido.id)
                 )
-            except Exception as audit_error:
-                # No fallar la creación del pedido por error de auditoría
-                print(f"Error registrando auditoría de pedido: {audit_error}")
-
-            # Enviar email de confirmación al cliente
-            try:
-                EmailPedidoService.enviar_confirmacion_pedido(pedido)
-            except Exception as email_error:
-                # No fallar la creación del pedido por error de email
-                print(f"Error enviando email de confirmación: {email_error}")
 
             return Response({
                 'success': True,
@@ -1208,6 +1481,17 @@ def crear_pedido(request):
                 'success': False,
                 'message': 'Producto no encontrado'
             }, status=status.HTTP_404_NOT_FOUND)
+        except StockInsuficiente as e:
+            return Response({
+                'success': False,
+                'message': str(e),
+                'faltantes': e.faltantes
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except CotizacionInvalida as e:
+            return Response({
+                'success': False,
+                'message': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({
                 'success': False,
@@ -1216,9 +1500,21 @@ def crear_pedido(request):
     
     return Response({'error': 'Método no permitido'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
+MIS_PEDIDOS_PAGE_SIZE_DEFAULT = 20
+MIS_PEDIDOS_PAGE_SIZE_MAX = 100
+
+
 @api_view(['GET'])
 def mis_pedidos(request):
-    """Obtener todos los pedidos del usuario logueado"""
+    """
+    Obtener los pedidos del usuario logueado (pedidos y líneas en dos consultas).
+
+    Si se envía `page_size` o `cursor` la respuesta se pagina por cursor sobre
+    (fecha_pedido, id), del más reciente al más antiguo. Con `desde` (fecha ISO
+    o el cursor de `sincronizacion` de la respuesta anterior) solo se retornan
+    los pedidos creados o modificados después, del más antiguo al más reciente.
+    Sin parámetros se mantiene la respuesta completa original.
+    """
     try:
         usuario_id = request.query_params.get('usuario_id')
         
@@ -1227,53 +1523,89 @@ def mis_pedidos(request):
                 'success': False,
                 'message': 'usuario_id es requerido'
             }, status=status.HTTP_400_BAD_REQUEST)
-        
-        user = User.objects.get(id=usuario_id)
-        cliente = Cliente.objects.get(user=user)
+
+        page_size = request.query_params.get('page_size')
+        cursor = request.query_params.get('cursor')
+        desde = request.query_params.get('desde')
+        paginado = page_size is not None or cursor is not None or desde is not None
+        try:
+            page_size = int(page_size) if page_size else MIS_PEDIDOS_PAGE_SIZE_DEFAULT
+        except ValueError:
+            page_size = MIS_PEDIDOS_PAGE_SIZE_DEFAULT
+        page_size = max(1, min(page_size, MIS_PEDIDOS_PAGE_SIZE_MAX))
 
         # En el perfil personal, siempre mostrar solo los pedidos del cliente actual
         # independientemente de su rol. Los administradores que necesiten ver todos
         # los pedidos deberían usar una API diferente específicamente para eso.
-        pedidos = Pedido.objects.filter(cliente=cliente)
-        
-        pedidos_data = []
-        for pedido in pedidos:
-            # Obtener detalles del pedido usando SQL directo
-            from django.db import connection
-            detalles = []
-            with connection.cursor() as cursor:
-                cursor.execute("""
-                    SELECT dp.producto_id, p.nombre, dp.cantidad, dp.precio_unitario, dp.subtotal
-                    FROM inventario_detallespedido dp
-                    JOIN inventario_producto p ON dp.producto_id = p.id
-                    WHERE dp.pedido_id = %s
-                """, [pedido.id])
-                for row in cursor.fetchall():
-                    detalles.append({
-                        'producto_id': row[0],
-                        'producto_nombre': row[1],
-                        'cantidad': row[2],
-                        'precio_unitario': float(row[3]),
-                        'subtotal': float(row[4])
-                    })
+        pedidos = Pedido.objects.filter(cliente__user_id=usuario_id)
+
+        if desde is not None:
+            # Sincronización incremental: (fecha_actualizacion, id) ascendente
+            campo = 'fecha_actualizacion'
+            fecha_desde = parse_datetime(desde)
+            if fecha_desde is not None:
+                if timezone.is_naive(fecha_desde):
+                    fecha_desde = timezone.make_aware(fecha_desde)
+                pedidos = pedidos.filter(fecha_actualizacion__gt=fecha_desde)
+            else:
+                valor, id_valor = _decodificar_cursor(desde, 2)
+                pedidos = pedidos.filter(_filtro_keyset(campo, valor, id_valor))
+        else:
+            # Historial: (fecha_pedido, id) descendente
+            campo = '-fecha_pedido'
+            if cursor:
+                valor, id_valor = _decodificar_cursor(cursor, 2)
+                pedidos = pedidos.filter(_filtro_keyset(campo, valor, id_valor))
+        campo_id = '-id' if campo.startswith('-') else 'id'
+
+        pedidos = pedidos.order_by(campo, campo_id).values(
+            'id', 'numero_pedido', 'total', 'estado', 'metodo_pago', 'fecha_pedido', 'fecha_actualizacion',
+            'cliente__user__email', 'cliente__user__first_name', 'cliente__user__username'
+        )
+        pagina = list(pedidos[:page_size + 1] if paginado else pedidos)
+        hay_mas = paginado and len(pagina) > page_size
+        if paginado:
+            pagina = pagina[:page_size]
 
-            pedidos_data.append({
-                'pedido_id': pedido.id,
-                'numero_pedido': pedido.numero_pedido,
-                'cliente_email': pedido.cliente.user.email,
-                'cliente_nombre': pedido.cliente.user.first_name or pedido.cliente.user.username,
-                'total': float(pedido.total),
-                'estado': pedido.estado,
-                'metodo_pago': pedido.metodo_pago,
-                'fecha_pedido': pedido.fecha_pedido.isoformat(),
-                'detalles': detalles
-            })
-        
-        return Response({
+        if not pagina and not paginado:
+            # Distinguir "sin pedidos" de usuario o cliente inexistente
+            user = User.objects.get(id=usuario_id)
+            Cliente.objects.get(user=user)
+
+        detalles = CargadorDetallesPedido.cargar([pedido['id'] for pedido in pagina])
+        pedidos_data = [{
+            'pedido_id': pedido['id'],
+            'numero_pedido': pedido['numero_pedido'],
+            'cliente_email': pedido['cliente__user__email'],
+            'cliente_nombre': pedido['cliente__user__first_name'] or pedido['cliente__user__username'],
+            'total': float(pedido['total']),
+            'estado': pedido['estado'],
+            'metodo_pago': pedido['metodo_pago'],
+            'fecha_pedido': pedido['fecha_pedido'].isoformat(),
+            'fecha_actualizacion': pedido['fecha_actualizacion'].isoformat(),
+            'detalles': detalles[pedido['id']]
+        } for pedido in pagina]
+
+        respuesta = {
             'success': True,
             'total': len(pedidos_data),
             'pedidos': pedidos_data
-        }, status=status.HTTP_200_OK)
+        }
+        if desde is not None:
+            # Cursor a guardar para la próxima sincronización (se mantiene si no hubo cambios)
+            ultimo = pagina[-1] if pagina else None
+            respuesta['sincronizacion'] = {
+                'cursor': _codificar_cursor([ultimo['fecha_actualizacion'], ultimo['id']]) if ultimo else desde,
+                'hay_mas': hay_mas,
+            }
+        elif paginado:
+            ultimo = pagina[-1] if hay_mas else None
+            respuesta['paginacion'] = {
+                'page_size': page_size,
+                'siguiente_cursor': _codificar_cursor([ultimo['fecha_pedido'], ultimo['id']]) if ultimo else None,
+                'hay_mas': hay_mas,
+            }
+        return Response(respuesta, status=status.HTTP_200_OK)
     
     except User.DoesNotExist:
         return Response({
@@ -1285,6 +1617,11 @@ def mis_pedidos(request):
             'success': False,
             'message': 'Cliente no encontrado'
         }, status=status.HTTP_404_NOT_FOUND)
+    except ValueError as e:
+        return Response({
+            'success': False,
+            'message': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response({
             'success': False,
@@ -1586,95 +1923,105 @@ def cambiar_estado_pedido(request):
                 'message': f'Estado no válido. Estados permitidos: {", ".join(estados_permitidos)}'
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # Obtener y validar pedido
-        try:
-            pedido = Pedido.objects.get(id=pedido_id)
-        except Pedido.DoesNotExist:
-            return Response({
-                'success': False,
-                'message': 'Pedido no encontrado.'
-            }, status=status.HTTP_404_NOT_FOUND)
-
-        estado_anterior = pedido.estado
-
-        # Validar transiciones de estado permitidas
-        if nuevo_estado == 'pagado':
-            if pedido.estado != 'pendiente':
-                return Response({
-                    'success': False,
-                    'message': f'No se puede marcar como pagado un pedido que está en estado "{pedido.get_estado_display()}".'
-                }, status=status.HTTP_400_BAD_REQUEST)
-        elif nuevo_estado == 'en_preparacion':
-            if pedido.estado not in ['pendiente', 'pagado']:
-                return Response({
-                    'success': False,
-                    'message': f'No se puede marcar como en preparación un pedido que está en estado "{pedido.get_estado_display()}".'
-                }, status=status.HTTP_400_BAD_REQUEST)
-        elif nuevo_estado == 'enviado':
-            if pedido.estado not in ['pagado', 'en_preparacion']:
-                return Response({
-                    'success': False,
-                    'message': f'No se puede marcar como enviado un pedido que está en estado "{pedido.get_estado_display()}".'
-                }, status=status.HTTP_400_BAD_REQUEST)
-        elif nuevo_estado == 'entregado':
-            if pedido.estado != 'enviado':
-                return Response({
-                    'success': False,
-                    'message': f'No se puede marcar como entregado un pedido que está en estado "{pedido.get_estado_display()}".'
-                }, status=status.HTTP_400_BAD_REQUEST)
-        elif nuevo_estado == 'cancelado':
-            if pedido.estado == 'entregado':
+        # El pedido se lee bloqueado: dos solicitudes concurrentes no validan el mismo estado anterior
+        # (p. ej. dos cancelaciones que repondrían el stock dos veces)
+        with transaction.atomic():
+            # Obtener y validar pedido
+            try:
+                pedido = Pedido.objects.select_for_update().get(id=pedido_id)
+            except Pedido.DoesNotExist:
                 return Response({
                     'success': False,
-                    'message': 'No se puede cancelar un pedido que ya fue entregado.'
-                }, status=status.HTTP_400_BAD_REQUEST)
+                    'message': 'Pedido no encontrado.'
+                }, status=status.HTTP_404_NOT_FOUND)
 
-        # Aplicar cambio de estado
-        if nuevo_estado == 'pagado':
-            pedido.marcar_como_pagado()
-        elif nuevo_estado == 'en_preparacion':
-            pedido.estado = 'en_preparacion'
-            pedido.save()
-        elif nuevo_estado == 'enviado':
-            pedido.marcar_como_enviado()
-        elif nuevo_estado == 'entregado':
-            pedido.marcar_como_entregado()
-        elif nuevo_estado == 'cancelado':
-            pedido.estado = 'cancelado'
-            pedido.save()
+            estado_anterior = pedido.estado
 
-        # Registrar en auditoría
-        from .models import AuditLog
-        AuditLog.registrar_cambio(
-            usuario=user,
-            tipo_accion='modificar',
-            modelo='Pedido',
-            id_objeto=pedido.id,
-            datos_anteriores={'estado': estado_anterior},
-            datos_nuevos={'estado': nuevo_estado},
-            descripcion=f'Pedido {pedido.numero_pedido} cambió de estado "{estado_anterior}" a "{nuevo_estado}" por {user.username}'
-        )
+            # Validar transiciones de estado permitidas
+            if nuevo_estado == 'pagado':
+                if pedido.estado != 'pendiente':
+                    return Response({
+                        'success': False,
+                        'message': f'No se puede marcar como pagado un pedido que está en estado "{pedido.get_estado_display()}".'
+                    }, status=status.HTTP_400_BAD_REQUEST)
+            elif nuevo_estado == 'en_preparacion':
+                if pedido.estado not in ['pendiente', 'pagado']:
+                    return Response({
+                        'success': False,
+                        'message': f'No se puede marcar como en preparación un pedido que está en estado "{pedido.get_estado_display()}".'
+                    }, status=status.HTTP_400_BAD_REQUEST)
+            elif nuevo_estado == 'enviado':
+                if pedido.estado not in ['pagado', 'en_preparacion']:
+                    return Response({
+                        'success': False,
+                        'message': f'No se puede marcar como enviado un pedido que está en estado "{pedido.get_estado_display()}".'
+                    }, status=status.HTTP_400_BAD_REQUEST)
+            elif nuevo_estado == 'entregado':
+                if pedido.estado != 'enviado':
+                    return Response({
+                        'success': False,
+                        'message': f'No se puede marcar como entregado un pedido que está en estado "{pedido.get_estado_display()}".'
+                    }, status=status.HTTP_400_BAD_REQUEST)
+            elif nuevo_estado == 'cancelado':
+                if pedido.estado == 'entregado':
+                    return Response({
+                        'success': False,
+                        'message': 'No se puede cancelar un pedido que ya fue entregado.'
+                    }, status=status.HTTP_400_BAD_REQUEST)
 
-        # Enviar notificación por email al cliente según el cambio de estado
-        emails_enviados = []
-        try:
-            emails_enviados = EmailPedidoService.enviar_notificacion_por_estado(
-                pedido, estado_anterior, nuevo_estado
-            )
-        except Exception as email_error:
-            # No fallar el cambio de estado por error de email
-            print(f"Error enviando email de notificación: {email_error}")
+            # Aplicar cambio de estado
+            if nuevo_estado == 'pagado':
+                pedido.marcar_como_pagado()
+            elif nuevo_estado == 'en_preparacion':
+                pedido.estado = 'en_preparacion'
+                pedido.save()
+            elif nuevo_estado == 'enviado':
+                pedido.marcar_como_enviado()
+            elif nuevo_estado == 'entregado':
+                pedido.marcar_como_entregado()
+            elif nuevo_estado == 'cancelado':
+                pedido.estado = 'cancelado'
+                pedido.save()
+                # El stock descontado al crear el pedido vuelve al inventario
+                if estado_anterior != 'cancelado':
+                    StockService.reponer_pedido(pedido, tipo='cancelacion', usuario=user)
+
+            # Registrar en auditoría
+            eventos = [
+                OutboxService.registrar(
+                    'auditoria',
+                    usuario_id=user.id,
+                    tipo_accion='modificar',
+                    modelo='Pedido',
+                    id_objeto=str(pedido.id),
+                    datos_anteriores={'estado': estado_anterior},
+                    datos_nuevos={'estado': nuevo_estado},
+                    descripcion=f'Pedido {pedido.numero_pedido} cambió de estado "{estado_anterior}" a "{nuevo_estado}" por {user.username}'
+                )
+            ]
+
+            # Notificación por email al cliente según el cambio de estado
+            email_programado = EmailPedidoService.notifica_estado(estado_anterior, nuevo_estado)
+            if email_programado:
+                eventos.append(OutboxService.registrar(
+                    'email_estado_pedido',
+                    pedido_id=pedido.id,
+                    estado_anterior=estado_anterior,
+                    estado_nuevo=nuevo_estado
+                ))
+            OutboxService.guardar(*eventos)
 
         mensaje_respuesta = f'Pedido {pedido.numero_pedido} cambió a estado "{pedido.get_estado_display()}" exitosamente.'
-        if emails_enviados:
-            mensaje_respuesta += f' Se notificó al cliente por email.'
+        if email_programado:
+            mensaje_respuesta += f' Se notificará al cliente por email.'
 
         return Response({
             'success': True,
             'message': mensaje_respuesta,
             'estado': pedido.estado,
             'estado_display': pedido.get_estado_display(),
-            'email_enviado': len(emails_enviados) > 0
+            # El email se envía desde el outbox; indica que quedó programado
+            'email_enviado': email_programado
         }, status=status.HTTP_200_OK)
 
     except User.DoesNotExist:
@@ -1691,6 +2038,165 @@ def cambiar_estado_pedido(request):
         },         status=status.HTTP_400_BAD_REQUEST)
 
 
+PEDIDOS_ESTADO_LOTE_MAX = 500
+
+
+@api_view(['POST'])
+@idempotente('pedidos_estado_lote')
+def cambiar_estado_pedidos_lote(request):
+    """
+    Cambia el estado de varios pedidos a la vez (p. ej. marcar como enviados
+    los pedidos de un despacho).
+
+    Recibe {'usuario_id', 'estado', 'pedido_ids': [...]} y retorna un resultado
+    por pedido. Los pedidos se leen y bloquean en una consulta y se actualizan
+    con un único UPDATE restringido a los estados desde los que la transición
+    es válida. Las cancelaciones reponen el stock de todos los pedidos juntos;
+    la auditoría y los emails se encolan en el outbox con un solo INSERT.
+    """
+    usuario_id = request.data.get('usuario_id')
+    nuevo_estado = request.data.get('estado')
+    pedido_ids = request.data.get('pedido_ids')
+
+    if not usuario_id or not nuevo_estado:
+        return Response({
+            'success': False,
+            'message': 'usuario_id y estado son requeridos'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    if not isinstance(pedido_ids, list) or not pedido_ids:
+        return Response({
+            'success': False,
+            'message': 'pedido_ids debe ser una lista con al menos un pedido'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    if len(pedido_ids) > PEDIDOS_ESTADO_LOTE_MAX:
+        return Response({
+            'success': False,
+            'message': f'Se permiten como máximo {PEDIDOS_ESTADO_LOTE_MAX} pedidos por lote'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    predecesores = PREDECESORES_ESTADO.get(nuevo_estado)
+    if predecesores is None:
+        return Response({
+            'success': False,
+            'message': f'Estado no válido. Estados permitidos: {", ".join(PREDECESORES_ESTADO)}'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        # dict.fromkeys quita duplicados conservando el orden recibido
+        pedido_ids = list(dict.fromkeys(int(pedido_id) for pedido_id in pedido_ids))
+    except (TypeError, ValueError):
+        return Response({
+            'success': False,
+            'message': 'pedido_ids debe contener solo ids numéricos'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        user = User.objects.get(id=usuario_id)
+    except (User.DoesNotExist, ValueError):
+        return Response({
+            'success': False,
+            'message': 'Usuario no encontrado'
+        }, status=status.HTTP_404_NOT_FOUND)
+
+    # Mismos permisos que cambiar_estado_pedido
+    if not (user.is_superuser or user.is_staff):
+        rol = Cliente.objects.filter(user=user).values_list('rol', flat=True).first()
+        if rol not in ['vendedor', 'gerente', 'admin_sistema']:
+            return Response({
+                'success': False,
+                'message': 'Acceso denegado. Solo vendedores, gerentes y administradores pueden cambiar estados de pedidos.'
+            }, status=status.HTTP_403_FORBIDDEN)
+
+    estados = dict(Pedido._meta.get_field('estado').choices)
+    resultados = []
+    with transaction.atomic():
+        pedidos = Pedido.objects.select_for_update().filter(id__in=pedido_ids).only(
+            'id', 'numero_pedido', 'estado'
+        ).order_by('id').in_bulk()
+
+        aplicables = [
+            pedidos[pedido_id] for pedido_id in pedido_ids
+            if pedido_id in pedidos and pedidos[pedido_id].estado in predecesores
+        ]
+        if aplicables:
+            cambios = {'estado': nuevo_estado, 'fecha_actualizacion': timezone.now()}
+            if nuevo_estado == 'entregado':
+                cambios['fecha_entrega_real'] = timezone.localdate()
+            # update() no pasa por save(): fecha_actualizacion (auto_now) se fija explícitamente
+            Pedido.objects.filter(
+                id__in=[pedido.id for pedido in aplicables],
+                estado__in=predecesores
+            ).update(**cambios)
+
+            if nuevo_estado == 'cancelado':
+                # El stock descontado al crear los pedidos vuelve al inventario
+                StockService.reponer_pedidos(aplicables, tipo='cancelacion', usuario=user)
+
+            eventos = []
+            notifica = {}
+            for pedido in aplicables:
+                eventos.append(OutboxService.registrar(
+                    'auditoria',
+                    usuario_id=user.id,
+                    tipo_accion='modificar',
+                    modelo='Pedido',
+                    id_objeto=str(pedido.id),
+                    datos_anteriores={'estado': pedido.estado},
+                    datos_nuevos={'estado': nuevo_estado},
+                    descripcion=f'Pedido {pedido.numero_pedido} cambió de estado "{pedido.estado}" a "{nuevo_estado}" por {user.username} (lote)'
+                ))
+                notifica[pedido.id] = EmailPedidoService.notifica_estado(pedido.estado, nuevo_estado)
+                if notifica[pedido.id]:
+                    eventos.append(OutboxService.registrar(
+                        'email_estado_pedido',
+                        pedido_id=pedido.id,
+                        estado_anterior=pedido.estado,
+                        estado_nuevo=nuevo_estado
+                    ))
+            OutboxService.guardar(*eventos)
+
+    for pedido_id in pedido_ids:
+        pedido = pedidos.get(pedido_id)
+        if pedido is None:
+            resultados.append({'pedido_id': pedido_id, 'success': False, 'message': 'Pedido no encontrado.'})
+        elif pedido.estado not in predecesores:
+            if pedido.estado == nuevo_estado:
+                mensaje = f'El pedido ya está en estado "{estados[nuevo_estado]}".'
+            else:
+                mensaje = f'No se puede pasar de "{estados.get(pedido.estado, pedido.estado)}" a "{estados[nuevo_estado]}".'
+            resultados.append({
+                'pedido_id': pedido_id,
+                'numero_pedido': pedido.numero_pedido,
+                'success': False,
+                'estado': pedido.estado,
+                'message': mensaje
+            })
+        else:
+            resultados.append({
+                'pedido_id': pedido_id,
+                'numero_pedido': pedido.numero_pedido,
+                'success': True,
+                'estado_anterior': pedido.estado,
+                'estado': nuevo_estado,
+                # El email se envía desde el outbox; indica que quedó programado
+                'email_enviado': notifica[pedido_id]
+            })
+
+    actualizados = sum(1 for r in resultados if r['success'])
+    return Response({
+        'success': True,
+        'message': f'{actualizados} de {len(resultados)} pedidos cambiaron a estado "{estados[nuevo_estado]}".',
+        'resumen': {
+            'recibidos': len(resultados),
+            'actualizados': actualizados,
+            'rechazados': len(resultados) - actualizados,
+        },
+        'resultados': resultados
+    }, status=status.HTTP_200_OK)
+
+
 @api_view(['POST'])
 def confirmar_envio_pedido(request):
     """
@@ -1798,11 +2304,33 @@ def confirmar_envio_pedido(request):
         }, status=status.HTTP_400_BAD_REQUEST)
 
 
+PEDIDOS_GESTION_PAGE_SIZE_DEFAULT = 50
+PEDIDOS_GESTION_PAGE_SIZE_MAX = 200
+
+
+def _fecha_filtro(valor, fin_de_dia=False):
+    """Fecha (YYYY-MM-DD) o fecha y hora ISO de un filtro; una fecha sola en `fin_de_dia` incluye todo el día"""
+    dia = parse_date(valor)
+    if dia is not None:
+        fecha = datetime.combine(dia + timedelta(days=1) if fin_de_dia else dia, datetime.min.time())
+    else:
+        fecha = parse_datetime(valor)
+        if fecha is None:
+            raise ValueError(f'Fecha inválida: {valor}')
+    if timezone.is_naive(fecha):
+        fecha = timezone.make_aware(fecha)
+    return fecha
+
+
 @api_view(['GET'])
 def listar_pedidos_gestion(request):
     """
     API endpoint para listar pedidos individuales para gestión administrativa.
     HU 50: Gestión de pedidos desde dashboard administrativo
+
+    Paginado por cursor sobre (fecha_pedido, id), del más reciente al más
+    antiguo. Filtros opcionales: estado, fecha_desde, fecha_hasta (YYYY-MM-DD
+    incluye todo el día), vendedor_id, metodo_envio y metodo_pago.
     """
     try:
         usuario_id = request.query_params.get('usuario_id')
@@ -1830,42 +2358,86 @@ def listar_pedidos_gestion(request):
                     'message': 'Acceso denegado. Solo vendedores, gerentes y administradores pueden gestionar pedidos.'
                 }, status=status.HTTP_403_FORBIDDEN)
 
-        # Construir queryset base
-        pedidos = Pedido.objects.select_related('cliente__user', 'vendedor__user').prefetch_related('detalles')
+        page_size = request.query_params.get('page_size')
+        cursor = request.query_params.get('cursor')
+        try:
+            page_size = int(page_size) if page_size else PEDIDOS_GESTION_PAGE_SIZE_DEFAULT
+        except ValueError:
+            page_size = PEDIDOS_GESTION_PAGE_SIZE_DEFAULT
+        page_size = max(1, min(page_size, PEDIDOS_GESTION_PAGE_SIZE_MAX))
+
+        pedidos = Pedido.objects.all()
 
-        # Aplicar filtro de estado
+        # Filtros; cada combinación (estado | vendedor) + fecha_pedido tiene su índice
         if estado_filtro and estado_filtro != 'todos':
             pedidos = pedidos.filter(estado=estado_filtro)
+        fecha_desde = request.query_params.get('fecha_desde')
+        if fecha_desde:
+            pedidos = pedidos.filter(fecha_pedido__gte=_fecha_filtro(fecha_desde))
+        fecha_hasta = request.query_params.get('fecha_hasta')
+        if fecha_hasta:
+            pedidos = pedidos.filter(fecha_pedido__lt=_fecha_filtro(fecha_hasta, fin_de_dia=True))
+        vendedor_id = request.query_params.get('vendedor_id')
+        if vendedor_id:
+            pedidos = pedidos.filter(vendedor_id=int(vendedor_id))
+        for campo in ('metodo_envio', 'metodo_pago'):
+            valor = request.query_params.get(campo)
+            if valor:
+                pedidos = pedidos.filter(**{campo: valor})
+
+        if cursor:
+            valor, id_valor = _decodificar_cursor(cursor, 2)
+            pedidos = pedidos.filter(_filtro_keyset('-fecha_pedido', valor, id_valor))
+
+        # Subconsulta correlacionada: solo se evalúa para las filas de la página
+        total_productos = DetallesPedido.objects.filter(pedido=OuterRef('pk')).values('pedido').annotate(
+            total=Sum('cantidad')
+        ).values('total')
+        pedidos = pedidos.annotate(
+            total_productos=Coalesce(Subquery(total_productos, output_field=IntegerField()), 0)
+        ).order_by('-fecha_pedido', '-id').values(
+            'id', 'numero_pedido', 'total', 'estado', 'fecha_pedido', 'metodo_pago', 'metodo_envio',
+            'total_productos', 'cliente__user__email', 'cliente__user__first_name',
+            'cliente__user__last_name', 'cliente__user__username',
+            'vendedor__user__first_name', 'vendedor__user__last_name'
+        )
+        pagina = list(pedidos[:page_size + 1])
+        hay_mas = len(pagina) > page_size
+        pagina = pagina[:page_size]
 
-        # Ordenar por fecha descendente y limitar a 50 resultados
-        pedidos = pedidos.order_by('-fecha_pedido')[:50]
-
-        # Serializar pedidos
+        estados = dict(Pedido._meta.get_field('estado').choices)
         pedidos_data = []
-        for pedido in pedidos:
-            # Calcular total de productos
-            total_productos = sum(detalle.cantidad for detalle in pedido.detalles.all())
-
+        for pedido in pagina:
+            cliente_nombre = f"{pedido['cliente__user__first_name']} {pedido['cliente__user__last_name']}".strip()
+            vendedor = None
+            if pedido['vendedor__user__first_name'] is not None:
+                vendedor = f"{pedido['vendedor__user__first_name']} {pedido['vendedor__user__last_name']}".strip()
             pedidos_data.append({
-                'id': pedido.id,
-                'numero_pedido': pedido.numero_pedido,
-                'cliente_email': pedido.cliente.user.email,
-                'cliente_nombre': pedido.cliente.user.get_full_name() or pedido.cliente.user.username,
-                'vendedor': pedido.vendedor.user.get_full_name() if pedido.vendedor else None,
-                'total': float(pedido.total),
-                'estado': pedido.estado,
-                'estado_display': pedido.get_estado_display(),
-                'fecha_pedido': pedido.fecha_pedido.isoformat(),
-                'metodo_pago': pedido.metodo_pago,
-                'metodo_envio': pedido.metodo_envio or 'N/A',
-                'total_productos': total_productos
+                'id': pedido['id'],
+                'numero_pedido': pedido['numero_pedido'],
+                'cliente_email': pedido['cliente__user__email'],
+                'cliente_nombre': cliente_nombre or pedido['cliente__user__username'],
+                'vendedor': vendedor,
+                'total': float(pedido['total']),
+                'estado': pedido['estado'],
+                'estado_display': estados.get(pedido['estado'], pedido['estado']),
+                'fecha_pedido': pedido['fecha_pedido'].isoformat(),
+                'metodo_pago': pedido['metodo_pago'],
+                'metodo_envio': pedido['metodo_envio'] or 'N/A',
+                'total_productos': pedido['total_productos']
             })
 
+        ultimo = pagina[-1] if hay_mas else None
         return Response({
             'success': True,
             'pedidos': pedidos_data,
             'total': len(pedidos_data),
-            'filtro_estado': estado_filtro
+            'filtro_estado': estado_filtro,
+            'paginacion': {
+                'page_size': page_size,
+                'siguiente_cursor': _codificar_cursor([ultimo['fecha_pedido'], ultimo['id']]) if ultimo else None,
+                'hay_mas': hay_mas,
+            }
         }, status=status.HTTP_200_OK)
 
     except User.DoesNotExist:
@@ -1873,6 +2445,11 @@ def listar_pedidos_gestion(request):
             'success': False,
             'message': 'Usuario no encontrado'
         }, status=status.HTTP_404_NOT_FOUND)
+    except ValueError as e:
+        return Response({
+            'success': False,
+            'message': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -1911,13 +2488,21 @@ def actualizar_producto(request, producto_id):
             producto.precio = request.data['precio']
         
         if 'stock' in request.data and request.data['stock'] is not None:
-            producto.stock = request.data['stock']
+            _, producto.stock = StockService.ajustar(
+                producto.id, request.data['stock'],
+                usuario=cliente.user if usuario_id else None,
+                motivo='Edición del producto'
+            )
         
         # Guardar URL de imagen en el campo imagen_url
         if 'imagen_url' in request.data and request.data['imagen_url']:
             producto.imagen_url = request.data['imagen_url']
         
-        producto.save()
+        # El stock ya se fijó con StockService.ajustar; no se reescribe el valor leído arriba
+        producto.save(update_fields=[
+            'nombre', 'descripcion', 'precio', 'imagen_url',
+            'imagen_principal', 'imagen_derivados', 'derivados_pendientes'
+        ])
         
         return Response({
             'success': True,
@@ -1990,21 +2575,22 @@ def catalogo_admin(request):
             search = request.query_params.get('search', '')
             
             # Filtrar productos
-            queryset = Producto.objects.all()
+            queryset = Producto.objects.select_related('categoria', 'proveedor')
+            search = search.strip()
             
             if search:
-                queryset = queryset.filter(
-                    Q(nombre__icontains=search) |
-                    Q(sku__icontains=search) |
-                    Q(descripcion__icontains=search)
-                )
+                queryset = queryset.filter(BusquedaProductoService.filtro(search))
             
             # Contar total
             total = queryset.count()
             
-            # Paginar
+            # Paginar (por relevancia si hay búsqueda)
             offset = (page - 1) * limit
-            productos = queryset.order_by('-fecha_creacion')[offset:offset + limit]
+            if search:
+                queryset = BusquedaProductoService.anotar_relevancia(queryset, search).order_by('-relevancia', '-fecha_creacion')
+            else:
+                queryset = queryset.order_by('-fecha_creacion')
+            productos = queryset[offset:offset + limit]
             
             productos_data = []
             for producto in productos:
@@ -2435,8 +3021,10 @@ def actualizar_stock_producto(request, producto_id):
                 'message': 'nuevo_stock es requerido'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        producto.stock = int(nuevo_stock)
-        producto.save()
+        # Ajuste relativo con la fila bloqueada, registrado como movimiento de stock
+        _, producto.stock = StockService.ajustar(
+            producto.id, nuevo_stock, usuario=cliente.user, motivo='Actualización de stock'
+        )
         
         return Response({
             'success': True,
@@ -2450,19 +3038,97 @@ def actualizar_stock_producto(request, producto_id):
     except Producto.DoesNotExist:
         return Response({
             'success': False,
-            'message': 'Producto no encontrado'
-        }, status=status.HTTP_404_NOT_FOUND)
+            'message': 'Producto no encontrado'
+        }, status=status.HTTP_404_NOT_FOUND)
+    except Cliente.DoesNotExist:
+        return Response({
+            'success': False,
+            'message': 'Cliente no encontrado'
+        }, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        return Response({
+            'success': False,
+            'message': f'Error: {str(e)}'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+
+# Máximo de alertas por página en alertas_stock_bajo
+ALERTAS_STOCK_LIMITE_MAX = 200
+# Las alertas se crean dentro de transacciones de stock (pedidos, ventas POS) y sus ids
+# pueden confirmarse fuera de orden; el feed solo entrega alertas con esta antigüedad
+ALERTAS_STOCK_RETARDO_SEGUNDOS = 30
+
+
+@api_view(['GET'])
+def alertas_stock_bajo(request):
+    """
+    Feed incremental de productos que cruzaron su stock mínimo.
+    Parámetros: usuario_id, desde (id de la última alerta recibida), limite,
+    incluir_resueltas (1 para incluir las ya repuestas).
+
+    Garantía: una alerta aparece ALERTAS_STOCK_RETARDO_SEGUNDOS después de crearse.
+    Pasado ese margen su transacción ya se confirmó, así que ninguna alerta con id
+    menor al cursor puede aparecer después y quien pagina con `desde` no pierde
+    alertas (siempre que las transacciones de stock duren menos que el margen).
+    """
+    usuario_id = request.query_params.get('usuario_id')
+    if not usuario_id:
+        return Response({
+            'success': False,
+            'message': 'usuario_id es requerido'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        cliente = Cliente.objects.get(user_id=usuario_id)
     except Cliente.DoesNotExist:
         return Response({
             'success': False,
             'message': 'Cliente no encontrado'
         }, status=status.HTTP_404_NOT_FOUND)
-    except Exception as e:
+    if cliente.rol not in ['vendedor', 'gerente', 'admin_sistema']:
         return Response({
             'success': False,
-            'message': f'Error: {str(e)}'
+            'message': 'No tienes permisos para ver las alertas de stock'
+        }, status=status.HTTP_403_FORBIDDEN)
+
+    try:
+        desde = int(request.query_params.get('desde', 0))
+        limite = min(max(int(request.query_params.get('limite', 50)), 1), ALERTAS_STOCK_LIMITE_MAX)
+    except ValueError:
+        return Response({
+            'success': False,
+            'message': 'desde y limite deben ser numéricos'
         }, status=status.HTTP_400_BAD_REQUEST)
 
+    corte = timezone.now() - timedelta(seconds=ALERTAS_STOCK_RETARDO_SEGUNDOS)
+    alertas = AlertaStockBajo.objects.filter(id__gt=desde, fecha_creacion__lte=corte).order_by('id')
+    if request.query_params.get('incluir_resueltas') != '1':
+        alertas = alertas.filter(resuelta=False)
+    alertas = list(alertas.values(
+        'id', 'producto_id', 'producto__nombre', 'producto__sku', 'producto__stock',
+        'stock', 'stock_minimo', 'fecha_creacion', 'resuelta', 'fecha_resuelta'
+    )[:limite])
+
+    return Response({
+        'success': True,
+        'alertas': [{
+            'id': a['id'],
+            'producto_id': a['producto_id'],
+            'nombre': a['producto__nombre'],
+            'sku': a['producto__sku'],
+            'stock_actual': a['producto__stock'],
+            'stock_al_alertar': a['stock'],
+            'stock_minimo': a['stock_minimo'],
+            'fecha': a['fecha_creacion'],
+            'resuelta': a['resuelta'],
+            'fecha_resuelta': a['fecha_resuelta'],
+        } for a in alertas],
+        # Cursor para la siguiente consulta (?desde=)
+        'siguiente': alertas[-1]['id'] if alertas else desde,
+        'hay_mas': len(alertas) == limite,
+        'productos_stock_bajo': Producto.objects.con_stock_bajo().count()
+    })
+
 
 @api_view(['GET', 'DELETE'])
 def obtener_eliminar_producto(request, producto_id):
@@ -3150,7 +3816,7 @@ def dashboard_admin_estadisticas(request):
         )['total'] or 0
 
         # Productos con stock bajo
-        productos_stock_bajo = Producto.objects.filter(activo=True, stock__lte=F('stock_minimo')).count()
+        productos_stock_bajo = Producto.objects.con_stock_bajo().count()
 
         # Pedidos por mes (últimos 12 meses)
         from datetime import datetime, timedelta
@@ -4055,20 +4721,22 @@ def detalle_cliente(request, cliente_id):
                         'pedidos_donde_aparece': row[4]
                     })
 
-        # Historial de pedidos (últimos 20)
+        # Historial de pedidos (últimos 20), con sus líneas en una sola consulta
         historial_pedidos = []
-        for pedido in pedidos_cliente.order_by('-fecha_pedido')[:20]:
+        ultimos_pedidos = list(pedidos_cliente.order_by('-fecha_pedido')[:20])
+        cargador = CargadorDetallesPedido(pedido.id for pedido in ultimos_pedidos)
+        for pedido in ultimos_pedidos:
             detalles_pedido = []
-            for detalle in pedido.detalles.all():
+            for detalle in cargador.obtener(pedido.id):
                 detalles_pedido.append({
                     'producto': {
-                        'id': detalle.producto.id,
-                        'nombre': detalle.producto.nombre,
-                        'sku': getattr(detalle.producto, 'sku', 'N/A')
+                        'id': detalle['producto_id'],
+                        'nombre': detalle['producto_nombre'],
+                        'sku': detalle['producto_sku'] or 'N/A'
                     },
-                    'cantidad': detalle.cantidad,
-                    'precio_unitario': float(detalle.precio_unitario),
-                    'subtotal': float(detalle.subtotal)
+                    'cantidad': detalle['cantidad'],
+                    'precio_unitario': detalle['precio_unitario'],
+                    'subtotal': detalle['subtotal']
                 })
 
             historial_pedidos.append({
@@ -4132,6 +4800,11 @@ def buscar_clientes(request):
     """
     API endpoint para buscar clientes por email o nombre.
     HU 23: Buscador de clientes por email/nombre en Dashboard
+
+    Cada palabra de `q` debe aparecer en el email, nombre, apellido o usuario
+    (índices de trigramas sobre auth_user, migración 0025). Primero van las
+    coincidencias exactas, luego las que empiezan con el texto buscado y al
+    final el resto. Las estadísticas de pedidos salen de la misma consulta.
     """
     try:
         usuario_id = request.query_params.get('user_id')
@@ -4159,35 +4832,43 @@ def buscar_clientes(request):
                 'message': 'Acceso denegado. Solo vendedores, gerentes y administradores pueden buscar clientes.'
             }, status=status.HTTP_403_FORBIDDEN)
 
-        # Buscar clientes
-        clientes = Cliente.objects.select_related('user').filter(rol='cliente')
-
-        if query:
-            # Buscar por email, nombre o apellido
-            clientes = clientes.filter(
-                Q(user__email__icontains=query) |
-                Q(user__first_name__icontains=query) |
-                Q(user__last_name__icontains=query) |
-                Q(user__username__icontains=query)
-            )
+        # Buscar clientes; estadísticas de pedidos pagados en la misma consulta
+        pagados = Q(pedidos__estado__in=['pagado', 'en_preparacion', 'enviado', 'entregado'])
+        clientes = Cliente.objects.select_related('user').filter(rol='cliente').annotate(
+            total_pedidos=Count('pedidos', filter=pagados),
+            total_gastado=Sum('pedidos__total', filter=pagados)
+        )
 
-        # Limitar resultados y ordenar
-        clientes = clientes.order_by('-user__date_joined')[:50]
+        campos = ('user__email', 'user__first_name', 'user__last_name', 'user__username')
+        terminos = query.split()
+        if terminos:
+            # Cada palabra debe coincidir con alguno de los campos ('juan pér' encuentra a Juan Pérez)
+            for termino in terminos:
+                condicion = Q()
+                for campo in campos:
+                    condicion |= Q(**{f'{campo}__icontains': termino})
+                clientes = clientes.filter(condicion)
+
+            # Orden: algún campo igual a la primera palabra, luego algún campo que empieza con ella, luego el resto
+            exacto = Q(user__email__iexact=query)
+            prefijo = Q()
+            for campo in campos:
+                exacto |= Q(**{f'{campo}__iexact': terminos[0]})
+                prefijo |= Q(**{f'{campo}__istartswith': terminos[0]})
+            clientes = clientes.annotate(
+                coincidencia=Case(
+                    When(exacto, then=Value(0)),
+                    When(prefijo, then=Value(1)),
+                    default=Value(2),
+                    output_field=IntegerField()
+                )
+            ).order_by('coincidencia', '-user__date_joined')
+        else:
+            clientes = clientes.order_by('-user__date_joined')
 
-        # Serializar resultados
+        # Limitar resultados y serializar
         resultados = []
-        for cliente in clientes:
-            # Estadísticas rápidas
-            pedidos_count = Pedido.objects.filter(
-                cliente=cliente,
-                estado__in=['pagado', 'en_preparacion', 'enviado', 'entregado']
-            ).count()
-
-            total_gastado = Pedido.objects.filter(
-                cliente=cliente,
-                estado__in=['pagado', 'en_preparacion', 'enviado', 'entregado']
-            ).aggregate(total=Sum('total'))['total'] or 0
-
+        for cliente in clientes[:50]:
             resultados.append({
                 'id': cliente.id,
                 'user': {
@@ -4201,8 +4882,8 @@ def buscar_clientes(request):
                 'telefono': getattr(cliente, 'telefono', None),  # Campo opcional
                 'fecha_nacimiento': cliente.fecha_nacimiento.isoformat() if cliente.fecha_nacimiento else None,
                 'estadisticas': {
-                    'total_pedidos': pedidos_count,
-                    'total_gastado': float(total_gastado)
+                    'total_pedidos': cliente.total_pedidos,
+                    'total_gastado': float(cliente.total_gastado or 0)
                 }
             })
 
@@ -4948,24 +5629,23 @@ def sugerencias_productos(request):
                 'mensaje': 'Ingrese al menos 2 caracteres'
             })
         
-        # Buscar en nombre, SKU y descripción
-        productos = Producto.objects.filter(
-            activo=True
-        ).filter(
-            Q(nombre__icontains=query) |
-            Q(sku__icontains=query) |
-            Q(descripcion__icontains=query)
-        )[:15]  # Limitar a 15 resultados
-        
-        sugerencias = []
-        for p in productos:
-            sugerencias.append({
-                'id': p.id,
-                'nombre': p.nombre,
-                'sku': p.sku,
-                'precio': float(p.precio) if p.precio else 0,
-                'categoria': p.categoria.nombre,
-            })
+        # Prefijos de nombre y SKU desde el índice en memoria (sin consultar la BD)
+        sugerencias = IndiceAutocompletado.sugerir(query, limite=15)
+        
+        # Sin coincidencias por prefijo: búsqueda tolerante a errores en la BD
+        if not sugerencias:
+            productos = BusquedaProductoService.buscar(
+                Producto.objects.filter(activo=True).select_related('categoria'),
+                query
+            )[:15]  # Limitar a 15 resultados
+            for p in productos:
+                sugerencias.append({
+                    'id': p.id,
+                    'nombre': p.nombre,
+                    'sku': p.sku,
+                    'precio': float(p.precio) if p.precio else 0,
+                    'categoria': p.categoria.nombre,
+                })
         
         return Response({
             'sugerencias': sugerencias,
@@ -5948,11 +6628,7 @@ def reportes_efectividad_promociones(request):
         
         # Reporte de productos con promoción
         ahora = timezone.now()
-        promociones_activas = PromocionProducto.objects.filter(
-            activa=True,
-            fecha_inicio__lte=ahora,
-            fecha_fin__gte=ahora
-        )
+        promociones_activas = PromocionProducto.objects.vigentes(ahora).select_related('producto')
         
         productos_con_promocion = []
         for promocion in promociones_activas:
@@ -6578,10 +7254,10 @@ def pos_buscar_producto(request):
     
     try:
         # Buscar por nombre o SKU
-        productos = Producto.objects.filter(
-            Q(nombre__icontains=query) | Q(sku__icontains=query),
-            activo=True
-        ).select_related('categoria')[:20]  # Limitar a 20 resultados
+        productos = BusquedaProductoService.buscar(
+            Producto.objects.filter(activo=True).select_related('categoria').con_precio_vigente(),
+            query
+        )[:20]  # Limitar a 20 resultados
         
         resultados = []
         for producto in productos:
@@ -6620,32 +7296,70 @@ def pos_buscar_producto(request):
 
 
 def _generar_numero_boleta():
-    """Genera un número de boleta correlativo único"""
-    from datetime import datetime
-    fecha_actual = datetime.now()
-    fecha_str = fecha_actual.strftime('%Y%m%d')
+    """Genera un número de boleta correlativo único (contador por día, ver boleta_service.py)"""
+    return NumeracionBoletaService.siguiente()
+
+
+def _cliente_venta_presencial():
+    """Cliente genérico "Venta Presencial" usado por las ventas POS sin cliente"""
+    try:
+        user_generico = User.objects.get(email='venta_presencial@elixir.com')
+        return Cliente.objects.get(user=user_generico)
+    except (User.DoesNotExist, Cliente.DoesNotExist):
+        # Crear usuario asociado
+        user_generico = User.objects.create_user(
+            username=f'venta_presencial_{int(timezone.now().timestamp())}',
+            email='venta_presencial@elixir.com',
+            password=secrets.token_urlsafe(32)
+        )
+        return Cliente.objects.create(
+            user=user_generico,
+            rol='cliente'
+        )
+
+
+@api_view(['POST'])
+def pos_reservar_boletas(request):
+    """Reserva un bloque de números de boleta para un terminal POS"""
+    usuario_id = request.data.get('usuario_id')
     
-    # Buscar el último número de boleta del día
-    ultimo_pedido = Pedido.objects.filter(
-        numero_pedido__startswith=f'BOL-{fecha_str}'
-    ).order_by('-numero_pedido').first()
+    if not usuario_id:
+        return Response({
+            'success': False,
+            'message': 'usuario_id es requerido'
+        }, status=status.HTTP_400_BAD_REQUEST)
     
-    if ultimo_pedido:
-        # Extraer el número secuencial
-        try:
-            ultimo_numero = int(ultimo_pedido.numero_pedido.split('-')[-1])
-            nuevo_numero = ultimo_numero + 1
-        except:
-            nuevo_numero = 1
-    else:
-        nuevo_numero = 1
+    try:
+        user = User.objects.get(id=usuario_id)
+    except User.DoesNotExist:
+        return Response({
+            'success': False,
+            'message': 'Usuario no encontrado'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    # Verificar permisos
+    if not _verificar_permisos_pos(user):
+        return Response({
+            'success': False,
+            'message': 'Acceso denegado. Solo vendedores, gerentes y administradores pueden usar el POS.'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    try:
+        numeros = NumeracionBoletaService.reservar(int(request.data.get('cantidad', 10)))
+    except ValueError as e:
+        return Response({
+            'success': False,
+            'message': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
     
-    # Formato: BOL-YYYYMMDD-XXXX
-    numero_boleta = f'BOL-{fecha_str}-{str(nuevo_numero).zfill(4)}'
-    return numero_boleta
+    return Response({
+        'success': True,
+        'numeros': numeros
+    }, status=status.HTTP_201_CREATED)
 
 
 @api_view(['POST'])
+@idempotente('pos_crear_venta')
 def pos_crear_venta(request):
     """Crear venta rápida desde POS"""
     usuario_id = request.data.get('usuario_id')
@@ -6692,21 +7406,7 @@ def pos_crear_venta(request):
                     'message': 'Cliente no encontrado'
                 }, status=status.HTTP_404_NOT_FOUND)
         else:
-            # Crear cliente genérico "Venta Presencial" si no existe
-            try:
-                user_generico = User.objects.get(email='venta_presencial@elixir.com')
-                cliente = Cliente.objects.get(user=user_generico)
-            except (User.DoesNotExist, Cliente.DoesNotExist):
-                # Crear usuario asociado
-                user_generico = User.objects.create_user(
-                    username=f'venta_presencial_{int(timezone.now().timestamp())}',
-                    email='venta_presencial@elixir.com',
-                    password=secrets.token_urlsafe(32)
-                )
-                cliente = Cliente.objects.create(
-                    user=user_generico,
-                    rol='cliente'
-                )
+            cliente = _cliente_venta_presencial()
         
         # Obtener vendedor
         try:
@@ -6721,17 +7421,29 @@ def pos_crear_venta(request):
         from decimal import Decimal
         subtotal = Decimal('0.00')
         items_validos = []
+
+        try:
+            productos = Producto.objects.filter(
+                id__in=[item['producto_id'] for item in items]
+            ).con_precio_vigente().in_bulk()
+        except Exception as e:
+            return Response({
+                'success': False,
+                'message': f'Error procesando item: {str(e)}'
+            }, status=status.HTTP_400_BAD_REQUEST)
         
         for item in items:
             try:
-                producto = Producto.objects.get(id=item['producto_id'])
+                producto = productos.get(int(item['producto_id']))
+                if producto is None:
+                    raise Producto.DoesNotExist()
                 
-                # Verificar stock
+                # El stock se valida al descontarlo, con las filas bloqueadas
                 cantidad = int(item['cantidad'])
-                if cantidad > producto.stock:
+                if cantidad <= 0:
                     return Response({
                         'success': False,
-                        'message': f'Stock insuficiente para {producto.nombre}. Stock disponible: {producto.stock}'
+                        'message': f'Cantidad inválida para {producto.nombre}'
                     }, status=status.HTTP_400_BAD_REQUEST)
                 
                 # Aplicar promoción si existe
@@ -6757,50 +7469,72 @@ def pos_crear_venta(request):
                     'message': f'Error procesando item: {str(e)}'
                 }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Generar número de boleta
-        numero_boleta = _generar_numero_boleta()
-        
-        # Crear pedido
-        pedido = Pedido.objects.create(
-            cliente=cliente,
-            vendedor=vendedor,
-            numero_pedido=numero_boleta,
-            total=float(subtotal),
-            subtotal=float(subtotal),
-            impuesto=0,
-            descuento=0,
-            estado='pagado',  # Venta presencial se marca como pagada inmediatamente
-            metodo_pago=metodo_pago
-        )
-        
-        # Crear detalles del pedido
-        for item in items_validos:
-            DetallesPedido.objects.create(
-                pedido=pedido,
-                producto=item['producto'],
-                cantidad=item['cantidad'],
-                precio_unitario=item['precio_unitario'],
-                subtotal=item['subtotal']
-            )
-            
-            # Reducir stock
-            item['producto'].stock -= item['cantidad']
-            item['producto'].save()
+        # Número de boleta: uno reservado previamente por el terminal o el siguiente del día.
+        # Se toma antes de la transacción de la venta para no bloquear el contador durante ella
+        numero_boleta = request.data.get('numero_boleta')
+        if numero_boleta:
+            if not NumeracionBoletaService.es_reservado(numero_boleta):
+                return Response({
+                    'success': False,
+                    'message': f'El número de boleta {numero_boleta} no fue reservado'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            if Pedido.objects.filter(numero_pedido=numero_boleta).exists():
+                return Response({
+                    'success': False,
+                    'message': f'El número de boleta {numero_boleta} ya fue utilizado'
+                }, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            numero_boleta = _generar_numero_boleta()
         
-        # Registrar en log
         try:
-            LogSistema.objects.create(
-                nivel='INFO',
-                categoria='ventas',
-                mensaje=f'Venta POS creada: {numero_boleta} por {user.email}',
-                usuario=user,
-                ip_address=request.META.get('REMOTE_ADDR', ''),
-                user_agent=request.META.get('HTTP_USER_AGENT', ''),
-                modulo='views.pos',
-                funcion='pos_crear_venta'
-            )
-        except:
-            pass
+            with transaction.atomic():
+                # Crear pedido
+                pedido = Pedido.objects.create(
+                    cliente=cliente,
+                    vendedor=vendedor,
+                    numero_pedido=numero_boleta,
+                    total=float(subtotal),
+                    subtotal=float(subtotal),
+                    impuesto=0,
+                    descuento=0,
+                    estado='pagado',  # Venta presencial se marca como pagada inmediatamente
+                    metodo_pago=metodo_pago
+                )
+                
+                # Crear detalles del pedido
+                for item in items_validos:
+                    DetallesPedido.objects.create(
+                        pedido=pedido,
+                        producto=item['producto'],
+                        cantidad=item['cantidad'],
+                        precio_unitario=item['precio_unitario'],
+                        subtotal=item['subtotal']
+                    )
+                
+                # Reducir stock de todas las líneas (bloqueo en orden de id + un solo UPDATE)
+                StockService.descontar(
+                    ((item['producto'].id, item['cantidad']) for item in items_validos),
+                    tipo='venta_pos', pedido=pedido, usuario=user
+                )
+
+                # Registrar en log (vía outbox, fuera del request)
+                OutboxService.guardar(OutboxService.registrar(
+                    'log_sistema',
+                    nivel='INFO',
+                    categoria='ventas',
+                    mensaje=f'Venta POS creada: {numero_boleta} por {user.email}',
+                    usuario_id=user.id,
+                    ip_address=request.META.get('REMOTE_ADDR', ''),
+                    user_agent=request.META.get('HTTP_USER_AGENT', ''),
+                    modulo='views.pos',
+                    funcion='pos_crear_venta'
+                ))
+        except StockInsuficiente as e:
+            return Response({
+                'success': False,
+                'message': str(e),
+                'faltantes': e.faltantes
+            }, status=status.HTTP_400_BAD_REQUEST)
         
         return Response({
             'success': True,
@@ -6821,6 +7555,324 @@ def pos_crear_venta(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+# Máximo de ventas por llamado a pos_ventas_lote
+POS_VENTAS_LOTE_MAX = 500
+
+
+def _leer_venta_offline(venta):
+    """Valida una venta del lote offline y la normaliza; lanza ValueError con el motivo"""
+    if not isinstance(venta, dict):
+        raise ValueError('Formato de venta inválido')
+
+    items = venta.get('items')
+    if not isinstance(items, list) or not items:
+        raise ValueError('Debe agregar al menos un producto')
+    lineas = []
+    for item in items:
+        try:
+            producto_id = int(item['producto_id'])
+            cantidad = int(item['cantidad'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('Cada item requiere producto_id y cantidad numéricos')
+        if cantidad <= 0:
+            raise ValueError(f'Cantidad inválida para el producto {producto_id}')
+        lineas.append((producto_id, cantidad))
+
+    metodo_pago = venta.get('metodo_pago') or 'efectivo'
+    if metodo_pago not in dict(Pedido._meta.get_field('metodo_pago').choices):
+        raise ValueError(f'Método de pago inválido: {metodo_pago}')
+
+    fecha = timezone.now()
+    if venta.get('fecha'):
+        fecha = parse_datetime(str(venta['fecha']))
+        if fecha is None:
+            raise ValueError('fecha inválida, se espera ISO 8601')
+        if timezone.is_naive(fecha):
+            fecha = timezone.make_aware(fecha)
+
+    cliente_id = venta.get('cliente_id')
+    if cliente_id:
+        try:
+            cliente_id = int(cliente_id)
+        except (TypeError, ValueError):
+            raise ValueError('cliente_id inválido')
+
+    return {
+        'lineas': lineas,
+        'metodo_pago': metodo_pago,
+        'fecha': fecha,
+        'cliente_id': cliente_id or None,
+        'numero_boleta': venta.get('numero_boleta') or None,
+    }
+
+
+@api_view(['POST'])
+@idempotente('pos_ventas_lote')
+def pos_ventas_lote(request):
+    """
+    Sincroniza las ventas capturadas sin conexión por un terminal POS.
+
+    Recibe {'usuario_id', 'ventas': [{'id_local', 'fecha', 'items', 'metodo_pago',
+    'cliente_id', 'numero_boleta'}]} y retorna un resultado por venta. Las ventas
+    cuyo id_local ya se sincronizó se informan como duplicadas, por lo que el
+    terminal puede reenviar el lote completo sin riesgo. El stock se valida para
+    todo el lote en una pasada (las ventas más antiguas tienen prioridad) y los
+    pedidos y detalles se insertan con bulk_create.
+    """
+    usuario_id = request.data.get('usuario_id')
+    ventas = request.data.get('ventas')
+
+    if not usuario_id:
+        return Response({
+            'success': False,
+            'message': 'usuario_id es requerido'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    if not isinstance(ventas, list) or not ventas:
+        return Response({
+            'success': False,
+            'message': 'ventas debe ser una lista con al menos una venta'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    if len(ventas) > POS_VENTAS_LOTE_MAX:
+        return Response({
+            'success': False,
+            'message': f'Se permiten como máximo {POS_VENTAS_LOTE_MAX} ventas por lote'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        user = User.objects.get(id=usuario_id)
+    except User.DoesNotExist:
+        return Response({
+            'success': False,
+            'message': 'Usuario no encontrado'
+        }, status=status.HTTP_404_NOT_FOUND)
+
+    # Verificar permisos
+    if not _verificar_permisos_pos(user):
+        return Response({
+            'success': False,
+            'message': 'Acceso denegado. Solo vendedores, gerentes y administradores pueden usar el POS.'
+        }, status=status.HTTP_403_FORBIDDEN)
+
+    try:
+        vendedor = Cliente.objects.get(user=user)
+    except Cliente.DoesNotExist:
+        return Response({
+            'success': False,
+            'message': 'Usuario no es un vendedor válido'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    resultados = [None] * len(ventas)
+
+    def rechazar(indice, id_local, mensaje, **extra):
+        resultados[indice] = {'id_local': id_local, 'success': False, 'message': mensaje, **extra}
+
+    # Validación de formato, sin consultas
+    pendientes = {}
+    ids_locales = set()
+    for indice, venta in enumerate(ventas):
+        id_local = str(venta.get('id_local') or '').strip() if isinstance(venta, dict) else ''
+        if not id_local or len(id_local) > 64:
+            rechazar(indice, id_local or None, 'id_local es requerido (máximo 64 caracteres)')
+            continue
+        if id_local in ids_locales:
+            rechazar(indice, id_local, 'id_local repetido dentro del lote')
+            continue
+        ids_locales.add(id_local)
+        try:
+            pendientes[indice] = {'id_local': id_local, **_leer_venta_offline(venta)}
+        except ValueError as e:
+            rechazar(indice, id_local, str(e))
+
+    # Ventas ya sincronizadas en un envío anterior
+    existentes = {
+        fila['id_externo']: fila
+        for fila in Pedido.objects.filter(
+            id_externo__in=[p['id_local'] for p in pendientes.values()]
+        ).values('id_externo', 'id', 'numero_pedido', 'total')
+    }
+    for indice, pendiente in list(pendientes.items()):
+        fila = existentes.get(pendiente['id_local'])
+        if fila:
+            resultados[indice] = {
+                'id_local': pendiente['id_local'],
+                'success': True,
+                'duplicada': True,
+                'pedido_id': fila['id'],
+                'numero_boleta': fila['numero_pedido'],
+                'total': float(fila['total']),
+            }
+            del pendientes[indice]
+
+    # Productos, clientes y boletas reservadas de todo el lote. Las ventas se cobraron
+    # con las promociones vigentes al capturarlas, no con las de la sincronización
+    productos = Producto.objects.filter(
+        id__in={producto_id for p in pendientes.values() for producto_id, _ in p['lineas']}
+    )
+    fechas_captura = [p['fecha'] for p in pendientes.values()]
+    if fechas_captura:
+        productos = productos.con_promociones_entre(min(fechas_captura), max(fechas_captura))
+    productos = productos.in_bulk()
+    clientes = Cliente.objects.in_bulk(
+        {p['cliente_id'] for p in pendientes.values() if p['cliente_id']}
+    )
+    numeros_propuestos = [p['numero_boleta'] for p in pendientes.values() if p['numero_boleta']]
+    numeros_reservados = NumeracionBoletaService.reservados(numeros_propuestos)
+    numeros_usados = set(
+        Pedido.objects.filter(numero_pedido__in=numeros_propuestos).values_list('numero_pedido', flat=True)
+    )
+
+    cliente_generico = None
+    for indice, pendiente in list(pendientes.items()):
+        id_local = pendiente['id_local']
+        no_encontrados = [producto_id for producto_id, _ in pendiente['lineas'] if producto_id not in productos]
+        numero_boleta = pendiente['numero_boleta']
+        if no_encontrados:
+            rechazar(indice, id_local, f"Productos no encontrados: {', '.join(map(str, no_encontrados))}")
+        elif pendiente['cliente_id'] and pendiente['cliente_id'] not in clientes:
+            rechazar(indice, id_local, 'Cliente no encontrado')
+        elif numero_boleta and numero_boleta not in numeros_reservados:
+            rechazar(indice, id_local, f'El número de boleta {numero_boleta} no fue reservado')
+        elif numero_boleta and numero_boleta in numeros_usados:
+            rechazar(indice, id_local, f'El número de boleta {numero_boleta} ya fue utilizado')
+        else:
+            if numero_boleta:
+                numeros_usados.add(numero_boleta)
+            if pendiente['cliente_id']:
+                pendiente['cliente'] = clientes[pendiente['cliente_id']]
+            else:
+                if cliente_generico is None:
+                    cliente_generico = _cliente_venta_presencial()
+                pendiente['cliente'] = cliente_generico
+            continue
+        del pendientes[indice]
+
+    # Las ventas más antiguas tienen prioridad sobre el stock disponible
+    orden = sorted(pendientes, key=lambda indice: (pendientes[indice]['fecha'], indice))
+
+    # Correlativos del día de la venta, reservados antes de la transacción del lote:
+    # cada reserva bloquea el contador solo durante su propio incremento, así las
+    # ventas POS en línea no esperan a que termine la sincronización. Las ventas
+    # rechazadas por stock dejan su número sin usar (igual que pos_reservar_boletas).
+    sin_numero = {}
+    for indice in orden:
+        if not pendientes[indice]['numero_boleta']:
+            fecha_local = timezone.localtime(pendientes[indice]['fecha']).date()
+            sin_numero.setdefault(fecha_local, []).append(indice)
+    for fecha_local, indices in sin_numero.items():
+        numeros = []
+        for inicio in range(0, len(indices), BLOQUE_MAXIMO):
+            numeros += NumeracionBoletaService.reservar(
+                len(indices[inicio:inicio + BLOQUE_MAXIMO]), fecha_local
+            )
+        for indice, numero_boleta in zip(indices, numeros):
+            pendientes[indice]['numero_boleta'] = numero_boleta
+
+    try:
+        with transaction.atomic():
+            aceptadas, sin_stock = StockService.asignar(
+                (indice, pendientes[indice]['lineas']) for indice in orden
+            )
+            for indice, faltantes in sin_stock.items():
+                rechazar(
+                    indice, pendientes[indice]['id_local'],
+                    str(StockInsuficiente(faltantes)), faltantes=faltantes
+                )
+
+            pedidos = []
+            detalles = []
+            for indice in aceptadas:
+                pendiente = pendientes[indice]
+                cantidades = StockService.consolidar(pendiente['lineas'])
+                lineas = []
+                subtotal = Decimal('0.00')
+                for producto_id, cantidad in cantidades.items():
+                    precio_final = productos[producto_id].precio_con_descuento(pendiente['fecha'])
+                    subtotal_item = precio_final * cantidad
+                    subtotal += subtotal_item
+                    lineas.append((producto_id, cantidad, precio_final, subtotal_item))
+
+                pedidos.append(Pedido(
+                    cliente=pendiente['cliente'],
+                    vendedor=vendedor,
+                    numero_pedido=pendiente['numero_boleta'],
+                    total=subtotal,
+                    subtotal=subtotal,
+                    impuesto=0,
+                    descuento=0,
+                    estado='pagado',  # Venta presencial se marca como pagada inmediatamente
+                    metodo_pago=pendiente['metodo_pago'],
+                    id_externo=pendiente['id_local'],
+                    fecha_captura=pendiente['fecha']
+                ))
+                detalles.append(lineas)
+
+            Pedido.objects.bulk_create(pedidos)
+            StockService.registrar_movimientos([
+                movimiento
+                for pedido, lineas in zip(pedidos, detalles)
+                for movimiento in StockService.movimientos_salida(
+                    {producto_id: cantidad for producto_id, cantidad, _, _ in lineas},
+                    'venta_pos', pedido=pedido, usuario=user
+                )
+            ])
+            DetallesPedido.objects.bulk_create([
+                DetallesPedido(
+                    pedido=pedido,
+                    producto_id=producto_id,
+                    cantidad=cantidad,
+                    precio_unitario=precio_final,
+                    subtotal=subtotal_item
+                )
+                for pedido, lineas in zip(pedidos, detalles)
+                for producto_id, cantidad, precio_final, subtotal_item in lineas
+            ])
+
+            for indice, pedido in zip(aceptadas, pedidos):
+                resultados[indice] = {
+                    'id_local': pedido.id_externo,
+                    'success': True,
+                    'duplicada': False,
+                    'pedido_id': pedido.id,
+                    'numero_boleta': pedido.numero_pedido,
+                    'total': float(pedido.total),
+                }
+
+            if pedidos:
+                # Registrar en log (vía outbox, fuera del request)
+                OutboxService.guardar(OutboxService.registrar(
+                    'log_sistema',
+                    nivel='INFO',
+                    categoria='ventas',
+                    mensaje=f'Lote POS sincronizado: {len(pedidos)} ventas por {user.email}',
+                    usuario_id=user.id,
+                    datos_extra={'numeros_boleta': [pedido.numero_pedido for pedido in pedidos]},
+                    ip_address=request.META.get('REMOTE_ADDR', ''),
+                    user_agent=request.META.get('HTTP_USER_AGENT', ''),
+                    modulo='views.pos',
+                    funcion='pos_ventas_lote'
+                ))
+    except IntegrityError:
+        # Otro envío del mismo terminal sincronizó alguna de estas ventas en paralelo
+        return Response({
+            'success': False,
+            'message': 'Algunas ventas del lote se están sincronizando en otro envío, reintenta'
+        }, status=status.HTTP_409_CONFLICT)
+
+    return Response({
+        'success': True,
+        'message': 'Lote sincronizado',
+        'resumen': {
+            'recibidas': len(ventas),
+            'creadas': sum(1 for r in resultados if r['success'] and not r['duplicada']),
+            'duplicadas': sum(1 for r in resultados if r['success'] and r['duplicada']),
+            'rechazadas': sum(1 for r in resultados if not r['success']),
+        },
+        'resultados': resultados
+    }, status=status.HTTP_200_OK)
+
+
 @api_view(['GET'])
 def pos_cierre_caja(request):
     """Cierre de caja diario con resumen de ventas"""
@@ -6960,7 +8012,21 @@ def obtener_recomendaciones(request):
     limite = int(request.query_params.get('limite', 12))
     producto_id = request.query_params.get('producto_id', None)  # Para productos relacionados
     tipo = request.query_params.get('tipo', 'personalizado')  # 'personalizado' o 'vendidos_semana'
-    
+
+    from .serializers import ProductoSerializer
+    campos, error = _campos_solicitados(request, ProductoSerializer.Meta.fields)
+    if error:
+        return Response({
+            'success': False,
+            'message': error
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    def optimizar(queryset):
+        # Con ?fields= solo se traen las columnas pedidas, más precio y categoría que usa el armado de recomendaciones
+        if campos:
+            return ProductoSerializer.optimizar_queryset(queryset, campos + ['precio', 'categoria'])
+        return queryset
+
     try:
         from django.db.models import Count, Sum, F
         from collections import Counter
@@ -6978,7 +8044,7 @@ def obtener_recomendaciones(request):
             
             productos_por_categoria = []
             for categoria in categorias:
-                productos_cat = Producto.objects.filter(
+                productos_cat = optimizar(Producto.objects.filter(
                     categoria=categoria,
                     activo=True
                 ).annotate(
@@ -6986,15 +8052,15 @@ def obtener_recomendaciones(request):
                     veces_vendido=Count('detallespedido__id')
                 ).filter(
                     total_vendido__gt=0
-                ).order_by('-total_vendido', '-veces_vendido')[:3]  # Top 3 por categoría
+                ).select_related('categoria', 'creador').con_precio_vigente()).order_by('-total_vendido', '-veces_vendido')[:3]  # Top 3 por categoría
                 
                 productos_por_categoria.extend(productos_cat)
             
             # Si no hay productos vendidos, obtener productos activos de diferentes categorías
             if not productos_por_categoria:
-                productos_por_categoria = Producto.objects.filter(
+                productos_por_categoria = optimizar(Producto.objects.filter(
                     activo=True
-                ).select_related('categoria').order_by('?')[:limite]  # Aleatorio para diversidad
+                ).select_related('categoria', 'creador').con_precio_vigente()).order_by('?')[:limite]  # Aleatorio para diversidad
             
             # Agregar productos de diferentes categorías
             categorias_agregadas = set()
@@ -7029,13 +8095,13 @@ def obtener_recomendaciones(request):
             
             # Si aún no hay suficientes, agregar productos populares de cualquier categoría
             if len(recomendaciones) < limite:
-                productos_populares = Producto.objects.filter(
+                productos_populares = optimizar(Producto.objects.filter(
                     activo=True
                 ).exclude(
                     id__in=productos_excluidos
                 ).annotate(
                     veces_vendido=Count('detallespedido__id')
-                ).order_by('-veces_vendido', '-fecha_creacion')[:limite]
+                ).select_related('categoria', 'creador').con_precio_vigente()).order_by('-veces_vendido', '-fecha_creacion')[:limite]
                 
                 for producto in productos_populares:
                     if len(recomendaciones) >= limite:
@@ -7086,14 +8152,14 @@ def obtener_recomendaciones(request):
                 ).values_list('categoria_id', flat=True).distinct()
                 
                 # 3. Productos de las mismas categorías (excluyendo ya comprados)
-                productos_misma_categoria = Producto.objects.filter(
+                productos_misma_categoria = optimizar(Producto.objects.filter(
                     categoria_id__in=categorias_interes,
                     activo=True
                 ).exclude(
                     id__in=productos_excluidos
                 ).annotate(
                     veces_vendido=Count('detallespedido__id')
-                ).order_by('-veces_vendido', '-fecha_creacion')[:limite]
+                ).select_related('categoria', 'creador').con_precio_vigente()).order_by('-veces_vendido', '-fecha_creacion')[:limite]
                 
                 # Agregar a recomendaciones con score
                 for producto in productos_misma_categoria:
@@ -7117,7 +8183,7 @@ def obtener_recomendaciones(request):
                 # 4. Productos frecuentemente comprados juntos (cross-selling)
                 # Buscar pedidos que contengan productos comprados por el usuario
                 pedidos_con_productos_similares = Pedido.objects.filter(
-                    detallespedido__producto_id__in=productos_comprados_ids
+                    detalles__producto_id__in=productos_comprados_ids
                 ).exclude(cliente=cliente).distinct()
                 
                 productos_juntos = DetallesPedido.objects.filter(
@@ -7129,10 +8195,10 @@ def obtener_recomendaciones(request):
                 ).order_by('-veces_comprado_junto')[:limite]
                 
                 productos_juntos_ids = [p['producto_id'] for p in productos_juntos]
-                productos_juntos_objs = Producto.objects.filter(
+                productos_juntos_objs = optimizar(Producto.objects.filter(
                     id__in=productos_juntos_ids,
                     activo=True
-                )
+                ).select_related('categoria', 'creador').con_precio_vigente())
                 
                 for producto in productos_juntos_objs:
                     # Verificar si ya está en recomendaciones
@@ -7157,7 +8223,7 @@ def obtener_recomendaciones(request):
                         })
                 
                 # 5. Productos más vendidos de categorías de interés
-                productos_populares = Producto.objects.filter(
+                productos_populares = optimizar(Producto.objects.filter(
                     categoria_id__in=categorias_interes,
                     activo=True
                 ).exclude(
@@ -7166,7 +8232,7 @@ def obtener_recomendaciones(request):
                     total_vendido=Sum('detallespedido__cantidad')
                 ).filter(
                     total_vendido__gt=0
-                ).order_by('-total_vendido', '-fecha_creacion')[:limite]
+                ).select_related('categoria', 'creador').con_precio_vigente()).order_by('-total_vendido', '-fecha_creacion')[:limite]
                 
                 for producto in productos_populares:
                     ya_recomendado = any(r['producto'].id == producto.id for r in recomendaciones)
@@ -7196,13 +8262,13 @@ def obtener_recomendaciones(request):
         # agregar productos más vendidos en general
         if len(recomendaciones) < limite:
             # Primero intentar productos más vendidos
-            productos_generales = Producto.objects.filter(
+            productos_generales = optimizar(Producto.objects.filter(
                 activo=True
             ).exclude(
                 id__in=productos_excluidos
             ).annotate(
                 total_vendido=Sum('detallespedido__cantidad')
-            ).order_by('-total_vendido', '-fecha_creacion')[:limite * 2]
+            ).select_related('categoria', 'creador').con_precio_vigente()).order_by('-total_vendido', '-fecha_creacion')[:limite * 2]
             
             for producto in productos_generales:
                 ya_recomendado = any(r['producto'].id == producto.id for r in recomendaciones)
@@ -7226,11 +8292,11 @@ def obtener_recomendaciones(request):
             
             # Si aún no hay suficientes, agregar cualquier producto activo
             if len(recomendaciones) < limite:
-                productos_adicionales = Producto.objects.filter(
+                productos_adicionales = optimizar(Producto.objects.filter(
                     activo=True
                 ).exclude(
                     id__in=[r['producto'].id for r in recomendaciones]
-                ).order_by('-fecha_creacion')[:limite]
+                ).select_related('categoria', 'creador').con_precio_vigente()).order_by('-fecha_creacion')[:limite]
                 
                 for producto in productos_adicionales:
                     if len(recomendaciones) >= limite:
@@ -7257,10 +8323,9 @@ def obtener_recomendaciones(request):
         recomendaciones = recomendaciones[:limite]
         
         # Serializar productos
-        from .serializers import ProductoSerializer
         productos_recomendados = []
         for rec in recomendaciones:
-            producto_data = ProductoSerializer(rec['producto']).data
+            producto_data = ProductoSerializer(rec['producto'], fields=campos).data
             producto_data['razon_recomendacion'] = rec['razon']
             productos_recomendados.append(producto_data)
         
@@ -7282,6 +8347,14 @@ def productos_relacionados(request, producto_id):
     """Obtener productos relacionados a un producto específico"""
     usuario_id = request.query_params.get('usuario_id', None)
     limite = int(request.query_params.get('limite', 6))
+
+    from .serializers import ProductoSerializer
+    campos, error = _campos_solicitados(request, ProductoSerializer.Meta.fields)
+    if error:
+        return Response({
+            'success': False,
+            'message': error
+        }, status=status.HTTP_400_BAD_REQUEST)
     
     try:
         producto = Producto.objects.get(id=producto_id, activo=True)
@@ -7292,11 +8365,14 @@ def productos_relacionados(request, producto_id):
             activo=True
         ).exclude(id=producto_id).annotate(
             veces_vendido=Count('detallespedido__id')
-        ).order_by('-veces_vendido', '-fecha_creacion')[:limite]
+        ).select_related('categoria', 'creador').con_precio_vigente().order_by('-veces_vendido', '-fecha_creacion')
+        if campos:
+            productos_categoria = ProductoSerializer.optimizar_queryset(productos_categoria, campos)
+        productos_categoria = productos_categoria[:limite]
         
         # 2. Productos frecuentemente comprados juntos
         pedidos_con_producto = Pedido.objects.filter(
-            detallespedido__producto=producto
+            detalles__producto=producto
         ).distinct()
         
         productos_juntos = DetallesPedido.objects.filter(
@@ -7311,7 +8387,9 @@ def productos_relacionados(request, producto_id):
         productos_juntos_objs = Producto.objects.filter(
             id__in=productos_juntos_ids,
             activo=True
-        )
+        ).select_related('categoria', 'creador').con_precio_vigente()
+        if campos:
+            productos_juntos_objs = ProductoSerializer.optimizar_queryset(productos_juntos_objs, campos)
         
         # Combinar y eliminar duplicados
         productos_relacionados = list(productos_categoria)
@@ -7323,8 +8401,7 @@ def productos_relacionados(request, producto_id):
         productos_relacionados = productos_relacionados[:limite]
         
         # Serializar
-        from .serializers import ProductoSerializer
-        productos_data = ProductoSerializer(productos_relacionados, many=True).data
+        productos_data = ProductoSerializer(productos_relacionados, many=True, fields=campos).data
         
         return Response({
             'success': True,
@@ -7596,8 +8673,8 @@ def obtener_regiones_comunas(request):
 def calcular_costo_envio(request):
     """Calcular el costo de envío según región y método"""
     try:
-        from .models import METODOS_ENVIO, COSTOS_ENVIO_BASE
         region = request.data.get('region')
+        comuna = request.data.get('comuna')
         metodo_envio = request.data.get('metodo_envio', 'estandar')
         monto_compra = float(request.data.get('monto_compra', 0))
         
@@ -7607,58 +8684,15 @@ def calcular_costo_envio(request):
                 'message': 'Región es requerida'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Validar método de envío
-        if metodo_envio not in dict(METODOS_ENVIO):
+        try:
+            envio = CostoEnvioService.calcular(region, metodo_envio, monto_compra, comuna)
+        except ValueError as e:
             return Response({
                 'success': False,
-                'message': 'Método de envío inválido'
+                'message': str(e)
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Retiro en tienda es gratis
-        if metodo_envio == 'retiro_tienda':
-            return Response({
-                'success': True,
-                'costo_envio': 0,
-                'metodo_envio': metodo_envio,
-                'metodo_envio_display': dict(METODOS_ENVIO)[metodo_envio],
-                'tiempo_estimado': 'Inmediato',
-                'mensaje': 'Retiro disponible en tienda física'
-            })
-        
-        # Obtener costo base según región
-        costo_base = COSTOS_ENVIO_BASE.get(region, {}).get(metodo_envio)
-        
-        if costo_base is None:
-            # Si no hay costo definido para la región, usar promedio
-            costos_regiones = [costos.get(metodo_envio, 0) for costos in COSTOS_ENVIO_BASE.values()]
-            costo_base = sum(costos_regiones) / len(costos_regiones) if costos_regiones else 5000
-        
-        # Descuento por compras mayores a $50,000 (10% descuento en envío)
-        descuento = 0
-        if monto_compra >= 50000:
-            descuento = costo_base * 0.1
-        # Descuento por compras mayores a $100,000 (envío gratis estándar)
-        elif monto_compra >= 100000 and metodo_envio == 'estandar':
-            costo_base = 0
-        
-        costo_final = max(0, costo_base - descuento)
-        
-        # Tiempo estimado según método
-        tiempos_estimados = {
-            'estandar': '3-5 días hábiles',
-            'express': '1-2 días hábiles'
-        }
-        
-        return Response({
-            'success': True,
-            'costo_envio': costo_final,
-            'costo_base': costo_base,
-            'descuento': descuento,
-            'metodo_envio': metodo_envio,
-            'metodo_envio_display': dict(METODOS_ENVIO)[metodo_envio],
-            'tiempo_estimado': tiempos_estimados.get(metodo_envio, '3-5 días'),
-            'region': region
-        })
+        return Response({'success': True, **envio})
     except Exception as e:
         return Response({
             'success': False,
@@ -7666,6 +8700,42 @@ def calcular_costo_envio(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['GET'])
+def cotizar_envio_direcciones(request):
+    """
+    Cotiza todos los métodos de envío para todas las direcciones del cliente
+    en un solo llamado, para que el checkout muestre todas las opciones.
+    Parámetros: usuario_id y monto_compra (opcional).
+    """
+    usuario_id = request.query_params.get('usuario_id')
+    if request.user and request.user.is_authenticated:
+        usuario_id = request.user.id
+
+    if not usuario_id:
+        return Response({
+            'success': False,
+            'message': 'Debe estar autenticado'
+        }, status=status.HTTP_401_UNAUTHORIZED)
+
+    try:
+        monto_compra = float(request.query_params.get('monto_compra', 0))
+    except ValueError:
+        return Response({
+            'success': False,
+            'message': 'monto_compra debe ser numérico'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    direcciones = DireccionEnvio.objects.filter(cliente__user_id=usuario_id).values(
+        'id', 'nombre', 'region', 'comuna', 'es_principal'
+    )
+
+    return Response({
+        'success': True,
+        'monto_compra': monto_compra,
+        'direcciones': CostoEnvioService.cotizar_direcciones(direcciones, monto_compra)
+    })
+
+
 @api_view(['GET'])
 def obtener_metodos_envio(request):
     """Obtener lista de métodos de envío disponibles"""